@@ -9,6 +9,8 @@ from controllers.user_controller import UserController
 from controllers.operation_controller import OperationController
 from controllers.notification_controller import NotificationController
 from controllers.radiograph_controller import RadiographController
+from controllers.health_controller import HealthController
+from controllers.model_controller import ModelController
 from routes.api_routes import register_routes
 from config.app_config import AppConfig
 
@@ -17,6 +19,9 @@ load_dotenv()
 def create_app():
     app = Flask(__name__)
 
+    # Rifiuta (413) le richieste troppo grandi prima di leggerne il corpo; il margine copre i campi del form
+    app.config['MAX_CONTENT_LENGTH'] = AppConfig.MAX_UPLOAD_BYTES + 1024 * 1024
+
     # Set Google Cloud credentials environment variable
     os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = AppConfig.GCS_CRED_PATH
 
@@ -36,7 +41,9 @@ def create_app():
         'user': UserController(managers),
         'operation': OperationController(managers),
         'notification': NotificationController(managers),
-        'radiograph': RadiographController(managers)
+        'radiograph': RadiographController(managers),
+        'health': HealthController(managers),
+        'model': ModelController(managers)
     }
 
     # Registra routes
@@ -44,7 +51,10 @@ def create_app():
 
     return app
 
-app = create_app()
+# I processi worker dell'inferenza (avviati con spawn) reimportano questo modulo
+# come __mp_main__: l'applicazione va creata solo nel processo principale
+if __name__ != '__mp_main__':
+    app = create_app()
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)), debug=True)
\ No newline at end of file
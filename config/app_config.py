@@ -34,4 +34,107 @@ class AppConfig:
     #SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD')
     
     # Model
-    MODEL_PATH = 'MODELLO/pesi.h5'
\ No newline at end of file
+    MODEL_PATH = 'MODELLO/pesi.h5'
+    # Cache locale del modello (None per scaricarlo in memoria a ogni avvio)
+    MODEL_CACHE_DIR = os.environ.get('MODEL_CACHE_DIR')
+    # Conversione una tantum in SavedModel, caricato agli avvii successivi
+    MODEL_CACHE_SAVEDMODEL = os.environ.get('MODEL_CACHE_SAVEDMODEL', 'False') == 'True'
+    # Le versioni precedenti del modello vengono eliminate dalla cache solo se inutilizzate da questo intervallo
+    MODEL_CACHE_PRUNE_GRACE_S = int(os.environ.get('MODEL_CACHE_PRUNE_GRACE_S', '3600'))
+    # Backend per la classificazione: 'keras', 'bf16', 'onnx' o 'tflite'
+    MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'keras')
+    # Percorso locale dell'artefatto esportato (richiesto dai backend 'onnx' e 'tflite')
+    MODEL_BACKEND_PATH = os.environ.get('MODEL_BACKEND_PATH')
+    MODEL_BACKEND_THREADS = int(os.environ.get('MODEL_BACKEND_THREADS', '0')) or None
+    MODEL_BACKGROUND_LOADING = os.environ.get('MODEL_BACKGROUND_LOADING', 'True') == 'True'
+    MODEL_RETRY_AFTER_S = int(os.environ.get('MODEL_RETRY_AFTER_S', '10'))
+    MODEL_JIT_COMPILE = os.environ.get('MODEL_JIT_COMPILE', 'False') == 'True'
+    MODEL_WARMUP_ENABLED = os.environ.get('MODEL_WARMUP_ENABLED', 'True') == 'True'
+    # Risoluzioni (altezza x larghezza) ammesse in input al modello, separate da virgola (es. '224x224').
+    # Di default (stringa vuota) il modello riceve la risoluzione nativa delle radiografie: il
+    # ridimensionamento cambia le predizioni e va abilitato dopo averne verificato l'effetto
+    # (tools.backend_parity, tools.rescore)
+    MODEL_INPUT_BUCKETS = [
+        tuple(int(v) for v in size.lower().split('x'))
+        for size in os.environ.get('MODEL_INPUT_BUCKETS', '').split(',')
+        if size.strip()
+    ]
+    # Risoluzione del preriscaldamento quando non sono configurati bucket di input
+    MODEL_WARMUP_SIZE = int(os.environ.get('MODEL_WARMUP_SIZE', '224'))
+
+    # Inference worker pool: numero di processi che eseguono l'inferenza (0 = nel processo Flask)
+    INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', '0'))
+
+    # Inference batching
+    INFERENCE_BATCHING_ENABLED = os.environ.get('INFERENCE_BATCHING_ENABLED', 'True') == 'True'
+    INFERENCE_MAX_BATCH_SIZE = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', '8'))
+    INFERENCE_MAX_WAIT_MS = float(os.environ.get('INFERENCE_MAX_WAIT_MS', '10'))
+    INFERENCE_RESULT_TIMEOUT_S = float(os.environ.get('INFERENCE_RESULT_TIMEOUT_S', '60'))
+
+    # Prediction cache (LRU in memoria, con livello opzionale su disco)
+    PREDICTION_CACHE_ENABLED = os.environ.get('PREDICTION_CACHE_ENABLED', 'True') == 'True'
+    PREDICTION_CACHE_MAX_ENTRIES = int(os.environ.get('PREDICTION_CACHE_MAX_ENTRIES', '256'))
+    PREDICTION_CACHE_DIR = os.environ.get('PREDICTION_CACHE_DIR')
+    PREDICTION_CACHE_DISK_MAX_ENTRIES = int(os.environ.get('PREDICTION_CACHE_DISK_MAX_ENTRIES', '4096'))
+
+    # Grad-CAM asincrona: /predict restituisce subito classe e fiducia, Grad-CAM e caricamenti in background
+    GRADCAM_ASYNC = os.environ.get('GRADCAM_ASYNC', 'False') == 'True'
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+    # Job accodati o in esecuzione oltre i quali /predict risponde 429 (ognuno trattiene l'immagine caricata)
+    JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', '32'))
+
+    # Codifica delle immagini salvate: 'png' (senza perdita), 'webp' o 'jpeg'.
+    # Gli originali già nel formato scelto sono salvati così come caricati.
+    ORIGINAL_IMAGE_FORMAT = os.environ.get('ORIGINAL_IMAGE_FORMAT', 'png')
+    ORIGINAL_PNG_COMPRESSION = int(os.environ.get('ORIGINAL_PNG_COMPRESSION', '6'))
+    GRADCAM_IMAGE_FORMAT = os.environ.get('GRADCAM_IMAGE_FORMAT', 'png')
+    GRADCAM_IMAGE_QUALITY = int(os.environ.get('GRADCAM_IMAGE_QUALITY', '85'))
+    GRADCAM_PNG_COMPRESSION = int(os.environ.get('GRADCAM_PNG_COMPRESSION', '1'))
+    ENCODER_WORKERS = int(os.environ.get('ENCODER_WORKERS', '2'))
+
+    # Ricaricamento a caldo del modello (endpoint di amministrazione disabilitato se il token non è impostato)
+    ADMIN_API_TOKEN = os.environ.get('ADMIN_API_TOKEN')
+    MODEL_DRAIN_TIMEOUT_S = float(os.environ.get('MODEL_DRAIN_TIMEOUT_S', '60'))
+
+    # Controllo di ammissione di /predict: richieste in elaborazione e in coda, oltre le quali si risponde 429.
+    # Se l'attesa in coda supera ADMISSION_LATENCY_TARGET_MS la Grad-CAM viene saltata (0 per disabilitare).
+    ADMISSION_MAX_CONCURRENCY = int(os.environ.get('ADMISSION_MAX_CONCURRENCY', '8'))
+    ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', '16'))
+    ADMISSION_LATENCY_TARGET_MS = float(os.environ.get('ADMISSION_LATENCY_TARGET_MS', '2000'))
+    ADMISSION_QUEUE_TIMEOUT_S = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT_S', '30'))
+    # Tempo di dimezzamento della media dell'attesa in coda quando non arrivano nuove richieste
+    ADMISSION_WAIT_HALF_LIFE_S = float(os.environ.get('ADMISSION_WAIT_HALF_LIFE_S', '5'))
+
+    # Limiti delle immagini caricate (/predict, /upload-to-dataset), verificati sull'intestazione prima della decodifica
+    MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(32 * 1024 * 1024)))
+    MAX_UPLOAD_PIXELS = int(os.environ.get('MAX_UPLOAD_PIXELS', str(40 * 1000 * 1000)))
+    # Livelli massimi di memoria per fase delle richieste di analisi (esposti in /api/inference/stats)
+    MEMORY_TRACKING_ENABLED = os.environ.get('MEMORY_TRACKING_ENABLED', 'True') == 'True'
+    MEMORY_TRACKING_HISTORY = int(os.environ.get('MEMORY_TRACKING_HISTORY', '50'))
+    # Intervallo di campionamento della RSS durante le fasi delle richieste
+    MEMORY_SAMPLE_INTERVAL_MS = float(os.environ.get('MEMORY_SAMPLE_INTERVAL_MS', '10'))
+
+    # Richieste concorrenti verso il bucket GCS (es. lettura degli info.txt in get_radiographs)
+    GCS_IO_WORKERS = int(os.environ.get('GCS_IO_WORKERS', '8'))
+
+    # URL di accesso ai file del bucket: firmati V4 (generati localmente, con scadenza) o, con
+    # GCS_PUBLIC_URLS, pubblici (i file vengono resi pubblici al caricamento, comportamento precedente)
+    GCS_PUBLIC_URLS = os.environ.get('GCS_PUBLIC_URLS', 'False') == 'True'
+    GCS_SIGNED_URL_TTL_S = int(os.environ.get('GCS_SIGNED_URL_TTL_S', '3600'))
+    GCS_SIGNED_URL_REFRESH_MARGIN_S = int(os.environ.get('GCS_SIGNED_URL_REFRESH_MARGIN_S', '300'))
+    GCS_SIGNED_URL_CACHE_SIZE = int(os.environ.get('GCS_SIGNED_URL_CACHE_SIZE', '10000'))
+
+    # Caricamenti paralleli dei file di una radiografia (upload_many): thread dedicati e tentativi
+    # ripetuti per singolo file dopo errori temporanei (5xx, 429, connessione), con attesa
+    # esponenziale a partire da GCS_UPLOAD_RETRY_BACKOFF_S
+    GCS_UPLOAD_WORKERS = int(os.environ.get('GCS_UPLOAD_WORKERS', '8'))
+    GCS_UPLOAD_RETRIES = int(os.environ.get('GCS_UPLOAD_RETRIES', '2'))
+    GCS_UPLOAD_RETRY_BACKOFF_S = float(os.environ.get('GCS_UPLOAD_RETRY_BACKOFF_S', '0.5'))
+
+    # Catalogo delle radiografie su Firestore: se abilitato, le radiografie non ancora importate
+    # (tools/backfill_radiograph_catalog.py) vengono lette dal bucket e unite all'elenco a ogni richiesta.
+    # Da abilitare solo finché il backfill non è stato eseguito
+    RADIOGRAPH_CATALOG_FALLBACK = os.environ.get('RADIOGRAPH_CATALOG_FALLBACK', 'False') == 'True'
+
+    # Dimensione dei blocchi letti dal bucket da /api/download-radiograph (memoria massima per download)
+    GCS_DOWNLOAD_CHUNK_BYTES = int(os.environ.get('GCS_DOWNLOAD_CHUNK_BYTES', str(1024 * 1024)))
\ No newline at end of file
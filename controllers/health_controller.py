@@ -0,0 +1,18 @@
+from flask import jsonify
+
+class HealthController:
+    def __init__(self, managers):
+        self.model_loader = managers['model_loader']
+
+    def liveness(self):
+        """
+        Indica che il processo è attivo (non dipende dal caricamento del modello).
+        """
+        return jsonify({"status": "alive"}), 200
+
+    def readiness(self):
+        """
+        Indica se il modello è caricato e pronto, con avanzamento e durata delle fasi di caricamento.
+        """
+        status = self.model_loader.get_status()
+        return jsonify(status), 200 if status['ready'] else 503
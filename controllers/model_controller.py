@@ -0,0 +1,68 @@
+from flask import jsonify
+import hmac
+from config.app_config import AppConfig
+
+class ModelController:
+    def __init__(self, managers):
+        self.model_loader = managers['model_loader']
+        self.gcs_manager = managers['gcs']
+
+    @staticmethod
+    def _check_admin(headers):
+        """
+        Verifica il token di amministrazione (header X-Admin-Token).
+
+        Returns:
+            Risposta di errore, o None se il token è valido.
+        """
+        if not AppConfig.ADMIN_API_TOKEN:
+            return jsonify({'error': 'Endpoint di amministrazione disabilitato'}), 403
+        token = headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(token.encode('utf-8'), AppConfig.ADMIN_API_TOKEN.encode('utf-8')):
+            return jsonify({'error': 'Token di amministrazione non valido'}), 401
+        return None
+
+    def reload_model(self, headers, data):
+        """
+        Avvia il ricaricamento a caldo del modello: il nuovo modello viene caricato e preriscaldato
+        accanto a quello in uso, che continua a servire le richieste fino alla sostituzione.
+        Senza 'force' il ricaricamento è saltato se la versione nel bucket non è cambiata.
+        """
+        error_response = self._check_admin(headers)
+        if error_response:
+            return error_response
+
+        try:
+            if not self.model_loader.is_ready():
+                return jsonify({'error': 'Il modello non è ancora pronto'}), 409
+
+            current_version = self.model_loader.get('model_version')
+            latest_version = self.gcs_manager.get_model_version(AppConfig.MODEL_PATH)
+            if latest_version == current_version and not data.get('force'):
+                return jsonify({
+                    'message': 'Il modello è già aggiornato',
+                    'model_version': current_version
+                }), 200
+
+            if not self.model_loader.reload(drain_timeout=AppConfig.MODEL_DRAIN_TIMEOUT_S):
+                return jsonify({
+                    'error': 'Ricaricamento già in corso',
+                    'reload': self.model_loader.get_status()['reload']
+                }), 409
+
+            return jsonify({
+                'message': 'Ricaricamento del modello avviato',
+                'from_version': current_version,
+                'status_url': '/api/admin/model/status'
+            }), 202
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    def get_model_status(self, headers):
+        """
+        Restituisce versione del modello in uso e stato dell'ultimo ricaricamento.
+        """
+        error_response = self._check_admin(headers)
+        if error_response:
+            return error_response
+        return jsonify(self.model_loader.get_status()), 200
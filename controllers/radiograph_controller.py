@@ -1,16 +1,172 @@
-from flask import jsonify, send_file
+from flask import jsonify, send_file, Response
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_etags, parse_if_range_header, parse_range_header, quote_etag
 import json
 import io
-import requests
 import uuid
-from datetime import datetime
-import cv2
+from datetime import datetime, timedelta, timezone
+from utils.firestore_utils import FirestoreManager, RADIOGRAPH_DATE_FORMAT
+from utils.prediction_cache import CachedPrediction
+from utils.image_encoding import EncodedImage
+from utils.admission_control import AdmissionRejectedException
+from utils.job_utils import JobQueueFullException
+from utils.image_header import validate_image_upload, ImageValidationException
+from utils.model_utils import ModelManager
+from config.app_config import AppConfig
+
+CLASS_LABELS = {
+    0: 'Classe 1: Normale',
+    1: 'Classe 2: Lieve osteoartrite',
+    2: 'Classe 3: Moderata osteoartrite',
+    3: 'Classe 4: Grave osteoartrite',
+    4: 'Classe 5: Avanzata osteoartrite'
+}
 
 class RadiographController:
     def __init__(self, managers):
         self.gcs_manager = managers['gcs']
-        self.model_manager = managers['model']
+        self.model_loader = managers['model_loader']
         self.firestore_manager = managers['firestore']
+        self.prediction_cache = managers.get('prediction_cache')
+        self.job_manager = managers['jobs']
+        self.image_encoder = managers['encoder']
+        self.admission = managers['admission']
+        self.memory_tracker = managers['memory']
+
+    def _model_not_ready(self):
+        """
+        Risposta 503 (con Retry-After) finché il modello non è pronto.
+        """
+        status = self.model_loader.get_status()
+        return jsonify({
+            'error': 'Il modello è in fase di caricamento, riprovare più tardi',
+            'retryable': status['stage'] != 'failed',
+            'model_status': status
+        }), 503, {'Retry-After': str(AppConfig.MODEL_RETRY_AFTER_S)}
+
+    @staticmethod
+    def _analyze(components, file, profile):
+        """
+        Esegue preprocessing, predizione e Grad-CAM: nel pool di processi se configurato,
+        altrimenti nel processo corrente (tramite lo scheduler di batching, se abilitato).
+        """
+        inference_pool = components['inference_pool']
+        if inference_pool is not None:
+            with profile.stage('inference'):
+                predicted_class, confidence, superimposed_img, _ = inference_pool.analyze(
+                    file, timeout=AppConfig.INFERENCE_RESULT_TIMEOUT_S
+                )
+            return predicted_class, confidence, superimposed_img
+
+        model_manager = components['model']
+        with profile.stage('preprocess'):
+            img_array, img_rgb = model_manager.preprocess_image(file)
+        with profile.stage('inference'):
+            if components['inference'] is not None:
+                predicted_class, confidence, heatmap, _ = components['inference'].predict_with_gradcam(img_array)
+            else:
+                predicted_class, confidence, heatmap, _ = model_manager.predict_with_gradcam(img_array)
+        with profile.stage('overlay'):
+            superimposed_img = model_manager.overlay_heatmap(heatmap, img_rgb)
+        return predicted_class, confidence, superimposed_img
+
+    @staticmethod
+    def _classify(components, file, profile):
+        """
+        Esegue soltanto preprocessing e classificazione, senza Grad-CAM (modalità degradata).
+        """
+        if components['inference_pool'] is not None:
+            with profile.stage('inference'):
+                return components['inference_pool'].classify(file, timeout=AppConfig.INFERENCE_RESULT_TIMEOUT_S)
+        model_manager = components['model']
+        with profile.stage('preprocess'):
+            img_array, _ = model_manager.preprocess_image(file, for_display=False)
+        with profile.stage('inference'):
+            return model_manager.predict_class(img_array)
+
+    def _analyze_all_classes(self, components, file, profile):
+        """
+        Esegue preprocessing e predizione calcolando le heatmap di tutte le classi in un solo passaggio;
+        la Grad-CAM restituita è quella della classe predetta.
+
+        Returns:
+            Tuple (classe, fiducia, Grad-CAM codificata, heatmap (num_classi, h, w), probabilità)
+        """
+        model_manager = components['model']
+        with profile.stage('preprocess'):
+            img_array, img = model_manager.preprocess_image(file)
+        with profile.stage('inference'):
+            predicted_class, confidence, heatmaps, probabilities = \
+                model_manager.predict_with_gradcam_all_classes(img_array)
+        with profile.stage('overlay'):
+            superimposed_img = model_manager.overlay_heatmap(heatmaps[predicted_class], img)
+        with profile.stage('encode'):
+            gradcam = self.image_encoder.encode('gradcam', superimposed_img)
+        return predicted_class, confidence, gradcam, heatmaps, probabilities
+
+    @staticmethod
+    def _validate_upload(file):
+        """
+        Verifica formato, dimensione e numero di pixel dell'immagine caricata leggendone solo l'intestazione.
+
+        Raises:
+            ImageValidationException: Se l'immagine non è valida o supera i limiti configurati.
+        """
+        return validate_image_upload(file, AppConfig.MAX_UPLOAD_BYTES, AppConfig.MAX_UPLOAD_PIXELS)
+
+    def _admission_rejected(self, error):
+        """
+        Risposta 429 (con Retry-After) quando la coda di inferenza è piena.
+        """
+        return jsonify({
+            'error': str(error),
+            'retryable': True,
+            'admission': self.admission.get_stats()
+        }), 429, {'Retry-After': str(error.retry_after)}
+
+    def _analyze_cached(self, components, file, profile):
+        """
+        Restituisce classe, fiducia e Grad-CAM codificata (EncodedImage), usando la cache dei risultati
+        (indicizzata dall'hash del file e dalla versione del modello) quando possibile.
+        """
+        model_version = components['model_version']
+        content_hash = None
+        if self.prediction_cache is not None:
+            content_hash = self.prediction_cache.hash_file(file)
+            cached = self.prediction_cache.get(content_hash, model_version)
+            if cached is not None:
+                gradcam = EncodedImage.from_bytes(cached.gradcam_image, cached.gradcam_format)
+                return cached.predicted_class, cached.confidence, gradcam
+
+        predicted_class, confidence, superimposed_img = self._analyze(components, file, profile)
+        with profile.stage('encode'):
+            gradcam = self.image_encoder.encode('gradcam', superimposed_img)
+
+        if self.prediction_cache is not None:
+            self.prediction_cache.put(
+                content_hash,
+                model_version,
+                CachedPrediction(int(predicted_class), float(confidence), gradcam.data, gradcam.format)
+            )
+        return predicted_class, confidence, gradcam
+
+    def get_inference_stats(self):
+        """
+        Restituisce le statistiche della coda di inferenza (profondità e dimensione dei batch),
+        del controllo di ammissione, della cache dei risultati, della codifica delle immagini salvate
+        e dei caricamenti su GCS.
+        """
+        inference_scheduler = self.model_loader.get('inference')
+        stats = {"batching_enabled": inference_scheduler is not None}
+        if inference_scheduler is not None:
+            stats.update(inference_scheduler.get_stats())
+        if self.prediction_cache is not None:
+            stats['prediction_cache'] = self.prediction_cache.get_stats()
+        stats['admission'] = self.admission.get_stats()
+        stats['image_encoding'] = self.image_encoder.get_stats()
+        stats['memory'] = self.memory_tracker.get_stats()
+        stats['uploads'] = self.gcs_manager.get_upload_stats()
+        return jsonify(stats), 200
 
     def get_patient_radiographs(self, patient_id):
         """
@@ -27,24 +183,56 @@ class RadiographController:
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
-    def download_radiograph(self, file_url, filename):
+    def download_radiograph(self, file_url, filename, headers=None):
         """
-        Consente il download di una radiografia dal sistema.
+        Consente il download di una radiografia dal sistema, leggendola dal bucket a blocchi.
+        Supporta le richieste condizionali (ETag dalla generazione del blob, If-None-Match)
+        e parziali (Range, If-Range); sono accettati solo URL di file del bucket.
         """
         try:
             if not file_url:
                 return jsonify({"error": "File URL is missing"}), 400
+            headers = headers or {}
+
+            blob_path = self.gcs_manager.blob_path_from_url(file_url)
+            if blob_path is None:
+                return jsonify({"error": "L'URL non riguarda un file del bucket"}), 400
+            blob = self.gcs_manager.get_blob(blob_path)
+            if blob is None:
+                return jsonify({"error": "Radiografia non trovata"}), 404
 
-            response = requests.get(file_url)
-            if response.status_code != 200:
-                return jsonify({"error": "Failed to fetch radiograph"}), 500
+            # La generazione cambia a ogni sovrascrittura del file
+            etag = str(blob.generation)
+            response_headers = Headers()
+            response_headers.set('ETag', quote_etag(etag))
+            response_headers.set('Accept-Ranges', 'bytes')
+            response_headers.set('Cache-Control', 'private')
 
-            file_stream = io.BytesIO(response.content)
-            return send_file(
-                file_stream,
-                mimetype='image/png',
-                as_attachment=True,
-                download_name=filename
+            if parse_etags(headers.get('If-None-Match')).contains_weak(etag):
+                return Response(status=304, headers=response_headers)
+
+            size = blob.size
+            start, stop, status = 0, size, 200
+            requested_range = parse_range_header(headers.get('Range'))
+            if_range = parse_if_range_header(headers.get('If-Range'))
+            # Con If-Range l'intervallo vale solo se il file non è cambiato; più intervalli: file intero
+            if_range_matches = if_range.etag == etag or (if_range.etag is None and if_range.date is None)
+            if requested_range is not None and if_range_matches and len(requested_range.ranges) == 1:
+                byte_range = requested_range.range_for_length(size)
+                if byte_range is None:
+                    response_headers.set('Content-Range', f"bytes */{size}")
+                    return Response(status=416, headers=response_headers)
+                start, stop, status = byte_range[0], byte_range[1], 206
+                response_headers.set('Content-Range', f"bytes {start}-{stop - 1}/{size}")
+
+            response_headers.set('Content-Length', str(stop - start))
+            response_headers.add('Content-Disposition', 'attachment', filename=filename)
+            return Response(
+                self.gcs_manager.iter_blob_range(blob, start, stop),
+                status=status,
+                headers=response_headers,
+                mimetype=blob.content_type or 'application/octet-stream',
+                direct_passthrough=True
             )
         except Exception as e:
             return jsonify({"error": str(e)}), 500
@@ -54,6 +242,8 @@ class RadiographController:
         Carica una radiografia nel dataset del paziente.
         """
         try:
+            self._validate_upload(file)
+
             patient_id = form_data.get('patientID')
             side = form_data.get('side', 'Unknown')
             file_name = f"{patient_id}_{side}_{file.filename}"
@@ -69,72 +259,185 @@ class RadiographController:
                 "message": "File caricato con successo.",
                 "url": url
             }), 200
+        except ImageValidationException as e:
+            return jsonify({"error": str(e)}), e.status_code
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
-    def get_radiographs(self, user_uid):
+    def get_radiographs(self, user_uid, filters=None):
         """
-        Restituisce le radiografie di un utente, incluse le immagini Grad-CAM.
+        Restituisce le radiografie di un utente, incluse le immagini Grad-CAM, dal catalogo su Firestore.
+        Filtri opzionali: doctorUid, predictedClass (indice della classe), dateFrom e dateTo (YYYY-MM-DD, inclusi).
         """
         try:
-            num_radiographs = self.gcs_manager.count_patient_radiographs(user_uid)
-            if num_radiographs == 0:
-                return jsonify([])
+            filters = filters or {}
+            try:
+                doctor_uid = filters.get('doctorUid') or None
+                predicted_class = int(filters['predictedClass']) if filters.get('predictedClass') else None
+                # Le date dei filtri sono giorni nell'ora locale del server, convertiti in UTC come uploadedAt
+                date_from = (
+                    datetime.strptime(filters['dateFrom'], '%Y-%m-%d').astimezone(timezone.utc)
+                    if filters.get('dateFrom') else None
+                )
+                date_to = (
+                    (datetime.strptime(filters['dateTo'], '%Y-%m-%d') + timedelta(days=1)).astimezone(timezone.utc)
+                    if filters.get('dateTo') else None
+                )
+            except ValueError:
+                return jsonify({'error': 'Filtri non validi: predictedClass deve essere un intero, le date nel formato YYYY-MM-DD'}), 400
+            filtered = any(value is not None for value in (doctor_uid, predicted_class, date_from, date_to))
 
+            records = self.firestore_manager.query_radiograph_records(
+                user_uid, doctor_uid=doctor_uid, predicted_class=predicted_class,
+                date_from=date_from, date_to=date_to
+            )
+            if AppConfig.RADIOGRAPH_CATALOG_FALLBACK:
+                # Le radiografie caricate prima del catalogo (non ancora importate con
+                # tools/backfill_radiograph_catalog.py) vengono lette da info.txt e filtrate qui
+                bucket_records = self._uncataloged_records(user_uid, records if not filtered else None)
+                records = sorted(
+                    records + [
+                        record for record in bucket_records
+                        if self._record_matches(record, doctor_uid, predicted_class, date_from, date_to)
+                    ],
+                    key=lambda record: record['index']
+                )
+
+            # Gli URL (firmati localmente) non richiedono chiamate di rete per singolo file
             radiographs = []
-            for i in range(1, num_radiographs + 1):
-                try:
-                    original_blob = self.gcs_manager.bucket.blob(
-                        f"{user_uid}/Radiografia{i}/original_image{i}.png"
+            for record in records:
+                # La Grad-CAM manca se è stata saltata per sovraccarico
+                gradcam_path = record.get('gradcamImagePath')
+                radiograph = {
+                    'original_image': self.gcs_manager.get_url(record['originalImagePath']),
+                    'gradcam_image': self.gcs_manager.get_url(gradcam_path) if gradcam_path else None,
+                    'info_txt': None,
+                    'radiograph_id': record.get('radiographId', ''),
+                    'gradcam_status': 'ready' if gradcam_path else 'skipped'
+                }
+                if record.get('heatmapsPath'):
+                    radiograph['class_gradcam_urls'] = self._class_gradcam_urls(
+                        user_uid, record['index'], len(CLASS_LABELS)
                     )
-                    gradcam_blob = self.gcs_manager.bucket.blob(
-                        f"{user_uid}/Radiografia{i}/gradcam_image{i}.png"
-                    )
-                    
-                    if not original_blob.exists() or not gradcam_blob.exists():
-                        continue
-
-                    original_blob.make_public()
-                    gradcam_blob.make_public()
-
-                    info = self.gcs_manager.get_radiograph_info(user_uid, i)
-                    radiographs.append({
-                        'original_image': original_blob.public_url,
-                        'gradcam_image': gradcam_blob.public_url,
-                        'info_txt': None,
-                        'radiograph_id': info.get('ID radiografia', '')
-                    })
-                except Exception:
-                    continue
+                radiographs.append(radiograph)
 
+            # I job in corso non hanno ancora una scheda: compaiono solo nell'elenco non filtrato
+            if not filtered:
+                radiographs.extend(self._unfinished_radiographs(user_uid))
             return jsonify(radiographs)
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
+    def _uncataloged_records(self, user_uid, cataloged_records=None):
+        """
+        Schede (ricavate da info.txt) delle radiografie di un utente presenti nel bucket ma non nel catalogo.
+        Il bucket viene elencato per intero solo se manca qualche indice.
+
+        Args:
+            cataloged_records: Schede già lette dal catalogo senza filtri (None per leggerne gli indici).
+        """
+        folder_indices = set(self.gcs_manager.list_radiograph_indices(user_uid))
+        if cataloged_records is not None:
+            cataloged = {record['index'] for record in cataloged_records}
+        else:
+            cataloged = set(self.firestore_manager.list_radiograph_record_indices(user_uid))
+        # Le cartelle dei job in corso vengono registrate nel catalogo al termine del job
+        in_progress = {
+            job['radiograph_index'] for job in self.job_manager.find(patient_id=user_uid)
+            if job['status'] != 'done'
+        }
+        missing = folder_indices - cataloged - in_progress
+        if not missing:
+            return []
+
+        folders = {
+            index: blobs for index, blobs in self.gcs_manager.list_radiograph_folders(user_uid).items()
+            if index in missing and 'original_image' in blobs and 'info' in blobs
+        }
+        infos = self.gcs_manager.read_radiograph_infos(
+            {index: blobs['info'] for index, blobs in folders.items()}
+        )
+        return [
+            self.record_from_folder(user_uid, index, folders[index], info)
+            for index, info in infos.items()
+        ]
+
+    @staticmethod
+    def record_from_folder(patient_id, index, blobs, info):
+        """
+        Scheda del catalogo di una radiografia ricavata da info.txt e dai file della sua cartella
+        (usata anche da tools/backfill_radiograph_catalog.py).
+        """
+        record = FirestoreManager.radiograph_record_from_info(info, CLASS_LABELS)
+        # Paziente e indice sono quelli della cartella, anche se info.txt riporta valori diversi
+        record['patientId'] = patient_id
+        record['index'] = index
+        record['originalImagePath'] = blobs['original_image'].name
+        record['gradcamImagePath'] = blobs['gradcam_image'].name if 'gradcam_image' in blobs else None
+        record['heatmapsPath'] = blobs['heatmaps'].name if 'heatmaps' in blobs else None
+        if record['uploadedAt'] is None:
+            # info.txt senza data leggibile: si usa la data di creazione del file
+            record['uploadedAt'] = blobs['original_image'].time_created.replace(microsecond=0)
+        return record
+
+    @staticmethod
+    def _record_matches(record, doctor_uid, predicted_class, date_from, date_to):
+        """
+        Applica a una scheda gli stessi filtri della query sul catalogo.
+        """
+        uploaded_at = record.get('uploadedAt')
+        return (
+            (doctor_uid is None or record.get('doctorUid') == doctor_uid)
+            and (predicted_class is None or record.get('predictedClass') == predicted_class)
+            and (date_from is None or (uploaded_at is not None and uploaded_at >= date_from))
+            and (date_to is None or (uploaded_at is not None and uploaded_at < date_to))
+        )
+
+    def _unfinished_radiographs(self, user_uid):
+        """
+        Radiografie di un paziente i cui file sono ancora in elaborazione (o falliti) nei job in background.
+        """
+        return [{
+            'original_image': None,
+            'gradcam_image': None,
+            'info_txt': None,
+            'radiograph_id': job['radiograph_id'],
+            'gradcam_status': 'failed' if job['status'] == 'failed' else 'pending',
+            'job_id': job['job_id']
+        } for job in self.job_manager.find(patient_id=user_uid) if job['status'] != 'done']
+
     def get_radiographs_info(self, user_uid, idx):
         """
         Fornisce i dettagli di una specifica radiografia di un utente.
         """
         try:
-            info = self.gcs_manager.get_radiograph_info(user_uid, int(idx))
-            
+            record = self.firestore_manager.get_radiograph_record(user_uid, int(idx))
+            if record is None:
+                # Radiografia non ancora importata nel catalogo: si legge info.txt
+                record = self.firestore_manager.radiograph_record_from_info(
+                    self.gcs_manager.get_radiograph_info(user_uid, int(idx)), CLASS_LABELS
+                )
+
+            uploaded_at = record.get('uploadedAt')
+            confidence = record.get('confidence')
             radiograph_info = {
-                "name": info.get('Nome paziente', ''),
-                "surname": info.get('Cognome paziente', ''),
-                "birthdate": info.get('Data di nascita paziente', ''),
-                "tax_code": info.get('Codice fiscale paziente', ''),
-                "address": info.get('Indirizzo paziente', ''),
-                "cap_code": info.get('CAP paziente', ''),
-                "gender": info.get('Genere paziente', ''),
-                "userId": info.get('UID paziente', ''),
-                "radiograph_id": info.get('ID radiografia', ''),
-                "date": info.get('Data di caricamento', ''),
-                "prediction": info.get('Classe predetta', ''),
-                "side": info.get('Lato del ginocchio', ''),
-                "confidence": info.get('Confidenza', ''),
-                "doctorLoaded": info.get('Radiografia caricata da', ''),
-                "doctorUid": info.get('UID dottore', ''),
-                "doctorID": info.get('Codice identificativo dottore', '')
+                "name": record.get('patientName', ''),
+                "surname": record.get('patientSurname', ''),
+                "birthdate": record.get('patientBirthdate', ''),
+                "tax_code": record.get('patientTaxCode', ''),
+                "address": record.get('patientAddress', ''),
+                "cap_code": record.get('patientCapCode', ''),
+                "gender": record.get('patientGender', ''),
+                "userId": record.get('patientId', ''),
+                "radiograph_id": record.get('radiographId', ''),
+                "date": uploaded_at.astimezone().strftime(RADIOGRAPH_DATE_FORMAT) if uploaded_at else '',
+                "prediction": record.get('prediction', ''),
+                "side": record.get('side', ''),
+                "confidence": f"{confidence:.2f}" if confidence is not None else '',
+                "doctorLoaded": record.get('doctorName', ''),
+                "doctorUid": record.get('doctorUid', ''),
+                "doctorID": record.get('doctorID', ''),
+                "modelVersion": record.get('modelVersion') or ''
             }
             
             return jsonify(radiograph_info)
@@ -142,87 +445,368 @@ class RadiographController:
             return jsonify({'error': str(e)}), 500
         
 
+    def _next_radiograph_index(self, patient_uid):
+        """
+        Assegna l'indice della prossima cartella Radiografia{N} tramite il contatore transazionale
+        del paziente su Firestore; il bucket viene elencato solo per inizializzare il contatore.
+        """
+        return self.firestore_manager.allocate_radiograph_index(
+            patient_uid,
+            seed=lambda: self.gcs_manager.get_max_radiograph_index(patient_uid)
+        )
+
+    @staticmethod
+    def _build_radiograph_record(patient_uid, index, patient_info, doctor_data, radiograph_id,
+                                 predicted_class, knee_side, confidence, model_version):
+        """
+        Compone la scheda del catalogo di una radiografia (da cui viene generato anche info.txt);
+        i percorsi dei file vengono aggiunti dopo il caricamento.
+        """
+        return {
+            'patientId': patient_uid,
+            'index': index,
+            'patientName': patient_info['name'],
+            'patientSurname': patient_info['family_name'],
+            'patientBirthdate': patient_info['birthdate'],
+            'patientTaxCode': patient_info['tax_code'],
+            'patientAddress': patient_info['address'],
+            'patientCapCode': patient_info['cap_code'],
+            'patientGender': patient_info['gender'],
+            'radiographId': radiograph_id,
+            'uploadedAt': datetime.now(timezone.utc).replace(microsecond=0),
+            'prediction': CLASS_LABELS.get(int(predicted_class), 'Unknown class'),
+            'predictedClass': int(predicted_class),
+            'side': knee_side,
+            'confidence': float(confidence),
+            'doctorName': f"{doctor_data['name']} {doctor_data['family_name']}",
+            'doctorUid': doctor_data['uid'],
+            'doctorID': doctor_data['doctorID'],
+            'modelVersion': model_version
+        }
+
+    def _catalog_radiograph(self, record, original_format, gradcam_format, has_heatmaps):
+        """
+        Registra nel catalogo una radiografia i cui file sono stati caricati
+        (gradcam_format None se la Grad-CAM non è stata generata).
+        """
+        patient_uid, index = record['patientId'], record['index']
+        record['originalImagePath'] = self.gcs_manager.radiograph_blob_path(
+            patient_uid, index, 'original_image', original_format
+        )
+        record['gradcamImagePath'] = self.gcs_manager.radiograph_blob_path(
+            patient_uid, index, 'gradcam_image', gradcam_format
+        ) if gradcam_format is not None else None
+        record['heatmapsPath'] = self.gcs_manager.radiograph_blob_path(
+            patient_uid, index, 'heatmaps'
+        ) if has_heatmaps else None
+        self.firestore_manager.save_radiograph_record(record)
+
+    def _get_patient_info(self, patient_uid):
+        """
+        Recupera e verifica le informazioni del paziente necessarie per info.txt.
+
+        Returns:
+            Tuple (patient_info, risposta di errore o None)
+        """
+        patient_info = self.firestore_manager.get_patient_information(patient_uid)
+        if not patient_info:
+            return None, (jsonify({'error': 'Unable to retrieve patient information'}), 400)
+
+        # Verifica campi necessari
+        required_fields = ['name', 'family_name', 'birthdate', 'tax_code', 'address', 'cap_code', 'gender']
+        missing_fields = [field for field in required_fields if not patient_info.get(field)]
+        if missing_fields:
+            return None, (jsonify({'error': f'Missing patient information: {", ".join(missing_fields)}'}), 400)
+        return patient_info, None
+
     def predict(self, file, form_data):
         """
         Effettua una predizione sulla radiografia e genera un'immagine Grad-CAM.
+        Con GRADCAM_ASYNC la risposta contiene subito classe e fiducia, mentre Grad-CAM
+        e caricamento dei file proseguono in un job in background.
+        Se la coda di inferenza è piena risponde 429; in sovraccarico la Grad-CAM viene saltata.
+        Immagini oltre i limiti di dimensione vengono rifiutate prima della decodifica.
         """
+        if not self.model_loader.is_ready():
+            return self._model_not_ready()
+
+        profile = self.memory_tracker.start('predict')
+        ticket = None
+        job_reservation = None
         try:
+            with profile.stage('validate'):
+                self._validate_upload(file)
+
             doctor_data = json.loads(form_data.get('userData'))
             patient_uid = form_data.get('selectedPatientID')
             knee_side = form_data.get('selectedSide')
+            # Con allClassGradcam vengono salvate le heatmap di tutte le classi, visualizzabili in seguito
+            all_classes = form_data.get('allClassGradcam', 'false').lower() == 'true'
 
-            num_folder = self.gcs_manager.count_patient_radiographs(patient_uid)
+            # L'ammissione (e la prenotazione del posto per il job in background) precede letture su
+            # Firestore e assegnazione dell'indice: una richiesta rifiutata (429) non consuma un indice
+            # Radiografia{N} né esegue chiamate di rete
+            if AppConfig.GRADCAM_ASYNC:
+                job_reservation = self.job_manager.reserve()
+            ticket = self.admission.acquire()
 
-            # Preprocessa e predici
-            img_array, img_rgb = self.model_manager.preprocess_image(file)
-            predicted_class, confidence = self.model_manager.predict_class(img_array)
+            patient_info, error_response = self._get_patient_info(patient_uid)
+            if error_response:
+                return error_response
 
-            # Genera Grad-CAM
-            superimposed_img = self.model_manager.generate_gradcam(img_array, predicted_class, img_rgb)
-            
-            # Prepara i file per il caricamento
-            gradcam_file = io.BytesIO()
-            _, buffer = cv2.imencode('.png', superimposed_img)
-            gradcam_file.write(buffer)
-            gradcam_file.seek(0)
-
-            # Prepara le informazioni
-            class_labels = {
-                0: 'Classe 1: Normale',
-                1: 'Classe 2: Lieve osteoartrite',
-                2: 'Classe 3: Moderata osteoartrite',
-                3: 'Classe 4: Grave osteoartrite',
-                4: 'Classe 5: Avanzata osteoartrite'
-            }
-            predicted_label = class_labels.get(predicted_class, 'Unknown class')
-            radiograph_id = str(uuid.uuid4())
-
-            patient_info = self.firestore_manager.get_patient_information(patient_uid)
-            if not patient_info:
-                return jsonify({'error': 'Unable to retrieve patient information'}), 400
-
-            # Verifica campi necessari
-            required_fields = ['name', 'family_name', 'birthdate', 'tax_code', 'address', 'cap_code', 'gender']
-            missing_fields = [field for field in required_fields if not patient_info.get(field)]
-            if missing_fields:
-                return jsonify({'error': f'Missing patient information: {", ".join(missing_fields)}'}), 400
-            
-            info_content = (
-                f"UID paziente: {patient_uid}\n"
-                f"Nome paziente: {patient_info['name']}\n"  
-                f"Cognome paziente: {patient_info['family_name']}\n"
-                f"Data di nascita paziente: {patient_info['birthdate']}\n"
-                f"Codice fiscale paziente: {patient_info['tax_code']}\n"
-                f"Indirizzo paziente: {patient_info['address']}\n"
-                f"CAP paziente: {patient_info['cap_code']}\n"
-                f"Genere paziente: {patient_info['gender']}\n"
-                f"ID radiografia: {radiograph_id}\n"
-                f"Data di caricamento: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-                f"Classe predetta: {predicted_label}\n"
-                f"Lato del ginocchio: {knee_side}\n"
-                f"Confidenza: {confidence:.2f}\n"
-                f"Radiografia caricata da: {doctor_data['name']} {doctor_data['family_name']}\n"
-                f"UID dottore: {doctor_data['uid']}\n"
-                f"Codice identificativo dottore: {doctor_data['doctorID']}\n"
-            )
+            # Tutta la richiesta usa gli stessi componenti, anche se il modello viene ricaricato nel frattempo
+            with self.model_loader.acquire() as components:
+                if all_classes and components['model'] is None:
+                    return jsonify({
+                        'error': 'La Grad-CAM di tutte le classi non è disponibile con il pool di processi'
+                    }), 400
 
-            # Salva i file
-            urls = self.gcs_manager.save_radiograph(
-                patient_id=patient_uid,
-                original_image=file,
-                gradcam_image=gradcam_file,
-                info_content=info_content,
-                index=num_folder + 1
-            )
+                # L'indice viene assegnato solo dopo le verifiche, per non lasciare buchi nella numerazione
+                index = self._next_radiograph_index(patient_uid)
+                radiograph_id = str(uuid.uuid4())
 
-            return jsonify({
-                'predicted_class': predicted_label,
+                if AppConfig.GRADCAM_ASYNC:
+                    return self._predict_async(components, file, patient_uid, patient_info, doctor_data,
+                                               knee_side, radiograph_id, index, profile, ticket,
+                                               job_reservation, all_classes)
+
+                # La codifica dell'originale procede sul pool dell'encoder in parallelo all'inferenza
+                original_bytes = file.read()
+                file.seek(0)
+                original_future = self.image_encoder.encode_upload_async('original', original_bytes)
+
+                # Preprocessa, predici e genera la Grad-CAM (o recupera il risultato dalla cache)
+                heatmaps = None
+                if ticket.degraded:
+                    predicted_class, confidence = self._classify(components, file, profile)
+                    gradcam = None
+                elif all_classes:
+                    predicted_class, confidence, gradcam, heatmaps, probabilities = \
+                        self._analyze_all_classes(components, file, profile)
+                else:
+                    predicted_class, confidence, gradcam = self._analyze_cached(components, file, profile)
+                original = original_future.result()
+                # Il caricamento dei file non occupa uno slot di inferenza
+                ticket.release()
+                model_version = components['model_version']
+
+                # Prepara le informazioni
+                record = self._build_radiograph_record(
+                    patient_uid, index, patient_info, doctor_data, radiograph_id,
+                    predicted_class, knee_side, confidence, model_version
+                )
+
+                # Salva i file
+                with profile.stage('upload'):
+                    urls = self.gcs_manager.save_radiograph(
+                        patient_id=patient_uid,
+                        original_image=io.BytesIO(original.data),
+                        gradcam_image=io.BytesIO(gradcam.data) if gradcam is not None else None,
+                        info_content=self.firestore_manager.format_radiograph_info(record),
+                        index=index,
+                        original_format=original.format,
+                        gradcam_format=gradcam.format if gradcam is not None else 'png',
+                        extra_artifacts=[
+                            self.gcs_manager.heatmaps_artifact(patient_uid, index, heatmaps, probabilities)
+                        ] if heatmaps is not None else None
+                    )
+                    self._catalog_radiograph(record, original.format,
+                                             gradcam.format if gradcam is not None else None,
+                                             heatmaps is not None)
+
+            response = {
+                'predicted_class': record['prediction'],
                 'confidence': confidence,
+                'model_version': model_version,
                 'original_image': urls['original_image'],
                 'gradcam_image': urls['gradcam_image'],
+                'gradcam_status': 'ready' if gradcam is not None else 'skipped',
                 'info_file': urls['info_file']
-            })
+            }
+            if heatmaps is not None:
+                response['class_gradcam_urls'] = self._class_gradcam_urls(patient_uid, index, len(heatmaps))
+            return jsonify(response)
 
+        except ImageValidationException as e:
+            return jsonify({'error': str(e)}), e.status_code
+        except AdmissionRejectedException as e:
+            return self._admission_rejected(e)
+        except JobQueueFullException as e:
+            return self._admission_rejected(AdmissionRejectedException(str(e), self.admission.retry_after()))
         except Exception as e:
             return jsonify({'error': str(e)}), 500
-        
\ No newline at end of file
+        finally:
+            if ticket is not None and not ticket.detached:
+                ticket.release()
+            # Nessun effetto se il posto è stato usato dal job
+            if job_reservation is not None:
+                job_reservation.release()
+            profile.finish()
+
+    @staticmethod
+    def _class_gradcam_urls(patient_uid, index, num_classes):
+        """
+        URL dell'endpoint che genera la Grad-CAM di ciascuna classe di una radiografia.
+        """
+        return [f"/api/radiographs/{patient_uid}/{index}/gradcam/{class_index}" for class_index in range(num_classes)]
+
+    def _predict_async(self, components, file, patient_uid, patient_info, doctor_data, knee_side,
+                       radiograph_id, index, profile, ticket, job_reservation, all_classes=False):
+        """
+        Calcola subito classe e fiducia e accoda Grad-CAM, codifica delle immagini e salvataggio dei file.
+        """
+        # Il file della richiesta non è più leggibile dopo la risposta: ne serve una copia
+        original_bytes = file.read()
+        file.seek(0)
+
+        model_version = components['model_version']
+        content_hash = None
+        gradcam = None
+        render_gradcam = None
+        cached = None
+        # La cache non contiene le heatmap di tutte le classi
+        if self.prediction_cache is not None and not all_classes:
+            content_hash = self.prediction_cache.hash_file(file)
+            cached = self.prediction_cache.get(content_hash, model_version)
+
+        if cached is not None:
+            predicted_class, confidence = cached.predicted_class, cached.confidence
+            gradcam = EncodedImage.from_bytes(cached.gradcam_image, cached.gradcam_format)
+        elif ticket.degraded:
+            # In sovraccarico la Grad-CAM viene saltata: il job carica solo originale e info
+            predicted_class, confidence = self._classify(components, file, profile)
+        elif components['inference_pool'] is not None:
+            # Il pool esegue l'intera pipeline: in background restano codifica e caricamento
+            with profile.stage('inference'):
+                predicted_class, confidence, superimposed_img, _ = components['inference_pool'].analyze(
+                    file, timeout=AppConfig.INFERENCE_RESULT_TIMEOUT_S
+                )
+            render_gradcam = lambda: superimposed_img
+        else:
+            # Il job mantiene un riferimento al ModelManager anche se il modello viene ricaricato
+            model_manager = components['model']
+            with profile.stage('preprocess'):
+                img_array, img = model_manager.preprocess_image(file)
+            with profile.stage('inference'):
+                predicted_class, confidence = model_manager.predict_class(img_array)
+            if all_classes:
+                def render_gradcam():
+                    _, _, heatmaps, probabilities = model_manager.predict_with_gradcam_all_classes(img_array)
+                    self.gcs_manager.save_heatmaps(patient_uid, index, heatmaps, probabilities)
+                    return model_manager.overlay_heatmap(heatmaps[predicted_class], img)
+            else:
+                render_gradcam = lambda: model_manager.generate_gradcam(img_array, predicted_class, img)
+        # Con una Grad-CAM da generare il job occupa lo slot di ammissione fino al rendering: le immagini
+        # decodificate in attesa nei job restano limitate dal controllo di ammissione
+        if render_gradcam is None:
+            ticket.release()
+
+        record = self._build_radiograph_record(
+            patient_uid, index, patient_info, doctor_data, radiograph_id,
+            predicted_class, knee_side, confidence, model_version
+        )
+
+        def job():
+            try:
+                original_future = self.image_encoder.encode_upload_async('original', original_bytes)
+                encoded_gradcam = gradcam
+                if encoded_gradcam is None and render_gradcam is not None:
+                    encoded_gradcam = self.image_encoder.encode('gradcam', render_gradcam())
+                    if content_hash is not None:
+                        self.prediction_cache.put(
+                            content_hash, model_version,
+                            CachedPrediction(int(predicted_class), float(confidence),
+                                             encoded_gradcam.data, encoded_gradcam.format)
+                        )
+                # Il caricamento dei file non occupa uno slot di inferenza
+                ticket.release()
+                original = original_future.result()
+                urls = self.gcs_manager.save_radiograph(
+                    patient_id=patient_uid,
+                    original_image=io.BytesIO(original.data),
+                    gradcam_image=io.BytesIO(encoded_gradcam.data) if encoded_gradcam is not None else None,
+                    info_content=self.firestore_manager.format_radiograph_info(record),
+                    index=index,
+                    original_format=original.format,
+                    gradcam_format=encoded_gradcam.format if encoded_gradcam is not None else 'png'
+                )
+                # Con allClassGradcam le heatmap sono state salvate da render_gradcam
+                self._catalog_radiograph(record, original.format,
+                                         encoded_gradcam.format if encoded_gradcam is not None else None,
+                                         all_classes and encoded_gradcam is not None)
+                return urls
+            finally:
+                ticket.release()
+
+        job_id = self.job_manager.submit(job, {
+            'patient_id': patient_uid,
+            'radiograph_index': index,
+            'radiograph_id': radiograph_id,
+            'model_version': model_version
+        }, reservation=job_reservation)
+        # Da qui lo slot viene liberato dal job
+        ticket.detached = True
+
+        response = {
+            'predicted_class': record['prediction'],
+            'confidence': confidence,
+            'model_version': model_version,
+            'job_id': job_id,
+            'gradcam_status': 'pending' if gradcam is not None or render_gradcam is not None else 'skipped',
+            'status_url': f"/api/jobs/{job_id}"
+        }
+        if all_classes and render_gradcam is not None:
+            response['class_gradcam_urls'] = self._class_gradcam_urls(patient_uid, index, len(CLASS_LABELS))
+        return jsonify(response), 202
+
+    def render_class_gradcam(self, patient_id, idx, class_index):
+        """
+        Genera la Grad-CAM di una classe qualsiasi di una radiografia dalle heatmap salvate,
+        senza rieseguire il modello (disponibile per le analisi richieste con allClassGradcam).
+        """
+        try:
+            idx, class_index = int(idx), int(class_index)
+            stored = self.gcs_manager.load_heatmaps(patient_id, idx)
+            if stored is None:
+                return jsonify({'error': 'Heatmap di tutte le classi non disponibili per questa radiografia'}), 404
+            heatmaps = stored['heatmaps']
+            if not 0 <= class_index < len(heatmaps):
+                return jsonify({'error': f'Classe non valida: {class_index}'}), 400
+
+            original_blob = self.gcs_manager.find_radiograph_image(patient_id, idx, 'original_image')
+            if original_blob is None:
+                return jsonify({'error': 'Immagine originale non trovata'}), 404
+
+            img = ModelManager.load_display_image(original_blob.download_as_bytes())
+            superimposed_img = ModelManager.overlay_heatmap(heatmaps[class_index], img)
+            gradcam = self.image_encoder.encode('gradcam', superimposed_img)
+
+            response = send_file(
+                io.BytesIO(gradcam.data),
+                mimetype=gradcam.content_type,
+                download_name=f"gradcam_image{idx}_class{class_index}{gradcam.extension}"
+            )
+            response.headers['X-Class-Label'] = CLASS_LABELS.get(class_index, 'Unknown class')
+            response.headers['X-Class-Probability'] = f"{float(stored['probabilities'][class_index]):.4f}"
+            return response
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    def get_job_status(self, job_id):
+        """
+        Restituisce lo stato di un job in background (Grad-CAM e caricamento dei file).
+        """
+        job = self.job_manager.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job non trovato'}), 404
+
+        response = {
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'radiograph_id': job.get('radiograph_id'),
+            'model_version': job.get('model_version'),
+            'error': job['error']
+        }
+        if job['status'] == 'done':
+            response.update(job['result'])
+        return jsonify(response), 200
@@ -1,6 +1,15 @@
 from utils.firestore_utils import FirestoreManager
 from utils.gcs_utils import GCSManager
 from utils.model_utils import ModelManager
+from utils.inference_backends import create_backend
+from utils.inference_scheduler import InferenceScheduler
+from utils.inference_pool import InferenceWorkerPool
+from utils.prediction_cache import PredictionCache
+from utils.model_loader import ModelLoader
+from utils.job_utils import JobManager
+from utils.image_encoding import ImageEncoder, EncodingPolicy
+from utils.admission_control import AdmissionController
+from utils.memory_tracking import MemoryTracker
 from utils.email_utils import EmailManager
 from firebase_admin import firestore
 from config.app_config import AppConfig
@@ -16,10 +25,55 @@ class ManagerFactory:
         # Inizializza GCS
         gcs_manager = GCSManager(AppConfig.GCS_BUCKET_NAME)
         
-        # Inizializza Model
-        model = gcs_manager.load_model(AppConfig.MODEL_PATH)
-        model_manager = ModelManager(model)
-        
+        # Inizializza Model in background: le route che non usano il modello restano disponibili
+        model_loader = ModelLoader()
+        model_loader.start(
+            lambda loader: ManagerFactory.create_inference_components(gcs_manager, loader),
+            background=AppConfig.MODEL_BACKGROUND_LOADING,
+            retire=ManagerFactory.retire_inference_components
+        )
+
+        # Inizializza la cache dei risultati di /predict (opzionale)
+        prediction_cache = None
+        if AppConfig.PREDICTION_CACHE_ENABLED:
+            prediction_cache = PredictionCache(
+                max_entries=AppConfig.PREDICTION_CACHE_MAX_ENTRIES,
+                disk_dir=AppConfig.PREDICTION_CACHE_DIR,
+                disk_max_entries=AppConfig.PREDICTION_CACHE_DISK_MAX_ENTRIES
+            )
+
+        # Inizializza i job in background (Grad-CAM asincrona e caricamento dei file)
+        job_manager = JobManager(max_workers=AppConfig.JOB_WORKERS, max_pending=AppConfig.JOB_MAX_PENDING)
+
+        # Inizializza la codifica delle immagini salvate (politica per tipo di artefatto)
+        image_encoder = ImageEncoder({
+            'original': EncodingPolicy(
+                format=AppConfig.ORIGINAL_IMAGE_FORMAT,
+                png_compression=AppConfig.ORIGINAL_PNG_COMPRESSION
+            ),
+            'gradcam': EncodingPolicy(
+                format=AppConfig.GRADCAM_IMAGE_FORMAT,
+                quality=AppConfig.GRADCAM_IMAGE_QUALITY,
+                png_compression=AppConfig.GRADCAM_PNG_COMPRESSION
+            )
+        }, max_workers=AppConfig.ENCODER_WORKERS)
+
+        # Inizializza il controllo di ammissione all'inferenza
+        admission_controller = AdmissionController(
+            max_concurrency=AppConfig.ADMISSION_MAX_CONCURRENCY,
+            max_queue=AppConfig.ADMISSION_MAX_QUEUE,
+            latency_target_ms=AppConfig.ADMISSION_LATENCY_TARGET_MS,
+            queue_timeout_s=AppConfig.ADMISSION_QUEUE_TIMEOUT_S,
+            wait_half_life_s=AppConfig.ADMISSION_WAIT_HALF_LIFE_S
+        )
+
+        # Inizializza la misura della memoria per fase delle richieste di analisi
+        memory_tracker = MemoryTracker(
+            enabled=AppConfig.MEMORY_TRACKING_ENABLED,
+            history_size=AppConfig.MEMORY_TRACKING_HISTORY,
+            sample_interval_ms=AppConfig.MEMORY_SAMPLE_INTERVAL_MS
+        )
+
         # Inizializza Email
         email_manager = EmailManager(
             sender_email=AppConfig.SMTP_USERNAME,
@@ -29,6 +83,107 @@ class ManagerFactory:
         return {
             'firestore': firestore_manager,
             'gcs': gcs_manager,
-            'model': model_manager,
+            'model_loader': model_loader,
+            'prediction_cache': prediction_cache,
+            'jobs': job_manager,
+            'encoder': image_encoder,
+            'admission': admission_controller,
+            'memory': memory_tracker,
             'email': email_manager
-        }
\ No newline at end of file
+        }
+
+    @staticmethod
+    def create_inference_components(gcs_manager, loader=None):
+        """
+        Carica il modello e crea i componenti di inferenza secondo le chiavi di AppConfig.
+        Con il pool di processi il modello vive solo nei worker.
+
+        Returns:
+            Dict con 'model' (ModelManager), 'inference' (InferenceScheduler), 'inference_pool'
+            (InferenceWorkerPool) e 'model_version'; i componenti non configurati valgono None.
+        """
+        def set_stage(stage):
+            if loader is not None:
+                loader.set_stage(stage)
+
+        model_manager = None
+        inference_scheduler = None
+        inference_pool = None
+        if AppConfig.INFERENCE_WORKERS > 0:
+            # I worker scaricano esattamente questa versione (if_generation_match)
+            model_version = gcs_manager.get_model_version(AppConfig.MODEL_PATH)
+            set_stage('starting_workers')
+            inference_pool = InferenceWorkerPool(
+                AppConfig.INFERENCE_WORKERS,
+                AppConfig.GCS_BUCKET_NAME,
+                AppConfig.MODEL_PATH,
+                model_version=model_version
+            )
+            inference_pool.wait_ready()
+        else:
+            set_stage('loading_model')
+            # La versione è quella dei metadati usati per il download dei pesi
+            model, model_version = gcs_manager.load_model_with_version(AppConfig.MODEL_PATH)
+            set_stage('warming_up')
+            model_manager = ManagerFactory.create_model_manager(model, model_version)
+
+            # Inizializza lo scheduler di micro-batching (opzionale)
+            if AppConfig.INFERENCE_BATCHING_ENABLED:
+                inference_scheduler = InferenceScheduler(
+                    model_manager,
+                    max_batch_size=AppConfig.INFERENCE_MAX_BATCH_SIZE,
+                    max_wait_ms=AppConfig.INFERENCE_MAX_WAIT_MS,
+                    result_timeout_s=AppConfig.INFERENCE_RESULT_TIMEOUT_S
+                )
+
+        return {
+            'model': model_manager,
+            'inference': inference_scheduler,
+            'inference_pool': inference_pool,
+            'model_version': model_version
+        }
+
+    @staticmethod
+    def retire_inference_components(components):
+        """
+        Arresta i componenti di inferenza sostituiti da un ricaricamento del modello
+        (thread dello scheduler e processi worker); il modello viene liberato dal garbage collector.
+        """
+        if components.get('inference') is not None:
+            components['inference'].shutdown()
+        if components.get('inference_pool') is not None:
+            components['inference_pool'].shutdown()
+
+    @staticmethod
+    def create_model_manager(model, model_version=None):
+        """
+        Crea e preriscalda il ModelManager per un modello Keras già caricato,
+        secondo le chiavi di AppConfig (usato anche dai processi worker).
+        """
+        backend = create_backend(
+            AppConfig.MODEL_BACKEND,
+            model,
+            model_path=AppConfig.MODEL_BACKEND_PATH,
+            jit_compile=AppConfig.MODEL_JIT_COMPILE,
+            num_threads=AppConfig.MODEL_BACKEND_THREADS
+        )
+        model_manager = ModelManager(
+            model,
+            jit_compile=AppConfig.MODEL_JIT_COMPILE,
+            input_buckets=AppConfig.MODEL_INPUT_BUCKETS,
+            backend=backend,
+            model_version=model_version
+        )
+
+        # Preriscalda le funzioni compilate per non pagare il tracing alla prima richiesta
+        if AppConfig.MODEL_WARMUP_ENABLED:
+            batch_sizes = [1]
+            if AppConfig.INFERENCE_BATCHING_ENABLED and AppConfig.INFERENCE_MAX_BATCH_SIZE > 1:
+                batch_sizes.append(AppConfig.INFERENCE_MAX_BATCH_SIZE)
+            # Senza bucket (risoluzione nativa) si preriscalda una risoluzione rappresentativa
+            input_shapes = None if AppConfig.MODEL_INPUT_BUCKETS else [
+                (AppConfig.MODEL_WARMUP_SIZE, AppConfig.MODEL_WARMUP_SIZE)
+            ]
+            model_manager.warmup(input_shapes, batch_sizes=batch_sizes)
+
+        return model_manager
\ No newline at end of file
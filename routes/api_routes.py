@@ -5,6 +5,24 @@ import io
 import cv2
 
 def register_routes(app, controllers):
+    # Health Routes
+    @app.route('/health/live', methods=['GET'])
+    def liveness():
+        return controllers['health'].liveness()
+
+    @app.route('/health/ready', methods=['GET'])
+    def readiness():
+        return controllers['health'].readiness()
+
+    # Admin Routes
+    @app.route('/api/admin/model/reload', methods=['POST'])
+    def reload_model():
+        return controllers['model'].reload_model(request.headers, request.get_json(silent=True) or {})
+
+    @app.route('/api/admin/model/status', methods=['GET'])
+    def get_model_status():
+        return controllers['model'].get_model_status(request.headers)
+
     # Auth Routes
     @app.route('/register', methods=['POST'])
     def register():
@@ -90,7 +108,8 @@ def register_routes(app, controllers):
     def download_radiograph():
         return controllers['radiograph'].download_radiograph(
             request.args.get('url'),
-            request.args.get('filename', 'radiograph.png')
+            request.args.get('filename', 'radiograph.png'),
+            request.headers
         )
 
     @app.route('/upload-to-dataset', methods=['POST'])
@@ -99,14 +118,26 @@ def register_routes(app, controllers):
 
     @app.route('/get_radiographs/<user_uid>', methods=['GET'])
     def get_radiographs(user_uid):
-        return controllers['radiograph'].get_radiographs(user_uid)
+        return controllers['radiograph'].get_radiographs(user_uid, request.args)
 
     @app.route('/get_radiographs_info/<user_uid>/<idx>', methods=['GET'])
     def get_radiographs_info(user_uid, idx):
         return controllers['radiograph'].get_radiographs_info(user_uid, idx)
 
+    @app.route('/api/radiographs/<patient_id>/<int:idx>/gradcam/<int:class_index>', methods=['GET'])
+    def render_class_gradcam(patient_id, idx, class_index):
+        return controllers['radiograph'].render_class_gradcam(patient_id, idx, class_index)
+
     @app.route('/predict', methods=['POST'])
     def predict():
         return controllers['radiograph'].predict(request.files['file'], request.form)
 
+    @app.route('/api/jobs/<job_id>', methods=['GET'])
+    def get_job_status(job_id):
+        return controllers['radiograph'].get_job_status(job_id)
+
+    @app.route('/api/inference/stats', methods=['GET'])
+    def get_inference_stats():
+        return controllers['radiograph'].get_inference_stats()
+
     return app
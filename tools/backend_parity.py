@@ -0,0 +1,115 @@
+"""
+Confronta i backend di inferenza con il modello Keras di riferimento su un insieme locale di radiografie.
+
+Esempio:
+    python -m tools.backend_parity --model pesi.h5 --images ./radiografie \
+        --export-dir ./export --backends onnx tflite bf16
+"""
+import argparse
+import json
+import os
+import time
+import numpy as np
+import tensorflow as tf
+from typing import Dict, List
+from config.app_config import AppConfig
+from utils.model_utils import ModelManager
+from utils.inference_backends import (
+    KerasBackend, InferenceBackend, create_backend, export_onnx, export_tflite
+)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+def load_images(model_manager: ModelManager, images_dir: str) -> List[np.ndarray]:
+    """
+    Legge e preprocessa tutte le immagini della cartella indicata.
+    """
+    images = []
+    for name in sorted(os.listdir(images_dir)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(images_dir, name), 'rb') as f:
+                img_array, _ = model_manager.preprocess_image(f, for_display=False)
+            images.append(img_array)
+    return images
+
+
+def run_backend(backend: InferenceBackend, images: List[np.ndarray]) -> Dict:
+    """
+    Esegue il backend su ogni immagine (batch di uno, come in /predict) misurando la latenza.
+    """
+    backend.predict(images[0])  # warmup
+    predictions, latencies = [], []
+    for img_array in images:
+        started_at = time.perf_counter()
+        predictions.append(backend.predict(img_array)[0])
+        latencies.append((time.perf_counter() - started_at) * 1000.0)
+    return {'predictions': np.stack(predictions), 'latencies_ms': np.array(latencies)}
+
+
+def compare(reference: Dict, candidate: Dict) -> Dict:
+    """
+    Calcola deriva di accuratezza/fiducia e latenza di un backend rispetto al riferimento Keras.
+    """
+    ref_preds, cand_preds = reference['predictions'], candidate['predictions']
+    ref_classes = np.argmax(ref_preds, axis=1)
+    cand_classes = np.argmax(cand_preds, axis=1)
+    confidence_drift = np.abs(np.max(cand_preds, axis=1) - np.max(ref_preds, axis=1))
+    latencies = candidate['latencies_ms']
+    return {
+        'top1_agreement': float(np.mean(ref_classes == cand_classes)),
+        'mean_abs_prob_drift': float(np.mean(np.abs(cand_preds - ref_preds))),
+        'mean_confidence_drift': float(np.mean(confidence_drift)),
+        'max_confidence_drift': float(np.max(confidence_drift)),
+        'latency_p50_ms': float(np.percentile(latencies, 50)),
+        'latency_p95_ms': float(np.percentile(latencies, 95)),
+        'speedup_p50': float(np.percentile(reference['latencies_ms'], 50) / np.percentile(latencies, 50))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Confronto di parità tra backend di inferenza")
+    parser.add_argument('--model', required=True, help="Percorso locale del modello Keras (.h5)")
+    parser.add_argument('--images', required=True, help="Cartella con le radiografie di test")
+    parser.add_argument('--backends', nargs='+', default=['onnx', 'tflite', 'bf16'],
+                        choices=['onnx', 'tflite', 'bf16'])
+    parser.add_argument('--export-dir', default='.', help="Cartella per gli artefatti ONNX/TFLite esportati")
+    parser.add_argument('--threads', type=int, default=None, help="Thread per ONNX Runtime/TFLite")
+    parser.add_argument('--output', help="File JSON in cui salvare il report")
+    args = parser.parse_args()
+
+    model = tf.keras.models.load_model(args.model)
+    model_manager = ModelManager(model, input_buckets=AppConfig.MODEL_INPUT_BUCKETS)
+    images = load_images(model_manager, args.images)
+    if not images:
+        parser.error(f"Nessuna immagine trovata in {args.images}")
+
+    reference = run_backend(KerasBackend(model), images)
+    report = {
+        'images': len(images),
+        'keras': {
+            'latency_p50_ms': float(np.percentile(reference['latencies_ms'], 50)),
+            'latency_p95_ms': float(np.percentile(reference['latencies_ms'], 95))
+        }
+    }
+
+    os.makedirs(args.export_dir, exist_ok=True)
+    for name in args.backends:
+        model_path = None
+        if name == 'onnx':
+            input_size = AppConfig.MODEL_INPUT_BUCKETS[0] if len(AppConfig.MODEL_INPUT_BUCKETS) == 1 else None
+            model_path = export_onnx(model, os.path.join(args.export_dir, 'model.onnx'), input_size)
+        elif name == 'tflite':
+            model_path = export_tflite(model, os.path.join(args.export_dir, 'model.tflite'))
+        backend = create_backend(name, model, model_path=model_path, num_threads=args.threads)
+        report[name] = compare(reference, run_backend(backend, images))
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
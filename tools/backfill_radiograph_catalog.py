@@ -0,0 +1,85 @@
+"""
+Importa nel catalogo delle radiografie (collezione Firestore 'radiographs') le radiografie già
+presenti nel bucket, leggendo i relativi file info.txt. Le schede già presenti nel catalogo
+vengono lasciate invariate, salvo con --overwrite.
+
+Esempio:
+    python -m tools.backfill_radiograph_catalog --dry-run
+    python -m tools.backfill_radiograph_catalog --patients UID1 UID2 --overwrite
+"""
+import argparse
+import json
+import os
+import firebase_admin
+from dotenv import load_dotenv
+from firebase_admin import firestore
+from typing import Dict
+from config.app_config import AppConfig
+from controllers.radiograph_controller import RadiographController
+from utils.firestore_utils import FirestoreManager
+from utils.gcs_utils import GCSManager
+
+
+def backfill_patient(gcs_manager: GCSManager, firestore_manager: FirestoreManager, patient_id: str,
+                     overwrite: bool, dry_run: bool) -> Dict[str, int]:
+    """
+    Importa nel catalogo le radiografie di un paziente.
+
+    Returns:
+        Dict[str, int]: Numero di radiografie importate, già presenti e non leggibili
+    """
+    stats = {'imported': 0, 'existing': 0, 'skipped': 0}
+    folders = gcs_manager.list_radiograph_folders(patient_id)
+    complete = {
+        index: blobs for index, blobs in folders.items()
+        if 'original_image' in blobs and 'info' in blobs
+    }
+    stats['skipped'] += len(folders) - len(complete)
+    infos = gcs_manager.read_radiograph_infos({index: blobs['info'] for index, blobs in complete.items()})
+    stats['skipped'] += len(complete) - len(infos)
+
+    for index in sorted(infos):
+        if not overwrite and firestore_manager.get_radiograph_record(patient_id, index) is not None:
+            stats['existing'] += 1
+            continue
+
+        record = RadiographController.record_from_folder(patient_id, index, complete[index], infos[index])
+        if not dry_run:
+            firestore_manager.save_radiograph_record(record)
+        stats['imported'] += 1
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa nel catalogo Firestore le radiografie presenti nel bucket")
+    parser.add_argument('--patients', nargs='*', default=None,
+                        help="ID dei pazienti da importare (default: tutti i pazienti del bucket)")
+    parser.add_argument('--overwrite', action='store_true', help="Sostituisce le schede già presenti nel catalogo")
+    parser.add_argument('--dry-run', action='store_true', help="Non scrive nel catalogo, riporta solo i conteggi")
+    args = parser.parse_args()
+
+    load_dotenv()
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = AppConfig.GCS_CRED_PATH
+    firebase_admin.initialize_app(firebase_admin.credentials.Certificate(AppConfig.FIREBASE_CRED_PATH))
+    firestore_manager = FirestoreManager(firestore.client())
+    gcs_manager = GCSManager(AppConfig.GCS_BUCKET_NAME)
+
+    patient_ids = args.patients if args.patients else gcs_manager.list_patient_ids()
+    report = {'dry_run': args.dry_run, 'patients': {}}
+    totals = {'imported': 0, 'existing': 0, 'skipped': 0}
+    for patient_id in patient_ids:
+        try:
+            stats = backfill_patient(gcs_manager, firestore_manager, patient_id, args.overwrite, args.dry_run)
+        except Exception as e:
+            report['patients'][patient_id] = {'error': str(e)}
+            continue
+        report['patients'][patient_id] = stats
+        for key, value in stats.items():
+            totals[key] += value
+    report['totals'] = totals
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
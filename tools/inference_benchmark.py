@@ -0,0 +1,228 @@
+"""
+Micro-benchmark delle fasi di inferenza di ModelManager (preprocess_image, predict_class,
+predict_batch, make_gradcam_heatmap, predict_with_gradcam_batch, generate_gradcam).
+
+Il modello è una ResNet50 con la stessa architettura di quello in produzione ma pesi casuali,
+costruita localmente (nessun accesso a GCS); le radiografie sono sintetiche, generate per ogni
+risoluzione richiesta. Il report JSON contiene percentili di latenza, throughput e picco di RSS
+(campionato durante ciascuna fase) e può essere confrontato con quello di un'esecuzione
+precedente (--compare).
+
+Esempio:
+    python -m tools.inference_benchmark --resolutions 512x512 1024x1024 2048x2048 \
+        --batch-sizes 1 4 8 --iterations 20 --output bench.json
+    python -m tools.inference_benchmark --compare bench.json --output bench_new.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import time
+import cv2
+import numpy as np
+import tensorflow as tf
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+from config.app_config import AppConfig
+from utils.memory_tracking import RssSampler, current_rss
+from utils.model_utils import ModelManager, GRADCAM_LAYER_NAME
+
+NUM_CLASSES = 5
+_MIB = 1024 * 1024
+# Campiona la RSS durante ogni fase, così il picco riportato è quello della fase e non del processo
+_RSS_SAMPLER = RssSampler(interval_s=0.005)
+
+
+def parse_size(value: str) -> Tuple[int, int]:
+    """
+    Converte una risoluzione 'ALTEZZAxLARGHEZZA' in una tupla.
+    """
+    height, width = value.lower().split('x')
+    return int(height), int(width)
+
+
+def build_model(seed: int) -> tf.keras.Model:
+    """
+    Costruisce un modello con l'architettura di produzione (ResNet50 + classificatore a 5 classi) e pesi casuali.
+    """
+    tf.random.set_seed(seed)
+    backbone = tf.keras.applications.ResNet50(weights=None, include_top=False, input_shape=(None, None, 3))
+    return tf.keras.Sequential([
+        backbone,
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(NUM_CLASSES, activation='softmax')
+    ])
+
+
+def synthetic_radiograph(height: int, width: int, rng: np.random.Generator) -> bytes:
+    """
+    Genera una radiografia sintetica in scala di grigi (gradiente, struttura centrale e rumore), codificata in PNG.
+    """
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    img = 60.0 + 80.0 * (y / height)
+    bone = np.exp(-(((x - width / 2) / (width / 6)) ** 2)) * 90.0
+    img += bone + rng.normal(0.0, 8.0, size=(height, width))
+    _, buffer = cv2.imencode('.png', np.clip(img, 0, 255).astype(np.uint8))
+    return buffer.tobytes()
+
+
+def peak_rss_mib() -> float:
+    """
+    Picco di memoria residente del processo finora, in MiB (ru_maxrss è in KiB su Linux, in byte su macOS).
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if platform.system() == 'Darwin' else peak / 1024
+
+
+def measure(fn: Callable[[], None], iterations: int, warmup: int, images_per_call: int = 1) -> Dict[str, float]:
+    """
+    Esegue `fn` e restituisce percentili di latenza, throughput e picco di RSS campionato durante
+    le iterazioni misurate, assoluto e come incremento rispetto alla RSS all'inizio della fase.
+    """
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    rss_before = current_rss()
+    measure_id = _RSS_SAMPLER.start()
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        call_started_at = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - call_started_at) * 1000.0)
+    total = time.perf_counter() - started_at
+    peak = _RSS_SAMPLER.stop(measure_id)
+    latencies = np.array(latencies)
+    return {
+        'iterations': iterations,
+        'images_per_call': images_per_call,
+        'latency_p50_ms': float(np.percentile(latencies, 50)),
+        'latency_p90_ms': float(np.percentile(latencies, 90)),
+        'latency_p99_ms': float(np.percentile(latencies, 99)),
+        'latency_mean_ms': float(np.mean(latencies)),
+        'throughput_images_s': iterations * images_per_call / total if total else 0.0,
+        'peak_rss_mib': peak / _MIB,
+        'peak_rss_increase_mib': max(0, peak - rss_before) / _MIB
+    }
+
+
+def run_resolution(model_manager: ModelManager, size: Tuple[int, int], batch_sizes: List[int],
+                   iterations: int, warmup: int, rng: np.random.Generator) -> Dict[str, Dict]:
+    """
+    Misura tutte le fasi per radiografie della risoluzione indicata.
+    """
+    data = synthetic_radiograph(size[0], size[1], rng)
+    img_array, img = model_manager.preprocess_image(io.BytesIO(data))
+    predicted_class, _ = model_manager.predict_class(img_array)
+    heatmap = model_manager.make_gradcam_heatmap(img_array, GRADCAM_LAYER_NAME, predicted_class)
+
+    results = {
+        'preprocess_image': measure(
+            lambda: model_manager.preprocess_image(io.BytesIO(data)), iterations, warmup
+        ),
+        'preprocess_image_model_only': measure(
+            lambda: model_manager.preprocess_image(io.BytesIO(data), for_display=False), iterations, warmup
+        ),
+        'predict_class': measure(lambda: model_manager.predict_class(img_array), iterations, warmup),
+        'make_gradcam_heatmap': measure(
+            lambda: model_manager.make_gradcam_heatmap(img_array, GRADCAM_LAYER_NAME, predicted_class),
+            iterations, warmup
+        ),
+        'overlay_heatmap': measure(lambda: model_manager.overlay_heatmap(heatmap, img), iterations, warmup),
+        'generate_gradcam': measure(
+            lambda: model_manager.generate_gradcam(img_array, predicted_class, img), iterations, warmup
+        )
+    }
+    for batch_size in batch_sizes:
+        img_batch = np.repeat(img_array, batch_size, axis=0)
+        results[f'predict_batch[{batch_size}]'] = measure(
+            lambda: model_manager.predict_batch(img_batch), iterations, warmup, batch_size
+        )
+        results[f'predict_with_gradcam_batch[{batch_size}]'] = measure(
+            lambda: model_manager.predict_with_gradcam_batch(img_batch), iterations, warmup, batch_size
+        )
+    return results
+
+
+def compare(report: Dict, baseline: Dict) -> Dict[str, Dict[str, float]]:
+    """
+    Rapporto tra la latenza mediana attuale e quella di un report precedente (>1 indica un peggioramento).
+    """
+    comparison = {}
+    for resolution, stages in report['results'].items():
+        for stage, stats in stages.items():
+            previous = baseline.get('results', {}).get(resolution, {}).get(stage)
+            if previous and previous['latency_p50_ms']:
+                comparison[f"{resolution}/{stage}"] = {
+                    'p50_ratio': stats['latency_p50_ms'] / previous['latency_p50_ms'],
+                    'throughput_ratio': (
+                        stats['throughput_images_s'] / previous['throughput_images_s']
+                        if previous['throughput_images_s'] else None
+                    )
+                }
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark delle fasi di inferenza di ModelManager")
+    parser.add_argument('--resolutions', nargs='+', default=['512x512', '1024x1024', '2048x2048'],
+                        help="Risoluzioni (ALTEZZAxLARGHEZZA) delle radiografie sintetiche")
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 4, 8])
+    parser.add_argument('--buckets', nargs='*', default=None,
+                        help="Bucket di input del modello (default: MODEL_INPUT_BUCKETS)")
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--jit-compile', action='store_true', help="Compila le funzioni di inferenza con XLA")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="File JSON in cui salvare il report")
+    parser.add_argument('--compare', help="Report JSON di un'esecuzione precedente da confrontare")
+    args = parser.parse_args()
+
+    buckets = [parse_size(b) for b in args.buckets] if args.buckets is not None else AppConfig.MODEL_INPUT_BUCKETS
+    rng = np.random.default_rng(args.seed)
+
+    model = build_model(args.seed)
+    model_manager = ModelManager(model, jit_compile=args.jit_compile, input_buckets=buckets)
+    warmup_s = model_manager.warmup(batch_sizes=sorted(set(args.batch_sizes))) if buckets else None
+
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'tensorflow': tf.__version__,
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'cpu_count': os.cpu_count(),
+            'gpus': len(tf.config.list_physical_devices('GPU'))
+        },
+        'config': {
+            'input_buckets': [list(bucket) for bucket in buckets],
+            'batch_sizes': args.batch_sizes,
+            'iterations': args.iterations,
+            'warmup': args.warmup,
+            'jit_compile': args.jit_compile,
+            'seed': args.seed
+        },
+        'model_warmup_s': warmup_s,
+        'results': {}
+    }
+    for resolution in args.resolutions:
+        report['results'][resolution] = run_resolution(
+            model_manager, parse_size(resolution), args.batch_sizes, args.iterations, args.warmup, rng
+        )
+    report['peak_rss_mib'] = peak_rss_mib()
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            report['comparison'] = compare(report, json.load(f))
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Misura il picco di memoria per richiesta del preprocessing, confrontando la pipeline precedente
+(copia RGB, img_to_array, expand_dims, preprocess_input) con quella attuale di ModelManager.
+
+Il picco è misurato con tracemalloc, che traccia le allocazioni degli array NumPy/OpenCV
+restituiti a Python (non i buffer interni temporanei di OpenCV).
+
+Esempio:
+    python -m tools.preprocess_memory radiografia.png
+"""
+import argparse
+import io
+import json
+import tracemalloc
+import cv2
+import numpy as np
+import tensorflow as tf
+from typing import Callable, Dict
+from config.app_config import AppConfig
+from utils.model_utils import ModelManager
+
+
+def legacy_preprocess(model_manager: ModelManager, file) -> None:
+    """
+    Pipeline di preprocessing precedente, riprodotta come riferimento.
+    """
+    img = cv2.imdecode(np.frombuffer(file.read(), np.uint8), cv2.IMREAD_GRAYSCALE)
+    equalized_img = cv2.equalizeHist(img)
+    img_rgb = cv2.cvtColor(equalized_img, cv2.COLOR_GRAY2RGB)
+    bucket = model_manager.select_bucket(img_rgb.shape[0], img_rgb.shape[1])
+    model_input = img_rgb if bucket is None else model_manager._resize(img_rgb, bucket)
+    img_array = tf.keras.utils.img_to_array(model_input)
+    img_array = np.expand_dims(img_array, axis=0)
+    tf.keras.applications.resnet50.preprocess_input(img_array)
+
+
+def measure_peak(fn: Callable, data: bytes, repeat: int) -> Dict[str, float]:
+    """
+    Esegue `fn` più volte e restituisce il picco di memoria massimo osservato, in MiB.
+    """
+    fn(io.BytesIO(data))  # esclude dalle misure le allocazioni una tantum
+    peaks = []
+    for _ in range(repeat):
+        tracemalloc.start()
+        fn(io.BytesIO(data))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peaks.append(peak / (1024 * 1024))
+    return {'peak_mib': max(peaks)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Picco di memoria del preprocessing per richiesta")
+    parser.add_argument('image', help="Radiografia di esempio")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as f:
+        data = f.read()
+
+    # Il preprocessing non usa il modello: basta un ModelManager senza pesi caricati
+    model_manager = ModelManager.__new__(ModelManager)
+    model_manager.input_buckets = list(AppConfig.MODEL_INPUT_BUCKETS)
+
+    report = {
+        'image_bytes': len(data),
+        'before': measure_peak(lambda file: legacy_preprocess(model_manager, file), data, args.repeat),
+        'after_display': measure_peak(lambda file: model_manager.preprocess_image(file), data, args.repeat),
+        'after_model_only': measure_peak(
+            lambda file: model_manager.preprocess_image(file, for_display=False), data, args.repeat
+        )
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
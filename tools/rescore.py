@@ -0,0 +1,167 @@
+"""
+Ricalcola le predizioni di tutte le radiografie salvate nel bucket con i pesi correnti del modello.
+
+Vengono rielaborate le immagini `original_image.*` dei pazienti (in tutti i formati di salvataggio) e tutte le immagini sotto `dataset/`.
+I risultati sono scritti in modo incrementale su un file JSONL; rilanciando il comando con lo stesso
+file di output le immagini già elaborate vengono saltate (checkpoint/resume).
+
+Esempio:
+    python -m tools.rescore --output rescore.jsonl --batch-size 16 --prefetch 8
+"""
+import argparse
+import io
+import json
+import os
+import posixpath
+import time
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import datetime
+from typing import Deque, Iterator, List, Optional, Set, Tuple
+from config.app_config import AppConfig
+from factories.manager_factory import ManagerFactory
+from utils.gcs_utils import GCSManager, RADIOGRAPH_IMAGE_EXTENSIONS
+from utils.model_utils import ModelManager
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+def is_rescorable(blob_name: str) -> bool:
+    """
+    Indica se un blob è una radiografia da rielaborare.
+    """
+    name = blob_name.lower()
+    if blob_name.startswith('dataset/'):
+        return name.endswith(IMAGE_EXTENSIONS)
+    return posixpath.basename(name).startswith('original_image') and name.endswith(RADIOGRAPH_IMAGE_EXTENSIONS)
+
+
+def load_checkpoint(output_path: str) -> Set[str]:
+    """
+    Legge dal file di output i nomi dei blob già elaborati.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r') as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)['blob'])
+            except (ValueError, KeyError):
+                # Riga troncata da un'interruzione: l'immagine verrà rielaborata
+                continue
+    return done
+
+
+def fetch_and_preprocess(model_manager: ModelManager, blob) -> Tuple[str, Optional[np.ndarray], Optional[str]]:
+    """
+    Scarica e preprocessa un'immagine (eseguito nei thread di prefetch).
+    """
+    try:
+        data = blob.download_as_bytes()
+        img_array, _ = model_manager.preprocess_image(io.BytesIO(data), for_display=False)
+        return blob.name, img_array, None
+    except Exception as e:
+        return blob.name, None, str(e)
+
+
+def prefetch(executor: ThreadPoolExecutor,
+             model_manager: ModelManager,
+             blobs: Iterator,
+             depth: int) -> Iterator[Tuple[str, Optional[np.ndarray], Optional[str]]]:
+    """
+    Mantiene fino a `depth` download/decodifiche in corso, restituendo i risultati in ordine.
+    """
+    pending: Deque[Future] = deque()
+    for blob in blobs:
+        pending.append(executor.submit(fetch_and_preprocess, model_manager, blob))
+        if len(pending) >= depth:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def score_batch(model_manager: ModelManager, batch: List[Tuple[str, np.ndarray]]) -> List[Tuple[str, np.ndarray]]:
+    """
+    Esegue l'inferenza batch, raggruppando le immagini con la stessa risoluzione.
+    """
+    groups = {}
+    for name, img_array in batch:
+        groups.setdefault(img_array.shape[1:], []).append((name, img_array))
+
+    results = []
+    for items in groups.values():
+        probabilities = model_manager.predict_batch(np.concatenate([img for _, img in items], axis=0))
+        results.extend((name, probabilities[i]) for i, (name, _) in enumerate(items))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ricalcolo offline delle predizioni sul bucket")
+    parser.add_argument('--output', required=True, help="File JSONL dei risultati (usato anche come checkpoint)")
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--prefetch', type=int, default=8, help="Download/decodifiche concorrenti")
+    parser.add_argument('--prefix', action='append', help="Prefissi da elaborare (default: intero bucket)")
+    parser.add_argument('--limit', type=int, default=None, help="Numero massimo di immagini da elaborare")
+    args = parser.parse_args()
+
+    os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", AppConfig.GCS_CRED_PATH)
+    gcs_manager = GCSManager(AppConfig.GCS_BUCKET_NAME)
+    model, model_version = gcs_manager.load_model_with_version(AppConfig.MODEL_PATH)
+    model_manager = ManagerFactory.create_model_manager(model, model_version)
+
+    done = load_checkpoint(args.output)
+    print(f"Immagini già elaborate: {len(done)}")
+
+    def pending_blobs():
+        count = 0
+        for prefix in args.prefix or [None]:
+            for blob in gcs_manager.iter_blobs(prefix):
+                if blob.name in done or not is_rescorable(blob.name):
+                    continue
+                if args.limit is not None and count >= args.limit:
+                    return
+                count += 1
+                yield blob
+
+    processed, failed = 0, 0
+    started_at = time.perf_counter()
+    with open(args.output, 'a') as output, ThreadPoolExecutor(max_workers=args.prefetch) as executor:
+        def flush(batch):
+            nonlocal processed
+            for name, probabilities in score_batch(model_manager, batch):
+                predicted_class = int(np.argmax(probabilities))
+                output.write(json.dumps({
+                    'blob': name,
+                    'predicted_class': predicted_class,
+                    'confidence': float(probabilities[predicted_class]),
+                    'probabilities': [float(p) for p in probabilities],
+                    'model_version': model_version,
+                    'scored_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                }) + '\n')
+            output.flush()
+            processed += len(batch)
+            elapsed = time.perf_counter() - started_at
+            print(f"Elaborate {processed} immagini ({processed / elapsed:.2f} img/s), errori: {failed}")
+
+        batch: List[Tuple[str, np.ndarray]] = []
+        for name, img_array, error in prefetch(executor, model_manager, pending_blobs(), args.prefetch):
+            if error is not None:
+                failed += 1
+                print(f"Errore su {name}: {error}")
+                continue
+            batch.append((name, img_array))
+            if len(batch) >= args.batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+
+    elapsed = time.perf_counter() - started_at
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    print(f"Completato: {processed} immagini in {elapsed:.1f}s ({rate:.2f} img/s), errori: {failed}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Any, Iterator, Optional
+
+class AdmissionRejectedException(Exception):
+    """Richiesta rifiutata perché la coda di ammissione all'inferenza è piena."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+@dataclass
+class AdmissionTicket:
+    """
+    Esito dell'ammissione di una richiesta; lo slot resta occupato fino a `release()`.
+    `detached` indica che il rilascio è affidato a un job in background.
+    """
+    queue_wait_s: float
+    degraded: bool
+    detached: bool = False
+    _controller: Optional['AdmissionController'] = field(default=None, repr=False)
+    _started_at: float = field(default=0.0, repr=False)
+    _released: bool = field(default=False, repr=False)
+
+    def release(self) -> None:
+        """
+        Libera lo slot della richiesta; le chiamate successive alla prima non hanno effetto.
+        """
+        if self._controller is not None:
+            self._controller._release(self)
+
+class AdmissionController:
+    """
+    Controllo di ammissione per l'inferenza: al più `max_concurrency` richieste elaborano immagini
+    contemporaneamente e al più `max_queue` attendono il proprio turno; oltre questo limite le
+    richieste vengono rifiutate subito (429), invece di accumulare immagini decodificate in memoria.
+
+    Quando l'attesa in coda (media mobile esponenziale) supera `latency_target_ms` il sistema entra
+    in modalità degradata: le richieste ammesse saltano la Grad-CAM e ricevono solo classe e fiducia.
+    """
+
+    def __init__(self,
+                 max_concurrency: int = 4,
+                 max_queue: int = 16,
+                 latency_target_ms: float = 2000.0,
+                 queue_timeout_s: float = 30.0,
+                 smoothing: float = 0.2,
+                 wait_half_life_s: float = 5.0):
+        """
+        Args:
+            max_concurrency: Numero massimo di richieste in elaborazione.
+            max_queue: Numero massimo di richieste in attesa.
+            latency_target_ms: Attesa in coda oltre la quale la Grad-CAM viene saltata (0 per disabilitare).
+            queue_timeout_s: Attesa massima in coda prima del rifiuto, in secondi.
+            smoothing: Peso dell'ultima osservazione nella media mobile dell'attesa.
+            wait_half_life_s: Tempo di dimezzamento della media dell'attesa in assenza di nuove
+                richieste, così che dopo un picco la modalità degradata non resti attiva a coda vuota.
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.latency_target_ms = latency_target_ms
+        self.queue_timeout_s = queue_timeout_s
+        self.smoothing = smoothing
+        self.wait_half_life_s = wait_half_life_s
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._active = 0
+        self._avg_wait_s = 0.0
+        self._avg_wait_updated_at = time.monotonic()
+        self._avg_service_s = 0.0
+        self._admitted = 0
+        self._rejected = 0
+        self._degraded = 0
+
+
+    @contextmanager
+    def admit(self) -> Iterator[AdmissionTicket]:
+        """
+        Ammette una richiesta, attendendo uno slot libero, e lo rilascia all'uscita dal blocco.
+
+        Yields:
+            AdmissionTicket: Attesa in coda e indicazione della modalità degradata.
+
+        Raises:
+            AdmissionRejectedException: Se la coda è piena o l'attesa supera `queue_timeout_s`.
+        """
+        ticket = self.acquire()
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+
+    def acquire(self) -> AdmissionTicket:
+        """
+        Ammette una richiesta, attendendo uno slot libero; lo slot va liberato con `ticket.release()`
+        (anche da un altro thread, es. al termine di un job in background).
+
+        Returns:
+            AdmissionTicket: Attesa in coda e indicazione della modalità degradata.
+
+        Raises:
+            AdmissionRejectedException: Se la coda è piena o l'attesa supera `queue_timeout_s`.
+        """
+        with self._lock:
+            if self._waiting >= self.max_queue and self._active >= self.max_concurrency:
+                self._rejected += 1
+                raise AdmissionRejectedException("Troppe richieste di analisi in corso", self._retry_after())
+            self._waiting += 1
+
+        started_at = time.monotonic()
+        acquired = self._slots.acquire(timeout=self.queue_timeout_s)
+        queue_wait = time.monotonic() - started_at
+        with self._lock:
+            self._waiting -= 1
+            if not acquired:
+                self._rejected += 1
+                raise AdmissionRejectedException("Tempo di attesa in coda scaduto", self._retry_after())
+            self._active += 1
+            self._admitted += 1
+            now = time.monotonic()
+            self._avg_wait_s = self._decayed_avg_wait(now)
+            self._avg_wait_s += self.smoothing * (queue_wait - self._avg_wait_s)
+            self._avg_wait_updated_at = now
+            degraded = self._overloaded(queue_wait)
+            if degraded:
+                self._degraded += 1
+
+        return AdmissionTicket(queue_wait, degraded, _controller=self, _started_at=time.monotonic())
+
+
+    def _release(self, ticket: AdmissionTicket) -> None:
+        service_time = time.monotonic() - ticket._started_at
+        with self._lock:
+            if ticket._released:
+                return
+            ticket._released = True
+            self._active -= 1
+            self._avg_service_s += self.smoothing * (service_time - self._avg_service_s)
+        self._slots.release()
+
+
+    def _overloaded(self, queue_wait: float) -> bool:
+        """
+        Indica se l'attesa in coda supera l'obiettivo di latenza (da chiamare con il lock).
+        """
+        if self.latency_target_ms <= 0:
+            return False
+        avg_wait = self._decayed_avg_wait(time.monotonic())
+        return 1000.0 * max(queue_wait, avg_wait) > self.latency_target_ms
+
+
+    def _decayed_avg_wait(self, now: float) -> float:
+        """
+        Media dell'attesa in coda attenuata in base al tempo trascorso dall'ultimo aggiornamento
+        (da chiamare con il lock).
+        """
+        if self.wait_half_life_s <= 0:
+            return self._avg_wait_s
+        elapsed = now - self._avg_wait_updated_at
+        return self._avg_wait_s * 0.5 ** (elapsed / self.wait_half_life_s)
+
+
+    def _retry_after(self) -> int:
+        """
+        Stima in secondi il tempo necessario a smaltire la coda attuale (da chiamare con il lock).
+        """
+        pending = self._waiting + self._active
+        return max(1, math.ceil(pending * self._avg_service_s / self.max_concurrency))
+
+
+    def retry_after(self) -> int:
+        """
+        Stima in secondi il tempo necessario a smaltire le richieste in coda e in elaborazione.
+        """
+        with self._lock:
+            return self._retry_after()
+
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Restituisce lo stato del controllo di ammissione.
+
+        Returns:
+            Dict[str, Any]: Richieste in coda e in elaborazione, contatori e attese medie.
+        """
+        with self._lock:
+            return {
+                'max_concurrency': self.max_concurrency,
+                'max_queue': self.max_queue,
+                'active': self._active,
+                'waiting': self._waiting,
+                'admitted': self._admitted,
+                'rejected': self._rejected,
+                'degraded': self._degraded,
+                'overloaded': self._overloaded(0.0),
+                'avg_queue_wait_ms': 1000.0 * self._decayed_avg_wait(time.monotonic()),
+                'avg_service_ms': 1000.0 * self._avg_service_s,
+                'latency_target_ms': self.latency_target_ms
+            }
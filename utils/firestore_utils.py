@@ -1,6 +1,31 @@
 from firebase_admin import firestore, auth
-from typing import Dict, List, Optional, Any, Tuple
-from datetime import datetime
+from google.api_core.exceptions import AlreadyExists
+from typing import Dict, List, Optional, Any, Tuple, Callable
+from datetime import datetime, timezone
+
+# Campi del catalogo delle radiografie (collezione 'radiographs') ed etichette corrispondenti in info.txt
+RADIOGRAPH_INFO_FIELDS = (
+    ('UID paziente', 'patientId'),
+    ('Nome paziente', 'patientName'),
+    ('Cognome paziente', 'patientSurname'),
+    ('Data di nascita paziente', 'patientBirthdate'),
+    ('Codice fiscale paziente', 'patientTaxCode'),
+    ('Indirizzo paziente', 'patientAddress'),
+    ('CAP paziente', 'patientCapCode'),
+    ('Genere paziente', 'patientGender'),
+    ('ID radiografia', 'radiographId'),
+    ('Data di caricamento', 'uploadedAt'),
+    ('Classe predetta', 'prediction'),
+    ('Lato del ginocchio', 'side'),
+    ('Confidenza', 'confidence'),
+    ('Radiografia caricata da', 'doctorName'),
+    ('UID dottore', 'doctorUid'),
+    ('Codice identificativo dottore', 'doctorID'),
+    ('Versione modello', 'modelVersion')
+)
+
+# Formato della data di caricamento in info.txt
+RADIOGRAPH_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
 
 class FirestoreManager:
     def __init__(self, db: firestore.Client):
@@ -281,3 +306,180 @@ class FirestoreManager:
         except Exception as e:
             print(f"Errore nel recupero delle informazioni del paziente: {str(e)}")
             return {}
+
+
+    # Funzioni per l'allocazione degli indici delle radiografie
+    def allocate_radiograph_index(self, patient_id: str, seed: Callable[[], int]) -> int:
+        """
+        Assegna in modo atomico l'indice della prossima cartella Radiografia{N} di un paziente,
+        tramite un contatore per paziente incrementato in una transazione: richieste concorrenti
+        ottengono sempre indici diversi.
+
+        Args:
+            patient_id: ID del paziente.
+            seed: Funzione che restituisce l'ultimo indice già usato, chiamata solo alla creazione
+                del contatore (es. per i pazienti con radiografie caricate prima del contatore).
+
+        Returns:
+            int: Indice assegnato.
+        """
+        doc_ref = self.db.collection('radiograph_counters').document(patient_id)
+        if not doc_ref.get().exists:
+            try:
+                doc_ref.create({'lastIndex': seed(), 'createdAt': firestore.SERVER_TIMESTAMP})
+            except AlreadyExists:
+                # Contatore creato nel frattempo da un'altra richiesta
+                pass
+
+        @firestore.transactional
+        def increment(transaction) -> int:
+            snapshot = doc_ref.get(transaction=transaction)
+            next_index = snapshot.get('lastIndex') + 1
+            transaction.update(doc_ref, {'lastIndex': next_index, 'updatedAt': firestore.SERVER_TIMESTAMP})
+            return next_index
+
+        return increment(self.db.transaction())
+
+
+    # Funzioni per il catalogo delle radiografie
+    def save_radiograph_record(self, record: Dict[str, Any]) -> str:
+        """
+        Salva (o sostituisce) la scheda di una radiografia nel catalogo.
+
+        Args:
+            record: Scheda della radiografia (vedi RADIOGRAPH_INFO_FIELDS), con 'patientId' e 'index'.
+
+        Returns:
+            str: ID del documento nel catalogo.
+        """
+        doc_id = self.radiograph_record_id(record['patientId'], record['index'])
+        self.db.collection('radiographs').document(doc_id).set(record)
+        return doc_id
+
+
+    def get_radiograph_record(self, patient_id: str, index: int) -> Optional[Dict[str, Any]]:
+        """
+        Recupera la scheda di una radiografia dal catalogo.
+
+        Args:
+            patient_id: ID del paziente.
+            index: Indice della radiografia.
+
+        Returns:
+            Optional[Dict[str, Any]]: Scheda della radiografia, o `None` se non è nel catalogo.
+        """
+        return self.get_document('radiographs', self.radiograph_record_id(patient_id, index))
+
+
+    def query_radiograph_records(self,
+                                 patient_id: str,
+                                 doctor_uid: Optional[str] = None,
+                                 predicted_class: Optional[int] = None,
+                                 date_from: Optional[datetime] = None,
+                                 date_to: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """
+        Cerca nel catalogo le radiografie di un paziente, con filtri opzionali.
+        Le combinazioni di filtri con intervallo di date richiedono un indice composito su Firestore.
+
+        Args:
+            patient_id: ID del paziente.
+            doctor_uid: (Opzionale) UID del dottore che ha caricato la radiografia.
+            predicted_class: (Opzionale) Indice della classe predetta.
+            date_from: (Opzionale) Data di caricamento minima (inclusa).
+            date_to: (Opzionale) Data di caricamento massima (esclusa).
+
+        Returns:
+            List[Dict[str, Any]]: Schede delle radiografie, ordinate per indice.
+        """
+        conditions = [('patientId', '==', patient_id)]
+        if doctor_uid:
+            conditions.append(('doctorUid', '==', doctor_uid))
+        if predicted_class is not None:
+            conditions.append(('predictedClass', '==', predicted_class))
+        if date_from is not None:
+            conditions.append(('uploadedAt', '>=', date_from))
+        if date_to is not None:
+            conditions.append(('uploadedAt', '<', date_to))
+        records = self.query_documents('radiographs', conditions)
+        return sorted(records, key=lambda record: record['index'])
+
+
+    def list_radiograph_record_indices(self, patient_id: str) -> List[int]:
+        """
+        Restituisce gli indici delle radiografie di un paziente presenti nel catalogo,
+        leggendo dei documenti solo il campo 'index'.
+
+        Args:
+            patient_id: ID del paziente.
+
+        Returns:
+            List[int]: Indici delle radiografie nel catalogo.
+        """
+        query = self.db.collection('radiographs').where('patientId', '==', patient_id).select(['index'])
+        return [doc.get('index') for doc in query.stream()]
+
+
+    @staticmethod
+    def radiograph_record_id(patient_id: str, index: int) -> str:
+        """
+        ID del documento del catalogo per la radiografia di indice `index` di un paziente.
+        """
+        return f"{patient_id}_{index}"
+
+
+    @staticmethod
+    def format_radiograph_info(record: Dict[str, Any]) -> str:
+        """
+        Compone il contenuto del file info.txt di una radiografia dalla sua scheda.
+
+        Args:
+            record: Scheda della radiografia.
+
+        Returns:
+            str: Contenuto di info.txt.
+        """
+        lines = []
+        for label, field in RADIOGRAPH_INFO_FIELDS:
+            value = record.get(field)
+            if field == 'uploadedAt':
+                # info.txt riporta l'ora locale del server, come i file creati prima del catalogo
+                value = value.astimezone().strftime(RADIOGRAPH_DATE_FORMAT)
+            elif field == 'confidence':
+                value = f"{value:.2f}"
+            elif field == 'modelVersion':
+                value = value or 'sconosciuta'
+            lines.append(f"{label}: {value}\n")
+        return ''.join(lines)
+
+
+    @staticmethod
+    def radiograph_record_from_info(info: Dict[str, str], class_labels: Dict[int, str]) -> Dict[str, Any]:
+        """
+        Converte le informazioni lette da un file info.txt nella scheda del catalogo
+        (senza indice e percorsi dei file, che dipendono dalla cartella della radiografia).
+
+        Args:
+            info: Coppie etichetta/valore di info.txt.
+            class_labels: Etichette delle classi per indice, per ricavare l'indice della classe predetta.
+
+        Returns:
+            Dict[str, Any]: Scheda della radiografia.
+        """
+        record: Dict[str, Any] = {field: info.get(label, '') for label, field in RADIOGRAPH_INFO_FIELDS}
+        try:
+            # La data di info.txt è nell'ora locale del server; nel catalogo viene salvata in UTC
+            record['uploadedAt'] = datetime.strptime(
+                record['uploadedAt'], RADIOGRAPH_DATE_FORMAT
+            ).astimezone(timezone.utc)
+        except ValueError:
+            record['uploadedAt'] = None
+        try:
+            record['confidence'] = float(record['confidence'])
+        except ValueError:
+            record['confidence'] = None
+        if record['modelVersion'] in ('', 'sconosciuta'):
+            record['modelVersion'] = None
+        record['predictedClass'] = next(
+            (class_index for class_index, label in class_labels.items() if label == record['prediction']), None
+        )
+        return record
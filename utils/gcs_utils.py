@@ -1,9 +1,23 @@
+import google.auth
+import requests
+from google.api_core.exceptions import GoogleAPICallError
+from google.auth.exceptions import TransportError
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage
 from google.cloud.exceptions import NotFound
 from google.oauth2 import service_account
-from typing import Optional, List, Dict, Union, BinaryIO
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+from typing import Optional, List, Dict, Union, BinaryIO, Iterator, Tuple
+from urllib.parse import urlparse, unquote
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import threading
+import time
 import io
+import os
+import re
+import shutil
 import cv2
 import numpy as np
 from dataclasses import dataclass
@@ -11,6 +25,16 @@ from pathlib import Path
 from tensorflow.keras.models import load_model
 import h5py
 from config.app_config import AppConfig
+from utils.image_encoding import IMAGE_FORMATS, EncodingPolicy
+
+# Estensioni con cui possono essere salvate le immagini delle radiografie
+RADIOGRAPH_IMAGE_EXTENSIONS = tuple(extension for extension, _ in IMAGE_FORMATS.values())
+
+# Durata massima di un URL firmato V4 (7 giorni)
+_MAX_SIGNED_URL_TTL_S = 7 * 24 * 3600
+
+# Nome di un file dentro una cartella Radiografia{N}: gruppo 1 l'indice, gruppo 2 il nome del file
+_RADIOGRAPH_FILE_PATTERN = re.compile(r'^[^/]+/Radiografia(\d+)/([^/]+)$')
 
 @dataclass
 class BlobInfo:
@@ -20,10 +44,43 @@ class BlobInfo:
     created_at: datetime
     content_type: Optional[str]
 
+@dataclass
+class UploadArtifact:
+    """File da caricare con `GCSManager.upload_many`."""
+    name: str
+    file: Union[BinaryIO, io.BytesIO]
+    destination_path: str
+    content_type: Optional[str] = None
+    make_public: bool = False
+
+@dataclass
+class UploadResult:
+    """Esito del caricamento di un file con `GCSManager.upload_many`."""
+    name: str
+    destination_path: str
+    url: Optional[str] = None
+    attempts: int = 0
+    duration_ms: float = 0.0
+    error: Optional[str] = None
+
 class GCSManagerException(Exception):
     """Classe personalizzata per le eccezioni del GCS Manager."""
     pass
 
+class GCSTransientException(GCSManagerException):
+    """Errore temporaneo di GCS (5xx, 429 o di connessione): l'operazione può essere ritentata."""
+    pass
+
+
+def _is_transient_error(error: Exception) -> bool:
+    """
+    Indica se un errore di GCS è temporaneo: risposte 429 e 5xx, errori di connessione e timeout.
+    """
+    if isinstance(error, GoogleAPICallError):
+        return error.code is not None and (error.code == 429 or error.code >= 500)
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                              TransportError, ConnectionError, TimeoutError))
+
 class GCSManager:
     """
     Gestore per le operazioni su Google Cloud Storage.
@@ -44,9 +101,31 @@ class GCSManager:
             credentials = service_account.Credentials.from_service_account_file(
                 AppConfig.GCS_CRED_PATH
             )
-            self.storage_client = storage.Client()
+            # Tutti i thread condividono la sessione HTTP del client: il pool di connessioni deve
+            # bastare per letture e caricamenti concorrenti (il default di requests è 10)
+            pool_size = AppConfig.GCS_IO_WORKERS + AppConfig.GCS_UPLOAD_WORKERS
+            client_credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+            session = AuthorizedSession(client_credentials)
+            session.mount("https://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+            self.storage_client = storage.Client(project=project, credentials=client_credentials, _http=session)
             self.bucket = self.storage_client.bucket(bucket_name)
             self.bucket_name = bucket_name
+            # Le credenziali del service account firmano localmente gli URL di accesso ai file
+            self.credentials = credentials
+            self.signed_url_ttl = min(AppConfig.GCS_SIGNED_URL_TTL_S, _MAX_SIGNED_URL_TTL_S)
+            self.signed_url_refresh_margin = AppConfig.GCS_SIGNED_URL_REFRESH_MARGIN_S
+            self._signed_urls: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+            self._signed_urls_lock = threading.Lock()
+            # Pool limitato per le richieste concorrenti al bucket (es. lettura di più info.txt)
+            self._io_executor = ThreadPoolExecutor(
+                max_workers=AppConfig.GCS_IO_WORKERS, thread_name_prefix="gcs-io"
+            )
+            # Pool per i caricamenti concorrenti (upload_many), separato da quello delle letture
+            self._upload_executor = ThreadPoolExecutor(
+                max_workers=AppConfig.GCS_UPLOAD_WORKERS, thread_name_prefix="gcs-upload"
+            )
+            self._upload_stats_lock = threading.Lock()
+            self._upload_stats: Dict[str, Dict[str, float]] = {}
         except Exception as e:
             raise GCSManagerException(f"Errore di inizializzazione: {str(e)}")
 
@@ -63,25 +142,125 @@ class GCSManager:
         Args:
             file: File da caricare (file-like object)
             destination_path: Percorso di destinazione nel bucket
-            make_public: Se rendere il file pubblicamente accessibile
+            make_public: Se restituire un URL di accesso al file (firmato, o pubblico con GCS_PUBLIC_URLS)
             content_type: Tipo di contenuto del file
         
         Returns:
-            str: URL pubblico del file se make_public=True, altrimenti path del blob
+            str: URL di accesso al file se make_public=True, altrimenti path del blob
             
         Raises:
+            GCSTransientException: Se il caricamento fallisce per un errore temporaneo (ritentabile)
             GCSManagerException: Se il caricamento fallisce
         """
+        blob = self.bucket.blob(destination_path)
         try:
-            blob = self.bucket.blob(destination_path)
             blob.upload_from_file(file, content_type=content_type, rewind=True)
-            
+        except Exception as e:
+            if _is_transient_error(e):
+                raise GCSTransientException(f"Errore temporaneo nel caricamento del file: {str(e)}")
+            raise GCSManagerException(f"Errore nel caricamento del file: {str(e)}")
+
+        # Gli errori successivi al caricamento (ACL, firma dell'URL) non vanno ritentati ricaricando il file
+        try:
             if make_public:
-                blob.make_public()
-                return blob.public_url
+                if AppConfig.GCS_PUBLIC_URLS:
+                    blob.make_public()
+                return self.get_url(blob)
             return destination_path
         except Exception as e:
-            raise GCSManagerException(f"Errore nel caricamento del file: {str(e)}")
+            raise GCSManagerException(f"Errore nella pubblicazione del file caricato: {str(e)}")
+
+
+    def upload_many(self, artifacts: List[UploadArtifact]) -> Dict[str, UploadResult]:
+        """
+        Carica più file in parallelo sul pool di caricamento del manager. Ogni file viene ritentato
+        singolarmente (fino a GCS_UPLOAD_RETRIES volte, con attesa esponenziale) senza ripetere gli altri.
+
+        Args:
+            artifacts: File da caricare (i nomi devono essere univoci)
+
+        Returns:
+            Dict[str, UploadResult]: Esito (URL o path, tentativi, durata) per nome del file
+
+        Raises:
+            GCSManagerException: Se almeno un file non viene caricato dopo tutti i tentativi
+                (gli altri caricamenti vengono comunque completati)
+        """
+        futures = {
+            artifact.name: self._upload_executor.submit(self._upload_with_retry, artifact)
+            for artifact in artifacts
+        }
+        results = {name: future.result() for name, future in futures.items()}
+        self._record_uploads(results.values())
+
+        failed = [result for result in results.values() if result.error is not None]
+        if failed:
+            details = "; ".join(f"{result.name}: {result.error}" for result in failed)
+            raise GCSManagerException(f"Caricamento non riuscito ({details})")
+        return results
+
+
+    def _upload_with_retry(self, artifact: UploadArtifact) -> UploadResult:
+        """
+        Carica un singolo file ritentando in caso di errore temporaneo; non solleva eccezioni,
+        l'errore finale viene riportato nel risultato.
+        """
+        result = UploadResult(artifact.name, artifact.destination_path)
+        started_at = time.perf_counter()
+        for attempt in range(1, AppConfig.GCS_UPLOAD_RETRIES + 2):
+            result.attempts = attempt
+            try:
+                result.url = self.upload_file(
+                    artifact.file,
+                    artifact.destination_path,
+                    make_public=artifact.make_public,
+                    content_type=artifact.content_type
+                )
+                result.error = None
+                break
+            except GCSTransientException as e:
+                result.error = str(e)
+                if attempt <= AppConfig.GCS_UPLOAD_RETRIES:
+                    time.sleep(AppConfig.GCS_UPLOAD_RETRY_BACKOFF_S * (2 ** (attempt - 1)))
+            except GCSManagerException as e:
+                # Errori permanenti (4xx) o successivi al caricamento: ritentare non servirebbe
+                result.error = str(e)
+                break
+        result.duration_ms = 1000.0 * (time.perf_counter() - started_at)
+        return result
+
+
+    def _record_uploads(self, results) -> None:
+        with self._upload_stats_lock:
+            for result in results:
+                stats = self._upload_stats.setdefault(
+                    result.name, {'count': 0, 'failures': 0, 'retries': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+                )
+                stats['count'] += 1
+                stats['failures'] += 1 if result.error is not None else 0
+                stats['retries'] += result.attempts - 1
+                stats['total_ms'] += result.duration_ms
+                stats['max_ms'] = max(stats['max_ms'], result.duration_ms)
+
+
+    def get_upload_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Restituisce le statistiche dei caricamenti di upload_many per tipo di file.
+
+        Returns:
+            Dict[str, Dict[str, float]]: Caricamenti, errori, tentativi ripetuti e durata media/massima
+        """
+        with self._upload_stats_lock:
+            return {
+                name: {
+                    'count': stats['count'],
+                    'failures': stats['failures'],
+                    'retries': stats['retries'],
+                    'avg_ms': stats['total_ms'] / stats['count'] if stats['count'] else 0.0,
+                    'max_ms': stats['max_ms']
+                }
+                for name, stats in self._upload_stats.items()
+            }
 
 
     def download_file(self, source_path: str) -> io.BytesIO:
@@ -109,6 +288,82 @@ class GCSManager:
             raise GCSManagerException(f"Errore nel download del file: {str(e)}")
 
 
+    def get_blob(self, blob_path: str) -> Optional[storage.Blob]:
+        """
+        Recupera i metadati di un blob (dimensione, generazione, tipo di contenuto) senza scaricarlo.
+
+        Args:
+            blob_path: Percorso del blob nel bucket
+
+        Returns:
+            Optional[storage.Blob]: Blob con i metadati, o None se non esiste
+
+        Raises:
+            GCSManagerException: Se la richiesta dei metadati fallisce
+        """
+        try:
+            return self.bucket.get_blob(blob_path)
+        except Exception as e:
+            raise GCSManagerException(f"Errore nel recupero dei metadati del file: {str(e)}")
+
+
+    def iter_blob_range(self, blob: storage.Blob, start: int, stop: int,
+                        chunk_size: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Scarica un intervallo di byte di un blob a blocchi, senza tenere in memoria l'intero file.
+        Se il blob ha una generazione (es. ottenuto con get_blob), tutti i blocchi vengono letti
+        dalla stessa versione del file anche se nel frattempo viene sovrascritto.
+
+        Args:
+            blob: Blob da scaricare
+            start: Primo byte dell'intervallo (incluso)
+            stop: Ultimo byte dell'intervallo (escluso)
+            chunk_size: Dimensione dei blocchi (default GCS_DOWNLOAD_CHUNK_BYTES)
+
+        Yields:
+            bytes: Blocchi consecutivi dell'intervallo
+
+        Raises:
+            GCSManagerException: Se il download di un blocco fallisce
+        """
+        chunk_size = chunk_size or AppConfig.GCS_DOWNLOAD_CHUNK_BYTES
+        position = start
+        while position < stop:
+            chunk_end = min(position + chunk_size, stop)
+            try:
+                # end è incluso; il checksum non è verificabile su un intervallo parziale
+                chunk = blob.download_as_bytes(start=position, end=chunk_end - 1, checksum=None)
+            except Exception as e:
+                raise GCSManagerException(f"Errore nel download del file: {str(e)}")
+            if not chunk:
+                break
+            position += len(chunk)
+            yield chunk
+
+
+    def blob_path_from_url(self, url: str) -> Optional[str]:
+        """
+        Ricava il percorso di un blob del bucket da un suo URL (firmato, pubblico o gs://).
+
+        Args:
+            url: URL del file
+
+        Returns:
+            Optional[str]: Percorso del blob, o None se l'URL non riguarda un file di questo bucket
+        """
+        parsed = urlparse(url)
+        if parsed.scheme == 'gs':
+            path = parsed.path.lstrip('/') if parsed.netloc == self.bucket_name else None
+        elif parsed.scheme == 'https' and parsed.netloc in ('storage.googleapis.com', 'storage.cloud.google.com'):
+            prefix = f"/{self.bucket_name}/"
+            path = parsed.path[len(prefix):] if parsed.path.startswith(prefix) else None
+        elif parsed.scheme == 'https' and parsed.netloc == f"{self.bucket_name}.storage.googleapis.com":
+            path = parsed.path.lstrip('/')
+        else:
+            path = None
+        return unquote(path) if path else None
+
+
     def delete_file(self, file_path: str) -> bool:
         """
         Elimina un file dal bucket GCS.
@@ -130,6 +385,26 @@ class GCSManager:
             raise GCSManagerException(f"Errore nell'eliminazione del file: {str(e)}")
 
 
+    def iter_blobs(self, prefix: Optional[str] = None) -> Iterator[storage.Blob]:
+        """
+        Scorre i blob del bucket pagina per pagina, senza caricare l'intero elenco in memoria.
+
+        Args:
+            prefix: Prefisso dei blob da elencare (None per l'intero bucket)
+
+        Yields:
+            storage.Blob: Blob del bucket
+
+        Raises:
+            GCSManagerException: Se l'elenco dei blob fallisce
+        """
+        try:
+            for blob in self.storage_client.list_blobs(self.bucket, prefix=prefix):
+                yield blob
+        except Exception as e:
+            raise GCSManagerException(f"Errore nell'elenco dei file: {str(e)}")
+
+
     # Operazioni Specifiche per il Dominio
     def list_patient_radiographs(self, patient_id: str) -> List[BlobInfo]:
         """
@@ -147,11 +422,10 @@ class GCSManager:
             
             radiographs = []
             for blob in blobs:
-                if 'original_image' in blob.name and blob.name.endswith('.png'):
-                    blob.make_public()
+                if 'original_image' in blob.name and blob.name.endswith(RADIOGRAPH_IMAGE_EXTENSIONS):
                     radiographs.append(BlobInfo(
                         name=blob.name,
-                        url=blob.public_url,
+                        url=self.get_url(blob),
                         created_at=blob.time_created,
                         content_type=blob.content_type
                     ))
@@ -160,6 +434,26 @@ class GCSManager:
             raise GCSManagerException(f"Errore nel recupero delle radiografie: {str(e)}")
 
 
+    def find_radiograph_image(self, patient_id: str, radiograph_idx: int, kind: str) -> Optional[storage.Blob]:
+        """
+        Cerca un'immagine di una radiografia tra i formati con cui può essere stata salvata.
+
+        Args:
+            patient_id: ID del paziente
+            radiograph_idx: Indice della radiografia
+            kind: Tipo di immagine ('original_image' o 'gradcam_image')
+
+        Returns:
+            Optional[storage.Blob]: Blob dell'immagine, o None se assente
+        """
+        base_path = f"{patient_id}/Radiografia{radiograph_idx}/{kind}{radiograph_idx}"
+        for extension in RADIOGRAPH_IMAGE_EXTENSIONS:
+            blob = self.bucket.blob(f"{base_path}{extension}")
+            if blob.exists():
+                return blob
+        return None
+
+
     def get_radiograph_info(self, patient_id: str, radiograph_idx: int) -> Dict[str, str]:
         """
         Recupera le informazioni di una specifica radiografia.
@@ -173,117 +467,323 @@ class GCSManager:
         """
         try:
             path = f"{patient_id}/Radiografia{radiograph_idx}/info.txt"
-            blob = self.bucket.blob(path)
-            info_content = blob.download_as_text()
-            
-            info_dict = {}
-            for line in info_content.splitlines():
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    info_dict[key.strip()] = value.strip()
-            
-            return info_dict
+            return self.parse_radiograph_info(self.bucket.blob(path).download_as_text())
         except Exception as e:
             raise GCSManagerException(f"Errore nel recupero delle informazioni: {str(e)}")
 
 
+    @staticmethod
+    def parse_radiograph_info(info_content: str) -> Dict[str, str]:
+        """
+        Converte il contenuto di un file info.txt (righe 'chiave: valore') in un dizionario.
+        """
+        info_dict = {}
+        for line in info_content.splitlines():
+            if ':' in line:
+                key, value = line.split(':', 1)
+                info_dict[key.strip()] = value.strip()
+        return info_dict
+
+
+    def list_radiograph_folders(self, patient_id: str) -> Dict[int, Dict[str, storage.Blob]]:
+        """
+        Elenca con un'unica lista del bucket i file delle cartelle Radiografia{N} di un paziente,
+        raggruppati per indice.
+
+        Args:
+            patient_id: ID del paziente
+
+        Returns:
+            Dict[int, Dict[str, storage.Blob]]: Per ogni indice, i blob presenti tra 'original_image',
+                'gradcam_image', 'info' e 'heatmaps'
+        """
+        try:
+            folders: Dict[int, Dict[str, storage.Blob]] = {}
+            for blob in self.bucket.list_blobs(prefix=f"{patient_id}/Radiografia"):
+                match = _RADIOGRAPH_FILE_PATTERN.match(blob.name)
+                if not match:
+                    continue
+                index, filename = int(match.group(1)), match.group(2)
+                if filename == 'info.txt':
+                    kind = 'info'
+                elif filename.startswith('heatmaps'):
+                    kind = 'heatmaps'
+                elif filename.endswith(RADIOGRAPH_IMAGE_EXTENSIONS) and filename.startswith(('original_image', 'gradcam_image')):
+                    kind = 'original_image' if filename.startswith('original_image') else 'gradcam_image'
+                else:
+                    continue
+                folders.setdefault(index, {})[kind] = blob
+            return folders
+        except Exception as e:
+            raise GCSManagerException(f"Errore nell'elenco delle radiografie: {str(e)}")
+
+
+    def read_radiograph_infos(self, info_blobs: Dict[int, storage.Blob]) -> Dict[int, Dict[str, str]]:
+        """
+        Scarica e interpreta in parallelo (sul pool limitato del manager) più file info.txt.
+
+        Args:
+            info_blobs: Blob info.txt per indice della radiografia
+
+        Returns:
+            Dict[int, Dict[str, str]]: Informazioni per indice; i file non leggibili vengono omessi
+        """
+        futures = {
+            index: self._io_executor.submit(blob.download_as_text)
+            for index, blob in info_blobs.items()
+        }
+        infos = {}
+        for index, future in futures.items():
+            try:
+                infos[index] = self.parse_radiograph_info(future.result())
+            except Exception as e:
+                print(f"Errore nella lettura di info.txt della radiografia {index}: {str(e)}")
+        return infos
+
+
     def save_radiograph(self, 
                        patient_id: str,
                        original_image: io.BytesIO,
-                       gradcam_image: io.BytesIO,
+                       gradcam_image: Optional[io.BytesIO],
                        info_content: str,
-                       index: int) -> Dict[str, str]:
+                       index: int,
+                       original_format: str = 'png',
+                       gradcam_format: str = 'png',
+                       extra_artifacts: Optional[List[UploadArtifact]] = None) -> Dict[str, str]:
         """
-        Salva una nuova radiografia con le relative informazioni.
+        Salva una nuova radiografia con le relative informazioni, caricando i file in parallelo.
         
         Args:
             patient_id: ID del paziente
             original_image: Immagine originale
-            gradcam_image: Immagine Grad-CAM
+            gradcam_image: Immagine Grad-CAM (None se non generata, es. in caso di sovraccarico)
             info_content: Contenuto del file info
             index: Indice della radiografia
+            original_format: Formato dell'immagine originale ('png', 'webp', 'jpeg')
+            gradcam_format: Formato dell'immagine Grad-CAM ('png', 'webp', 'jpeg')
+            extra_artifacts: Altri file da caricare insieme alla radiografia (es. le heatmap)
             
         Returns:
             Dict[str, str]: URLs dei file caricati
         """
         try:
-            base_path = f"{patient_id}/Radiografia{index}"
-            
-            # Carica l'immagine originale
-            original_url = self.upload_file(
-                original_image, 
-                f"{base_path}/original_image{index}.png",
-                make_public=True,
-                content_type="image/png"
-            )
-            
-            # Carica l'immagine Grad-CAM
-            gradcam_url = self.upload_file(
-                gradcam_image,
-                f"{base_path}/gradcam_image{index}.png",
-                make_public=True,
-                content_type="image/png"
-            )
-            
-            # Carica il file info
-            info_file = io.BytesIO(info_content.encode('utf-8'))
-            info_url = self.upload_file(
-                info_file,
-                f"{base_path}/info.txt",
-                make_public=True,
-                content_type="text/plain"
-            )
-            
+            artifacts = [
+                UploadArtifact('original_image', original_image,
+                               self.radiograph_blob_path(patient_id, index, 'original_image', original_format),
+                               IMAGE_FORMATS[original_format][1], make_public=True),
+                UploadArtifact('info_file', io.BytesIO(info_content.encode('utf-8')),
+                               self.radiograph_blob_path(patient_id, index, 'info'), "text/plain", make_public=True)
+            ]
+            # L'immagine Grad-CAM manca se non è stata generata (es. in caso di sovraccarico)
+            if gradcam_image is not None:
+                artifacts.append(UploadArtifact('gradcam_image', gradcam_image,
+                                                self.radiograph_blob_path(patient_id, index, 'gradcam_image', gradcam_format),
+                                                IMAGE_FORMATS[gradcam_format][1], make_public=True))
+            artifacts.extend(extra_artifacts or [])
+
+            results = self.upload_many(artifacts)
             return {
-                'original_image': original_url,
-                'gradcam_image': gradcam_url,
-                'info_file': info_url
+                'original_image': results['original_image'].url,
+                'gradcam_image': results['gradcam_image'].url if gradcam_image is not None else None,
+                'info_file': results['info_file'].url
             }
         except Exception as e:
             raise GCSManagerException(f"Errore nel salvataggio della radiografia: {str(e)}")
 
 
-    def count_patient_radiographs(self, patient_id: str) -> int:
+    def save_heatmaps(self, patient_id: str, index: int, heatmaps: np.ndarray, probabilities: np.ndarray) -> str:
         """
-        Conta il numero di radiografie per un paziente.
-        
+        Salva le heatmap Grad-CAM di tutte le classi di una radiografia (npz compresso, float16),
+        così che la Grad-CAM di qualsiasi classe possa essere generata senza rieseguire il modello.
+
         Args:
             patient_id: ID del paziente
-            
+            index: Indice della radiografia
+            heatmaps: Heatmap normalizzate (num_classi, h, w)
+            probabilities: Probabilità di tutte le classi
+
         Returns:
-            int: Numero di radiografie
+            str: Percorso del file nel bucket
         """
         try:
-            prefix = f"{patient_id}/"
-            blobs = list(self.bucket.list_blobs(prefix=prefix))
-            folders = set()
-            
-            for blob in blobs:
-                folder_name = '/'.join(blob.name.split('/')[:-1])
-                if folder_name:
-                    folders.add(folder_name)
-            
-            print(" -- folders: ", folders)
-            print(" -- lunghezza folder: ", len(folders))
-            return len(folders)
+            artifact = self.heatmaps_artifact(patient_id, index, heatmaps, probabilities)
+            return self.upload_file(artifact.file, artifact.destination_path, content_type=artifact.content_type)
         except Exception as e:
-            raise GCSManagerException(f"Errore nel conteggio delle radiografie: {str(e)}")
-        
+            raise GCSManagerException(f"Errore nel salvataggio delle heatmap: {str(e)}")
+
+
+    @staticmethod
+    def heatmaps_artifact(patient_id: str, index: int, heatmaps: np.ndarray, probabilities: np.ndarray) -> UploadArtifact:
+        """
+        Prepara il file delle heatmap di una radiografia (npz compresso, float16), da caricare
+        con save_heatmaps o insieme agli altri file in save_radiograph.
+
+        Args:
+            patient_id: ID del paziente
+            index: Indice della radiografia
+            heatmaps: Heatmap normalizzate (num_classi, h, w)
+            probabilities: Probabilità di tutte le classi
+
+        Returns:
+            UploadArtifact: File da caricare
+        """
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            heatmaps=heatmaps.astype(np.float16),
+            probabilities=np.asarray(probabilities, dtype=np.float32)
+        )
+        return UploadArtifact('heatmaps', buffer, GCSManager.radiograph_blob_path(patient_id, index, 'heatmaps'),
+                              "application/octet-stream")
+
+
+    @staticmethod
+    def radiograph_blob_path(patient_id: str, index: int, kind: str, image_format: str = 'png') -> str:
+        """
+        Percorso nel bucket di un file della cartella Radiografia{N} di un paziente.
+
+        Args:
+            patient_id: ID del paziente
+            index: Indice della radiografia
+            kind: 'original_image', 'gradcam_image', 'info' o 'heatmaps'
+            image_format: Formato delle immagini ('png', 'webp', 'jpeg')
+
+        Returns:
+            str: Percorso del file
+        """
+        base_path = f"{patient_id}/Radiografia{index}"
+        if kind == 'info':
+            return f"{base_path}/info.txt"
+        if kind == 'heatmaps':
+            return f"{base_path}/heatmaps{index}.npz"
+        return f"{base_path}/{kind}{index}{IMAGE_FORMATS[image_format][0]}"
+
+
+    def load_heatmaps(self, patient_id: str, index: int) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Carica le heatmap Grad-CAM di tutte le classi salvate con `save_heatmaps`.
+
+        Args:
+            patient_id: ID del paziente
+            index: Indice della radiografia
+
+        Returns:
+            Optional[Dict[str, np.ndarray]]: 'heatmaps' (num_classi, h, w) e 'probabilities',
+                o None se la radiografia non ha heatmap salvate
+        """
+        try:
+            blob = self.bucket.blob(self.radiograph_blob_path(patient_id, index, 'heatmaps'))
+            if not blob.exists():
+                return None
+            with np.load(io.BytesIO(blob.download_as_bytes())) as data:
+                return {
+                    'heatmaps': data['heatmaps'].astype(np.float32),
+                    'probabilities': data['probabilities']
+                }
+        except Exception as e:
+            raise GCSManagerException(f"Errore nel caricamento delle heatmap: {str(e)}")
+
+
+    def list_patient_ids(self) -> List[str]:
+        """
+        Elenca i pazienti con almeno un file nel bucket, elencando solo le cartelle di primo livello.
+
+        Returns:
+            List[str]: ID dei pazienti
+        """
+        try:
+            iterator = self.bucket.list_blobs(delimiter='/')
+            for _ in iterator.pages:
+                pass
+            return sorted(prefix.rstrip('/') for prefix in iterator.prefixes)
+        except Exception as e:
+            raise GCSManagerException(f"Errore nell'elenco dei pazienti: {str(e)}")
+
+
+    def list_radiograph_indices(self, patient_id: str) -> List[int]:
+        """
+        Restituisce gli indici delle cartelle Radiografia{N} di un paziente, elencando solo i prefissi delle cartelle.
+
+        Args:
+            patient_id: ID del paziente
+
+        Returns:
+            List[int]: Indici delle cartelle, in ordine crescente
+        """
+        try:
+            prefix = f"{patient_id}/Radiografia"
+            iterator = self.bucket.list_blobs(prefix=prefix, delimiter='/')
+            for _ in iterator.pages:
+                pass
+            return sorted(
+                int(folder[len(prefix):].rstrip('/'))
+                for folder in iterator.prefixes
+                if folder[len(prefix):].rstrip('/').isdigit()
+            )
+        except Exception as e:
+            raise GCSManagerException(f"Errore nel calcolo dell'indice delle radiografie: {str(e)}")
+
+
+    def get_max_radiograph_index(self, patient_id: str) -> int:
+        """
+        Restituisce l'indice più alto tra le cartelle Radiografia{N} di un paziente (0 se non ce ne sono).
+
+        Args:
+            patient_id: ID del paziente
+
+        Returns:
+            int: Indice più alto
+        """
+        return max(self.list_radiograph_indices(patient_id), default=0)
+
 
-    def load_model(self, model_path):
+    def load_model(self, model_path, generation: Optional[str] = None):
         """
         Carica un modello Keras da Google Cloud Storage.
+        Se è configurata una cache locale (MODEL_CACHE_DIR) il file viene scaricato solo quando
+        il blob cambia (generation/MD5) e, opzionalmente, convertito una tantum in SavedModel.
         
         Args:
             model_path: Percorso del modello nel bucket (es. 'MODELLO/pesi.h5')
+            generation: Versione del blob da caricare (None per la versione attuale)
         Returns:
             Il modello Keras caricato
         """
+        model, _ = self.load_model_with_version(model_path, generation)
+        return model
+
+
+    def load_model_with_version(self, model_path: str, generation: Optional[str] = None) -> Tuple[object, Optional[str]]:
+        """
+        Carica un modello Keras da Google Cloud Storage insieme alla sua versione (generation del blob).
+        La versione restituita è quella dei metadati usati per il download, eseguito con
+        if_generation_match: se il blob viene sostituito nel frattempo il caricamento fallisce
+        invece di restituire pesi diversi dalla versione dichiarata.
+
+        Args:
+            model_path: Percorso del modello nel bucket (es. 'MODELLO/pesi.h5')
+            generation: Versione del blob da caricare (None per leggere la versione attuale)
+
+        Returns:
+            Tuple[object, Optional[str]]: Modello Keras caricato e versione
+
+        Raises:
+            GCSManagerException: Se il caricamento fallisce o il blob non è più alla versione indicata
+        """
         try:
-            # Scarica i dati in memoria
             blob = self.bucket.blob(model_path)
+            if generation is None:
+                blob.reload()
+                generation = str(blob.generation) if blob.generation else None
+            if_generation_match = int(generation) if generation else None
+
+            if AppConfig.MODEL_CACHE_DIR:
+                model = self._load_cached_model(blob, generation, AppConfig.MODEL_CACHE_DIR)
+                return model, generation
+
+            # Scarica i dati in memoria
             model_bytes = io.BytesIO()
-            blob.download_to_file(model_bytes)
+            blob.download_to_file(model_bytes, if_generation_match=if_generation_match)
             model_bytes.seek(0)
 
             # Carica il modello direttamente dal buffer
@@ -291,42 +791,210 @@ class GCSManager:
                 model = load_model(h5file)
 
             print("Modello caricato correttamente dalla memoria!")
-            return model
+            return model, generation
             
         except Exception as e:
             raise GCSManagerException(f"Errore nel caricamento del modello: {str(e)}")
+
+
+    def _load_cached_model(self, blob: storage.Blob, generation: Optional[str], cache_dir: str):
+        """
+        Carica il modello dalla cache locale, aggiornandola solo se il blob è cambiato.
+
+        Args:
+            blob: Blob del modello (con i metadati caricati se generation è None)
+            generation: Versione del blob da caricare
+            cache_dir: Cartella locale della cache
+
+        Returns:
+            Il modello Keras caricato
+        """
+        version = generation if generation else blob.md5_hash.replace('/', '_').replace('+', '-')
+        stem = Path(blob.name).stem
+        base_path = os.path.join(cache_dir, f"{stem}-{version}")
+        h5_path = f"{base_path}.h5"
+        savedmodel_path = f"{base_path}.savedmodel"
+        os.makedirs(cache_dir, exist_ok=True)
+
+        if AppConfig.MODEL_CACHE_SAVEDMODEL and os.path.isdir(savedmodel_path):
+            self._touch_cache_entry(savedmodel_path)
+            model = load_model(savedmodel_path)
+            print(f"Modello caricato dalla cache locale (SavedModel): {savedmodel_path}")
+            return model
+
+        if not os.path.exists(h5_path):
+            # Download su file temporaneo e rename atomico: più processi possono aggiornare la cache insieme
+            tmp_path = f"{h5_path}.{os.getpid()}.tmp"
+            blob.download_to_filename(tmp_path, if_generation_match=int(generation) if generation else None)
+            os.replace(tmp_path, h5_path)
+            self._prune_model_cache(cache_dir, stem, keep=base_path)
+            print(f"Modello scaricato nella cache locale: {h5_path}")
+        else:
+            self._touch_cache_entry(h5_path)
+
+        model = load_model(h5_path)
+
+        if AppConfig.MODEL_CACHE_SAVEDMODEL and not os.path.isdir(savedmodel_path):
+            tmp_dir = f"{savedmodel_path}.{os.getpid()}.tmp"
+            try:
+                model.save(tmp_dir, save_format='tf')
+                os.replace(tmp_dir, savedmodel_path)
+                print(f"Modello convertito in SavedModel: {savedmodel_path}")
+            except Exception as e:
+                # Se un altro processo ha completato la conversione per primo la cartella esiste già;
+                # in ogni altro caso la conversione è solo un'ottimizzazione e si continua con il file .h5
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                if not os.path.isdir(savedmodel_path):
+                    print(f"Conversione in SavedModel non riuscita, si usa il file .h5: {str(e)}")
+
+        print(f"Modello caricato dalla cache locale: {h5_path}")
+        return model
+
+
+    @staticmethod
+    def _touch_cache_entry(path: str) -> None:
+        """
+        Aggiorna la data di modifica di una voce della cache, usata come data dell'ultimo utilizzo.
+        """
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+
+    @staticmethod
+    def _prune_model_cache(cache_dir: str, stem: str, keep: str) -> None:
+        """
+        Elimina dalla cache locale le versioni precedenti del modello non utilizzate da almeno
+        MODEL_CACHE_PRUNE_GRACE_S secondi: la cartella è condivisa dai processi worker, che
+        potrebbero stare ancora scaricando o caricando un'altra versione.
+        """
+        threshold = time.time() - AppConfig.MODEL_CACHE_PRUNE_GRACE_S
+        for entry in os.scandir(cache_dir):
+            if not entry.name.startswith(f"{stem}-") or entry.path.startswith(keep):
+                continue
+            try:
+                if entry.stat().st_mtime > threshold:
+                    continue
+            except OSError:
+                continue
+            if entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+        
+
+    def get_model_version(self, model_path: str) -> Optional[str]:
+        """
+        Restituisce la versione del modello salvato nel bucket (generation del blob).
+
+        Args:
+            model_path: Percorso del modello nel bucket (es. 'MODELLO/pesi.h5')
+
+        Returns:
+            Optional[str]: Generation del blob, o None se non disponibile.
+        """
+        try:
+            blob = self.bucket.blob(model_path)
+            blob.reload()
+            return str(blob.generation) if blob.generation else None
+        except Exception as e:
+            raise GCSManagerException(f"Errore nel recupero della versione del modello: {str(e)}")
         
 
     def get_public_url(self, blob_path: str) -> Optional[str]:
         """
-        Ottiene l'URL pubblico di un blob.
+        Ottiene l'URL di accesso a un blob (firmato, o pubblico con GCS_PUBLIC_URLS).
 
         Args:
             blob_path: Il percorso del blob nel bucket.
 
         Returns:
-            Optional[str]: L'URL pubblico del blob, o None se il blob non esiste.
+            Optional[str]: L'URL del blob, o None se il blob non esiste.
 
         Raises:
-            GCSManagerException: Se si verifica un errore nel recupero dell'URL pubblico.
+            GCSManagerException: Se si verifica un errore nel recupero dell'URL.
         """
         try:
             blob = self.bucket.blob(blob_path)
             if blob.exists():
-                blob.make_public()
-                return blob.public_url
+                return self.get_url(blob)
             return None
         except Exception as e:
             raise GCSManagerException(f"Errore nel recupero dell'URL pubblico: {str(e)}")
 
 
-    def save_gradcam_image(self, image_array: np.ndarray, destination_path: str) -> str:
+    def get_url(self, blob: Union[storage.Blob, str]) -> str:
+        """
+        Restituisce l'URL con cui il client accede a un blob, senza richieste di rete: un URL firmato V4
+        (generato localmente con la chiave del service account e riutilizzato fino a poco prima della
+        scadenza) o, con GCS_PUBLIC_URLS, l'URL pubblico dei file resi pubblici al caricamento.
+
+        Args:
+            blob: Blob o percorso del blob nel bucket.
+
+        Returns:
+            str: URL di accesso al blob.
+        """
+        blob_name = blob if isinstance(blob, str) else blob.name
+        if AppConfig.GCS_PUBLIC_URLS:
+            return self.bucket.blob(blob_name).public_url if isinstance(blob, str) else blob.public_url
+        return self.get_signed_url(blob_name)
+
+
+    def get_signed_url(self, blob_name: str) -> str:
+        """
+        Restituisce un URL firmato V4 in lettura per un blob, dalla cache se ancora valido
+        per almeno GCS_SIGNED_URL_REFRESH_MARGIN_S secondi.
+
+        Args:
+            blob_name: Percorso del blob nel bucket.
+
+        Returns:
+            str: URL firmato.
+
+        Raises:
+            GCSManagerException: Se la firma fallisce.
+        """
+        now = time.time()
+        with self._signed_urls_lock:
+            cached = self._signed_urls.get(blob_name)
+            if cached is not None and cached[1] - now > self.signed_url_refresh_margin:
+                self._signed_urls.move_to_end(blob_name)
+                return cached[0]
+
+        try:
+            url = self.bucket.blob(blob_name).generate_signed_url(
+                version='v4',
+                expiration=timedelta(seconds=self.signed_url_ttl),
+                method='GET',
+                credentials=self.credentials
+            )
+        except Exception as e:
+            raise GCSManagerException(f"Errore nella firma dell'URL: {str(e)}")
+
+        with self._signed_urls_lock:
+            self._signed_urls[blob_name] = (url, now + self.signed_url_ttl)
+            self._signed_urls.move_to_end(blob_name)
+            while len(self._signed_urls) > AppConfig.GCS_SIGNED_URL_CACHE_SIZE:
+                self._signed_urls.popitem(last=False)
+        return url
+
+
+    def save_gradcam_image(self,
+                           image_array: np.ndarray,
+                           destination_path: str,
+                           policy: Optional[EncodingPolicy] = None) -> str:
         """
         Salva un'immagine Grad-CAM nel bucket.
 
         Args:
             image_array: Array numpy che rappresenta l'immagine Grad-CAM.
-            destination_path: Percorso di destinazione del file nel bucket.
+            destination_path: Percorso di destinazione del file nel bucket (con l'estensione del formato).
+            policy: Politica di codifica (PNG di default).
 
         Returns:
             str: URL pubblico dell'immagine salvata.
@@ -336,8 +1004,9 @@ class GCSManager:
         """
         try:
             # Converti l'immagine in bytes
+            policy = policy or EncodingPolicy()
             gradcam_file = io.BytesIO()
-            _, buffer = cv2.imencode('.png', image_array)
+            _, buffer = cv2.imencode(policy.extension, image_array, policy.imencode_params())
             gradcam_file.write(buffer)
             gradcam_file.seek(0)
 
@@ -346,7 +1015,7 @@ class GCSManager:
                 gradcam_file,
                 destination_path,
                 make_public=True,
-                content_type="image/png"
+                content_type=policy.content_type
             )
         except Exception as e:
             raise GCSManagerException(f"Errore nel salvataggio dell'immagine Grad-CAM: {str(e)}")
@@ -371,10 +1040,10 @@ class GCSManager:
             GCSManagerException: Se si verifica un errore durante il processamento della cartella.
         """
         try:
-            base_path = f"{patient_id}/Radiografia{folder_index}"
-            
-            original_url = self.get_public_url(f"{base_path}/original_image{folder_index}.png")
-            gradcam_url = self.get_public_url(f"{base_path}/gradcam_image{folder_index}.png")
+            original_blob = self.find_radiograph_image(patient_id, folder_index, 'original_image')
+            gradcam_blob = self.find_radiograph_image(patient_id, folder_index, 'gradcam_image')
+            original_url = self.get_url(original_blob) if original_blob else None
+            gradcam_url = self.get_url(gradcam_blob) if gradcam_blob else None
             info = self.get_radiograph_info(patient_id, folder_index)
             
             return {
@@ -0,0 +1,183 @@
+import threading
+import time
+import cv2
+import numpy as np
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass
+from typing import Dict, Any
+from utils.image_header import sniff_image_format
+
+# Estensione e content type per ciascun formato supportato
+IMAGE_FORMATS = {
+    'png': ('.png', 'image/png'),
+    'webp': ('.webp', 'image/webp'),
+    'jpeg': ('.jpg', 'image/jpeg')
+}
+
+class ImageEncodingException(Exception):
+    """Classe personalizzata per le eccezioni della codifica delle immagini."""
+    pass
+
+@dataclass
+class EncodingPolicy:
+    """Politica di codifica di un tipo di artefatto."""
+    format: str = 'png'
+    quality: int = 90
+    png_compression: int = 3
+
+    @property
+    def extension(self) -> str:
+        return IMAGE_FORMATS[self.format][0]
+
+    @property
+    def content_type(self) -> str:
+        return IMAGE_FORMATS[self.format][1]
+
+    def imencode_params(self) -> list:
+        """
+        Parametri di `cv2.imencode` per il formato della politica.
+        """
+        if self.format == 'png':
+            return [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression]
+        if self.format == 'webp':
+            return [cv2.IMWRITE_WEBP_QUALITY, self.quality]
+        return [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+
+@dataclass
+class EncodedImage:
+    """Immagine codificata pronta per il caricamento."""
+    data: bytes
+    format: str
+    extension: str
+    content_type: str
+
+    @classmethod
+    def from_bytes(cls, data: bytes, format: str) -> 'EncodedImage':
+        """
+        Crea un EncodedImage da dati già codificati nel formato indicato.
+        """
+        extension, content_type = IMAGE_FORMATS[format]
+        return cls(data, format, extension, content_type)
+
+class ImageEncoder:
+    """
+    Codifica le immagini salvate (originali e Grad-CAM) secondo una politica per tipo di artefatto,
+    con statistiche su byte prodotti e tempi di codifica. Gli originali caricati possono essere
+    preparati su un pool di thread dedicato (OpenCV rilascia il GIL durante la codifica), in
+    parallelo all'inferenza.
+    """
+
+    def __init__(self, policies: Dict[str, EncodingPolicy], max_workers: int = 2):
+        """
+        Args:
+            policies: Politica di codifica per ogni tipo di artefatto (es. 'original', 'gradcam').
+            max_workers: Numero di thread di codifica.
+        """
+        for artifact, policy in policies.items():
+            if policy.format not in IMAGE_FORMATS:
+                raise ImageEncodingException(f"Formato non supportato per '{artifact}': {policy.format}")
+        self.policies = policies
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="encoder")
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+
+
+    def policy(self, artifact: str) -> EncodingPolicy:
+        """
+        Restituisce la politica di un artefatto (PNG di default).
+        """
+        return self.policies.get(artifact, EncodingPolicy())
+
+
+    def encode(self, artifact: str, image: np.ndarray) -> EncodedImage:
+        """
+        Codifica un'immagine nel thread corrente.
+
+        Args:
+            artifact: Tipo di artefatto ('original', 'gradcam').
+            image: Immagine da codificare.
+
+        Returns:
+            EncodedImage: Immagine codificata.
+
+        Raises:
+            ImageEncodingException: Se la codifica fallisce.
+        """
+        policy = self.policy(artifact)
+        started_at = time.perf_counter()
+        success, buffer = cv2.imencode(policy.extension, image, policy.imencode_params())
+        if not success:
+            raise ImageEncodingException(f"Errore nella codifica dell'immagine '{artifact}'")
+        data = buffer.tobytes()
+        self._record(artifact, image.nbytes, len(data), time.perf_counter() - started_at)
+        return EncodedImage(data, policy.format, policy.extension, policy.content_type)
+
+
+    def encode_upload(self, artifact: str, data: bytes) -> EncodedImage:
+        """
+        Prepara per il salvataggio un file caricato dall'utente: se è già nel formato della politica
+        viene salvato così com'è (nessuna perdita di generazione), altrimenti viene decodificato
+        senza conversioni di profondità/canali e ricodificato.
+
+        Args:
+            artifact: Tipo di artefatto (es. 'original').
+            data: Contenuto del file caricato.
+
+        Returns:
+            EncodedImage: Immagine pronta per il caricamento.
+
+        Raises:
+            ImageEncodingException: Se il file non è un'immagine leggibile.
+        """
+        if sniff_image_format(data) == self.policy(artifact).format:
+            self._record(artifact, 0, len(data), 0.0, passthrough=True)
+            return EncodedImage.from_bytes(data, self.policy(artifact).format)
+
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ImageEncodingException(f"Impossibile decodificare l'immagine '{artifact}'")
+        return self.encode(artifact, image)
+
+
+    def encode_upload_async(self, artifact: str, data: bytes) -> Future:
+        """
+        Come `encode_upload`, sul pool di thread dell'encoder.
+
+        Returns:
+            Future: Future che si risolve in un EncodedImage.
+        """
+        return self._executor.submit(self.encode_upload, artifact, data)
+
+
+    def _record(self, artifact: str, raw_bytes: int, encoded_bytes: int, seconds: float, passthrough: bool = False) -> None:
+        with self._lock:
+            stats = self._stats[artifact]
+            stats['count'] += 1
+            stats['passthrough'] += 1 if passthrough else 0
+            stats['raw_bytes'] += raw_bytes
+            stats['encoded_bytes'] += encoded_bytes
+            stats['encode_seconds'] += seconds
+
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Restituisce le statistiche di codifica per tipo di artefatto.
+
+        Returns:
+            Dict[str, Any]: Formato, numero di immagini, byte prodotti e tempo medio di codifica.
+        """
+        with self._lock:
+            result = {}
+            for artifact, stats in self._stats.items():
+                encoded = stats['count'] - stats['passthrough']
+                result[artifact] = {
+                    'format': self.policy(artifact).format,
+                    'count': int(stats['count']),
+                    'passthrough': int(stats['passthrough']),
+                    'encoded_bytes_total': int(stats['encoded_bytes']),
+                    'avg_encoded_bytes': stats['encoded_bytes'] / stats['count'] if stats['count'] else 0.0,
+                    'avg_encode_ms': 1000.0 * stats['encode_seconds'] / encoded if encoded else 0.0,
+                    'compression_ratio': stats['raw_bytes'] / stats['encoded_bytes'] if encoded and stats['encoded_bytes'] else None
+                }
+            return result
@@ -0,0 +1,252 @@
+import os
+import struct
+import cv2
+import numpy as np
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple, BinaryIO
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Marker JPEG Start Of Frame che contengono le dimensioni dell'immagine
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# Byte letti dall'inizio del file per riconoscerne formato e dimensioni (i segmenti APP/EXIF
+# dei JPEG possono precedere di molto il marker SOF)
+HEADER_PROBE_BYTES = 256 * 1024
+
+@dataclass
+class ImageHeader:
+    """
+    Formato e dimensioni di un'immagine letti dall'intestazione
+    (formato None se le dimensioni sono state ricavate decodificando l'immagine).
+    """
+    format: Optional[str]
+    width: int
+    height: int
+
+    @property
+    def pixels(self) -> int:
+        return self.width * self.height
+
+class ImageValidationException(Exception):
+    """Immagine caricata rifiutata prima della decodifica (formato non riconosciuto o limiti superati)."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def sniff_image_format(data: bytes) -> Optional[str]:
+    """
+    Riconosce il formato di un'immagine dalla firma iniziale.
+
+    Args:
+        data: Contenuto (o parte iniziale) del file immagine.
+
+    Returns:
+        Optional[str]: 'png', 'jpeg', 'webp', 'bmp' o 'tiff', o None se il formato non è riconosciuto.
+    """
+    data = bytes(data[:12])
+    if data[:8] == _PNG_SIGNATURE:
+        return 'png'
+    if data[:2] == b'\xff\xd8':
+        return 'jpeg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    if data[:2] == b'BM':
+        return 'bmp'
+    if data[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'tiff'
+    return None
+
+
+def read_image_header(data: bytes) -> Optional[ImageHeader]:
+    """
+    Legge formato e dimensioni di un'immagine dall'intestazione, senza decodificarla.
+
+    Args:
+        data: Contenuto (o parte iniziale) del file immagine.
+
+    Returns:
+        Optional[ImageHeader]: Formato e dimensioni, o None se il formato non è riconosciuto
+            o l'intestazione è incompleta/non valida.
+    """
+    image_format = sniff_image_format(data)
+    if image_format is None:
+        return None
+    data = memoryview(data)
+    try:
+        size = _SIZE_READERS[image_format](data)
+    except (struct.error, IndexError):
+        return None
+    if size is None:
+        return None
+    return ImageHeader(image_format, size[0], size[1])
+
+
+def validate_image_upload(file: BinaryIO,
+                          max_bytes: Optional[int] = None,
+                          max_pixels: Optional[int] = None) -> ImageHeader:
+    """
+    Verifica un'immagine caricata leggendo solo dimensione del file e intestazione, così file
+    enormi o malformati vengono rifiutati prima di allocare memoria per la decodifica.
+    I formati di cui non si sa leggere l'intestazione (es. JPEG 2000, PNM) vengono invece
+    decodificati e verificati sulle dimensioni reali. Il file viene riportato all'inizio.
+
+    Args:
+        file: File binario caricato.
+        max_bytes: Dimensione massima del file, in byte (None per nessun limite).
+        max_pixels: Numero massimo di pixel dell'immagine decodificata (None per nessun limite).
+
+    Returns:
+        ImageHeader: Formato e dimensioni dell'immagine.
+
+    Raises:
+        ImageValidationException: Con codice 400 (file vuoto o dimensioni nulle), 413 (limiti superati)
+            o 415 (file non decodificabile come immagine).
+    """
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(0)
+    if size == 0:
+        raise ImageValidationException("Il file caricato è vuoto", 400)
+    if max_bytes and size > max_bytes:
+        raise ImageValidationException(
+            f"Il file caricato ({size} byte) supera il limite di {max_bytes} byte", 413
+        )
+
+    probe = file.read(HEADER_PROBE_BYTES)
+    header = read_image_header(probe)
+    if header is None and sniff_image_format(probe) == 'tiff':
+        # La directory (IFD) di un TIFF può trovarsi oltre i byte letti inizialmente
+        header = _read_tiff_header(file, probe)
+    if header is None:
+        header = _decode_header(file)
+    file.seek(0)
+    if header.width == 0 or header.height == 0:
+        raise ImageValidationException("L'immagine ha dimensioni nulle", 400)
+    if max_pixels and header.pixels > max_pixels:
+        raise ImageValidationException(
+            f"L'immagine ({header.width}x{header.height}) supera il limite di {max_pixels} pixel", 413
+        )
+    return header
+
+
+def _read_tiff_header(file: BinaryIO, probe: bytes) -> Optional[ImageHeader]:
+    """
+    Legge le dimensioni di un TIFF leggendo dal file la directory (IFD) alla sua posizione reale.
+    """
+    def read_at(offset: int, size: int) -> bytes:
+        file.seek(offset)
+        return file.read(size)
+
+    try:
+        size = _tiff_ifd_size(memoryview(probe), read_at)
+    except (struct.error, IndexError):
+        return None
+    return ImageHeader('tiff', size[0], size[1]) if size else None
+
+
+def _decode_header(file: BinaryIO) -> ImageHeader:
+    """
+    Ricava le dimensioni di un'immagine di cui non si sa leggere l'intestazione decodificandola
+    (in scala di grigi, come l'analisi). Il limite di pixel viene poi verificato sulle dimensioni reali.
+    """
+    file.seek(0)
+    img = cv2.imdecode(np.frombuffer(file.read(), np.uint8), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise ImageValidationException("Formato immagine non riconosciuto o file non valido", 415)
+    return ImageHeader(None, img.shape[1], img.shape[0])
+
+
+def _png_size(data: memoryview) -> Optional[Tuple[int, int]]:
+    if bytes(data[12:16]) != b'IHDR':
+        return None
+    return struct.unpack('>II', data[16:24])
+
+
+def _jpeg_size(data: memoryview) -> Optional[Tuple[int, int]]:
+    offset = 2
+    while offset + 9 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Byte di riempimento tra i marker
+            offset += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        segment_length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+        if marker in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + segment_length
+    return None
+
+
+def _webp_size(data: memoryview) -> Optional[Tuple[int, int]]:
+    chunk = bytes(data[12:16])
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L':
+        bits = struct.unpack('<I', data[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X':
+        width = int.from_bytes(bytes(data[24:27]), 'little') + 1
+        height = int.from_bytes(bytes(data[27:30]), 'little') + 1
+        return width, height
+    return None
+
+
+def _bmp_size(data: memoryview) -> Optional[Tuple[int, int]]:
+    header_size = struct.unpack('<I', data[14:18])[0]
+    if header_size == 12:
+        return struct.unpack('<HH', data[18:22])
+    width, height = struct.unpack('<ii', data[18:26])
+    # Un'altezza negativa indica righe memorizzate dall'alto verso il basso
+    return abs(width), abs(height)
+
+
+def _tiff_size(data: memoryview) -> Optional[Tuple[int, int]]:
+    return _tiff_ifd_size(data, lambda offset, size: data[offset:offset + size])
+
+
+def _tiff_ifd_size(data: memoryview, read_at: Callable[[int, int], bytes]) -> Optional[Tuple[int, int]]:
+    """
+    Legge le dimensioni dalla prima directory (IFD) di un TIFF; `read_at(offset, size)`
+    restituisce i byte del file a partire da `offset`.
+    """
+    byte_order = '<' if bytes(data[:2]) == b'II' else '>'
+    ifd_offset = struct.unpack(f'{byte_order}I', data[4:8])[0]
+    num_entries = struct.unpack(f'{byte_order}H', read_at(ifd_offset, 2))[0]
+    entries = memoryview(read_at(ifd_offset + 2, 12 * num_entries))
+    width = height = None
+    for i in range(num_entries):
+        entry = 12 * i
+        tag, value_type = struct.unpack(f'{byte_order}HH', entries[entry:entry + 4])
+        if tag not in (256, 257):
+            continue
+        # Valori SHORT (3) o LONG (4), contenuti direttamente nel campo valore
+        if value_type == 3:
+            value = struct.unpack(f'{byte_order}H', entries[entry + 8:entry + 10])[0]
+        else:
+            value = struct.unpack(f'{byte_order}I', entries[entry + 8:entry + 12])[0]
+        if tag == 256:
+            width = value
+        else:
+            height = value
+    if width is None or height is None:
+        return None
+    return width, height
+
+
+_SIZE_READERS = {
+    'png': _png_size,
+    'jpeg': _jpeg_size,
+    'webp': _webp_size,
+    'bmp': _bmp_size,
+    'tiff': _tiff_size
+}
@@ -0,0 +1,235 @@
+import threading
+import numpy as np
+import tensorflow as tf
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+
+# Firma di input del modello: batch e risoluzione variabili, 3 canali float32
+IMAGE_BATCH_SPEC = tf.TensorSpec(shape=[None, None, None, 3], dtype=tf.float32)
+
+class InferenceBackendException(Exception):
+    """Classe personalizzata per le eccezioni dei backend di inferenza."""
+    pass
+
+class InferenceBackend:
+    """
+    Interfaccia comune dei backend di inferenza usati dal ModelManager per la sola classificazione.
+    La Grad-CAM richiede i gradienti e resta quindi sempre sul modello Keras.
+    """
+    name = 'base'
+
+    def predict(self, img_batch: np.ndarray) -> np.ndarray:
+        """
+        Calcola le probabilità delle classi per un batch di immagini preprocessate.
+
+        Args:
+            img_batch: Batch di immagini preprocessate (N, H, W, 3) in float32.
+
+        Returns:
+            np.ndarray: Probabilità delle classi (N, num_classi).
+        """
+        raise NotImplementedError
+
+class KerasBackend(InferenceBackend):
+    """Backend basato sul modello Keras, con forward compilato tramite `tf.function`."""
+    name = 'keras'
+
+    def __init__(self, model: tf.keras.Model, jit_compile: bool = False):
+        """
+        Args:
+            model: Modello Keras pre-addestrato.
+            jit_compile: Se compilare il forward con XLA.
+        """
+        self.model = model
+        self._predict_fn = tf.function(
+            lambda img_batch: self.model(img_batch, training=False),
+            input_signature=[IMAGE_BATCH_SPEC],
+            jit_compile=jit_compile
+        )
+
+    def predict(self, img_batch: np.ndarray) -> np.ndarray:
+        return self._predict_fn(tf.convert_to_tensor(img_batch, dtype=tf.float32)).numpy()
+
+class Bfloat16KerasBackend(KerasBackend):
+    """
+    Backend Keras con calcolo in bfloat16 (policy `mixed_bfloat16`), utile sulle CPU con
+    istruzioni AVX512-BF16/AMX. I pesi vengono copiati da un clone del modello originale.
+    """
+    name = 'bf16'
+
+    def __init__(self, model: tf.keras.Model, jit_compile: bool = False):
+        # La configurazione di ogni layer riporta esplicitamente la policy float32, che avrebbe la precedenza
+        # sulla policy globale: la policy va sostituita nella configurazione, anche dei modelli annidati
+        bf16_model = tf.keras.models.clone_model(
+            model,
+            clone_function=lambda layer: layer.__class__.from_config(_with_bf16_policy(layer.get_config()))
+        )
+        bf16_model.set_weights(model.get_weights())
+
+        float32_layers = [
+            layer.name for layer in _iter_layers(bf16_model)
+            if layer.weights and layer.compute_dtype != 'bfloat16'
+        ]
+        if float32_layers:
+            raise InferenceBackendException(
+                f"Layer non convertiti in bfloat16: {', '.join(float32_layers)}"
+            )
+        super().__init__(bf16_model, jit_compile=jit_compile)
+
+    def predict(self, img_batch: np.ndarray) -> np.ndarray:
+        return super().predict(img_batch).astype(np.float32)
+
+def _with_bf16_policy(config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Imposta la policy `mixed_bfloat16` nella configurazione di un layer e dei layer dei modelli annidati.
+    I layer di input mantengono il dtype float32 degli ingressi.
+    """
+    config = dict(config)
+    if 'dtype' in config:
+        config['dtype'] = 'mixed_bfloat16'
+    if isinstance(config.get('layers'), list):
+        config['layers'] = [
+            layer_config if layer_config.get('class_name') == 'InputLayer'
+            else {**layer_config, 'config': _with_bf16_policy(layer_config['config'])}
+            for layer_config in config['layers']
+        ]
+    return config
+
+def _iter_layers(model: tf.keras.Model) -> Iterator[tf.keras.layers.Layer]:
+    """
+    Scorre i layer di un modello, inclusi quelli dei modelli annidati.
+    """
+    for layer in model.layers:
+        yield layer
+        if isinstance(layer, tf.keras.Model):
+            yield from _iter_layers(layer)
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """Backend basato su un grafo ONNX esportato, eseguito con ONNX Runtime su CPU."""
+    name = 'onnx'
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None):
+        """
+        Args:
+            model_path: Percorso locale del file .onnx.
+            num_threads: Numero di thread intra-op (None per il default di ONNX Runtime).
+        """
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise InferenceBackendException("Il backend 'onnx' richiede il pacchetto onnxruntime")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, img_batch: np.ndarray) -> np.ndarray:
+        img_batch = np.ascontiguousarray(img_batch, dtype=np.float32)
+        return self.session.run(None, {self.input_name: img_batch})[0]
+
+class TFLiteBackend(InferenceBackend):
+    """Backend basato su un modello TFLite (tipicamente quantizzato dynamic-range)."""
+    name = 'tflite'
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None):
+        """
+        Args:
+            model_path: Percorso locale del file .tflite.
+            num_threads: Numero di thread dell'interprete (None per il default di TFLite).
+        """
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self._input_shape: Optional[Tuple[int, ...]] = None
+        self._lock = threading.Lock()
+
+    def predict(self, img_batch: np.ndarray) -> np.ndarray:
+        img_batch = np.ascontiguousarray(img_batch, dtype=np.float32)
+        # L'interprete non è thread-safe e va riallocato solo quando cambia la forma dell'input
+        with self._lock:
+            if self._input_shape != img_batch.shape:
+                self.interpreter.resize_tensor_input(self.input_index, img_batch.shape)
+                self.interpreter.allocate_tensors()
+                self._input_shape = img_batch.shape
+            self.interpreter.set_tensor(self.input_index, img_batch)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output_index).copy()
+
+
+def create_backend(name: str,
+                   model: tf.keras.Model,
+                   model_path: Optional[str] = None,
+                   jit_compile: bool = False,
+                   num_threads: Optional[int] = None) -> InferenceBackend:
+    """
+    Crea il backend di inferenza indicato dalla configurazione.
+
+    Args:
+        name: Nome del backend ('keras', 'bf16', 'onnx', 'tflite').
+        model: Modello Keras (usato dai backend 'keras' e 'bf16').
+        model_path: Percorso locale dell'artefatto esportato (richiesto da 'onnx' e 'tflite').
+        jit_compile: Se compilare con XLA i backend Keras.
+        num_threads: Numero di thread per i backend 'onnx' e 'tflite'.
+
+    Returns:
+        InferenceBackend: Backend inizializzato.
+
+    Raises:
+        InferenceBackendException: Se il backend non esiste o manca l'artefatto richiesto.
+    """
+    name = (name or 'keras').lower()
+    if name == KerasBackend.name:
+        return KerasBackend(model, jit_compile=jit_compile)
+    if name == Bfloat16KerasBackend.name:
+        return Bfloat16KerasBackend(model, jit_compile=jit_compile)
+    if name in (OnnxRuntimeBackend.name, TFLiteBackend.name):
+        if not model_path:
+            raise InferenceBackendException(f"Il backend '{name}' richiede il percorso del modello esportato")
+        if name == OnnxRuntimeBackend.name:
+            return OnnxRuntimeBackend(model_path, num_threads=num_threads)
+        return TFLiteBackend(model_path, num_threads=num_threads)
+    raise InferenceBackendException(f"Backend di inferenza sconosciuto: {name}")
+
+
+def export_onnx(model: tf.keras.Model, output_path: str, input_size: Optional[Sequence[int]] = None) -> str:
+    """
+    Esporta il modello Keras in formato ONNX.
+
+    Args:
+        model: Modello Keras da esportare.
+        output_path: Percorso del file .onnx da creare.
+        input_size: Risoluzione fissa (altezza, larghezza) dell'input; se None resta dinamica.
+
+    Returns:
+        str: Percorso del file esportato.
+    """
+    try:
+        import tf2onnx
+    except ImportError:
+        raise InferenceBackendException("L'esportazione ONNX richiede il pacchetto tf2onnx")
+
+    height, width = input_size if input_size else (None, None)
+    spec = (tf.TensorSpec((None, height, width, 3), tf.float32, name='input'),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, output_path=output_path)
+    return output_path
+
+
+def export_tflite(model: tf.keras.Model, output_path: str) -> str:
+    """
+    Esporta il modello Keras in formato TFLite con quantizzazione dynamic-range dei pesi.
+
+    Args:
+        model: Modello Keras da esportare.
+        output_path: Percorso del file .tflite da creare.
+
+    Returns:
+        str: Percorso del file esportato.
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+    return output_path
@@ -0,0 +1,319 @@
+import os
+import sys
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory, resource_tracker
+from typing import Tuple, Optional, Any, Callable
+
+# ModelManager del processo worker, inizializzato da _init_worker
+_worker_model_manager = None
+
+class InferencePoolException(Exception):
+    """Classe personalizzata per le eccezioni del pool di processi di inferenza."""
+    pass
+
+class _SharedMemoryFile:
+    """Adattatore file-like in sola lettura sopra un blocco di memoria condivisa (senza copie)."""
+
+    def __init__(self, buffer: memoryview):
+        self._buffer = buffer
+
+    def read(self, *args) -> memoryview:
+        return self._buffer
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """
+    Apre un blocco di memoria condivisa creato da un altro processo senza registrarlo nel
+    resource tracker: il blocco resta di competenza del processo che lo ha creato.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # Fino a Python 3.12 anche la sola apertura registra il blocco. I worker 'spawn' condividono il
+    # tracker del processo principale, quindi deregistrarlo dopo l'apertura cancellerebbe anche la
+    # registrazione del proprietario: la registrazione viene invece saltata
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _unlink_shared_memory(name: str) -> None:
+    """
+    Libera un blocco di memoria condivisa creato da un worker, se esiste ancora.
+    """
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def _discard_analysis_output(future: Future) -> None:
+    """
+    Libera il blocco Grad-CAM di un'analisi il cui risultato non è più atteso dal chiamante.
+    """
+    if future.cancelled() or future.exception() is not None:
+        return
+    _unlink_shared_memory(future.result()[0])
+
+
+def _init_worker(bucket_name: str, model_path: str, model_version: Optional[str], intra_op_threads: Optional[int]) -> None:
+    """
+    Inizializza un processo worker: limita i thread di TensorFlow e carica il proprio modello.
+    """
+    global _worker_model_manager
+    import tensorflow as tf
+    from utils.gcs_utils import GCSManager
+    from factories.manager_factory import ManagerFactory
+
+    if intra_op_threads:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    model = GCSManager(bucket_name).load_model(model_path, generation=model_version)
+    _worker_model_manager = ManagerFactory.create_model_manager(model, model_version)
+
+
+def _worker_ping() -> int:
+    """
+    Task vuoto usato per avviare (e inizializzare) i worker all'avvio dell'applicazione.
+    """
+    return os.getpid()
+
+
+def _worker_analyze(input_name: str, input_size: int) -> Tuple[str, Tuple[int, ...], str, int, float, list]:
+    """
+    Esegue nel worker decodifica, preprocessing, predizione e Grad-CAM sull'immagine in memoria condivisa.
+    L'immagine Grad-CAM viene scritta in un nuovo blocco condiviso, liberato dal processo principale.
+    """
+    input_shm = _attach_shared_memory(input_name)
+    error = None
+    try:
+        predicted_class, confidence, superimposed_img, probabilities = _worker_model_manager.analyze(
+            _SharedMemoryFile(input_shm.buf[:input_size])
+        )
+    except Exception as e:
+        # Il traceback tiene vive le viste sul blocco condiviso: va rilasciato prima di chiuderlo
+        error = f"{type(e).__name__}: {str(e)}"
+    input_shm.close()
+    if error is not None:
+        raise InferencePoolException(error)
+
+    output_shm = shared_memory.SharedMemory(create=True, size=max(1, superimposed_img.nbytes))
+    try:
+        output = np.ndarray(superimposed_img.shape, dtype=superimposed_img.dtype, buffer=output_shm.buf)
+        output[...] = superimposed_img
+        del output
+        return (output_shm.name, superimposed_img.shape, superimposed_img.dtype.str,
+                predicted_class, confidence, probabilities.tolist())
+    finally:
+        output_shm.close()
+
+
+def _worker_classify(input_name: str, input_size: int) -> Tuple[int, float]:
+    """
+    Esegue nel worker soltanto preprocessing e classificazione (senza Grad-CAM) sull'immagine in memoria condivisa.
+    """
+    input_shm = _attach_shared_memory(input_name)
+    error = None
+    try:
+        img_array, _ = _worker_model_manager.preprocess_image(
+            _SharedMemoryFile(input_shm.buf[:input_size]), for_display=False
+        )
+        predicted_class, confidence = _worker_model_manager.predict_class(img_array)
+    except Exception as e:
+        error = f"{type(e).__name__}: {str(e)}"
+    input_shm.close()
+    if error is not None:
+        raise InferencePoolException(error)
+    return int(predicted_class), float(confidence)
+
+
+class InferenceWorkerPool:
+    """
+    Pool di processi worker, ognuno con la propria copia del modello, a cui il ModelManager
+    delega decodifica, predizione e Grad-CAM. Le immagini viaggiano tramite
+    `multiprocessing.shared_memory` invece di essere serializzate con pickle.
+    Se un worker termina in modo anomalo (es. OOM killer) il pool viene ricreato.
+    """
+
+    def __init__(self, num_workers: int, bucket_name: str, model_path: str, model_version: Optional[str] = None):
+        """
+        Avvia il pool di processi.
+
+        Args:
+            num_workers: Numero di processi worker.
+            bucket_name: Nome del bucket GCS da cui ogni worker carica il modello.
+            model_path: Percorso del modello nel bucket.
+            model_version: Versione del modello caricato dai worker.
+        """
+        self.num_workers = num_workers
+        self.model_version = model_version
+        # I core vengono divisi tra i worker per evitare di sovraccaricare la CPU
+        intra_op_threads = max(1, (os.cpu_count() or 1) // num_workers)
+        self._init_args = (bucket_name, model_path, model_version, intra_op_threads)
+        self._executor_lock = threading.Lock()
+        self._executor = self._start_executor()
+
+
+    def _start_executor(self) -> ProcessPoolExecutor:
+        """
+        Crea il pool di processi e avvia subito tutti i worker, così il caricamento del modello
+        avviene all'avvio e non alla prima richiesta.
+        """
+        executor = ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=self._init_args
+        )
+        self._startup_futures = [executor.submit(_worker_ping) for _ in range(self.num_workers)]
+        return executor
+
+
+    def _restart_executor(self, broken: ProcessPoolExecutor) -> None:
+        """
+        Sostituisce un pool interrotto dalla terminazione anomala di un worker: senza il riavvio
+        ogni richiesta successiva fallirebbe con BrokenProcessPool.
+        """
+        with self._executor_lock:
+            if self._executor is not broken:
+                # Già ricreato da un'altra richiesta
+                return
+            print("Pool di inferenza interrotto da un worker terminato, riavvio dei processi")
+            broken.shutdown(wait=False)
+            self._executor = self._start_executor()
+
+
+    def wait_ready(self, timeout: Optional[float] = None) -> None:
+        """
+        Attende che i worker avviati abbiano caricato il modello.
+
+        Args:
+            timeout: Tempo massimo di attesa, in secondi.
+
+        Raises:
+            InferencePoolException: Se l'inizializzazione di un worker fallisce.
+        """
+        try:
+            for future in self._startup_futures:
+                future.result(timeout)
+        except Exception as e:
+            raise InferencePoolException(f"Errore nell'avvio dei worker di inferenza: {str(e)}")
+
+
+    def analyze(self, file, timeout: Optional[float] = None) -> Tuple[int, float, np.ndarray, np.ndarray]:
+        """
+        Esegue l'intera pipeline di inferenza su un worker.
+
+        Args:
+            file: File binario dell'immagine.
+            timeout: Tempo massimo di attesa del risultato, in secondi.
+
+        Returns:
+            Tuple[int, float, np.ndarray, np.ndarray]:
+                - Classe predetta.
+                - Fiducia associata alla classe predetta.
+                - Immagine Grad-CAM con heatmap sovrapposta.
+                - Probabilità di tutte le classi.
+
+        Raises:
+            InferencePoolException: Se l'elaborazione nel worker fallisce.
+        """
+        output_name, shape, dtype, predicted_class, confidence, probabilities = self._run_on_file(
+            _worker_analyze, file, timeout, on_abandon=_discard_analysis_output
+        )
+
+        output_shm = shared_memory.SharedMemory(name=output_name)
+        try:
+            superimposed_img = np.ndarray(shape, dtype=np.dtype(dtype), buffer=output_shm.buf).copy()
+        finally:
+            output_shm.close()
+            output_shm.unlink()
+
+        return predicted_class, confidence, superimposed_img, np.array(probabilities)
+
+
+    def classify(self, file, timeout: Optional[float] = None) -> Tuple[int, float]:
+        """
+        Esegue su un worker soltanto la classificazione, senza Grad-CAM.
+
+        Args:
+            file: File binario dell'immagine.
+            timeout: Tempo massimo di attesa del risultato, in secondi.
+
+        Returns:
+            Tuple[int, float]: Classe predetta e relativa fiducia.
+
+        Raises:
+            InferencePoolException: Se l'elaborazione nel worker fallisce.
+        """
+        return self._run_on_file(_worker_classify, file, timeout)
+
+
+    def _run_on_file(self,
+                     task: Callable[[str, int], Any],
+                     file,
+                     timeout: Optional[float],
+                     on_abandon: Optional[Callable[[Future], None]] = None) -> Any:
+        """
+        Copia il file in un blocco di memoria condivisa ed esegue `task` su un worker.
+        Se il risultato non viene atteso (timeout o errore), `on_abandon` viene invocata sul
+        future al termine del task, per liberare le risorse create dal worker.
+        """
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        file.seek(0)
+        if size == 0:
+            raise InferencePoolException("Il file caricato è vuoto")
+
+        input_shm = shared_memory.SharedMemory(create=True, size=size)
+        executor = self._executor
+        future = None
+        try:
+            self._read_into(file, input_shm.buf[:size])
+            future = executor.submit(task, input_shm.name, size)
+            return future.result(timeout)
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                self._restart_executor(executor)
+            if future is not None:
+                # Un task non ancora avviato viene annullato, uno in corso viene lasciato terminare
+                future.cancel()
+                if on_abandon is not None:
+                    future.add_done_callback(on_abandon)
+            raise InferencePoolException(f"Errore nel worker di inferenza: {str(e)}")
+        finally:
+            input_shm.close()
+            input_shm.unlink()
+            file.seek(0)
+
+
+    @staticmethod
+    def _read_into(file: Any, buffer: memoryview) -> None:
+        """
+        Copia il contenuto del file direttamente nel buffer condiviso.
+        """
+        if hasattr(file, 'readinto'):
+            offset = 0
+            while offset < len(buffer):
+                read = file.readinto(buffer[offset:])
+                if not read:
+                    break
+                offset += read
+        else:
+            buffer[:] = file.read()
+
+
+    def shutdown(self) -> None:
+        """
+        Arresta i processi worker.
+        """
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,237 @@
+import queue
+import threading
+import time
+import numpy as np
+from collections import Counter
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple, Any, Optional
+
+class InferenceSchedulerException(Exception):
+    """Classe personalizzata per le eccezioni dello scheduler di inferenza."""
+    pass
+
+@dataclass
+class _InferenceRequest:
+    """Richiesta di inferenza in attesa di essere inserita in un batch."""
+    img_array: np.ndarray
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+class InferenceScheduler:
+    """
+    Scheduler di micro-batching posto davanti al ModelManager.
+    Raccoglie le richieste concorrenti fino a `max_batch_size` immagini o `max_wait_ms` millisecondi,
+    esegue un unico forward (con Grad-CAM) per batch e restituisce i risultati ai thread in attesa.
+    """
+
+    def __init__(self, model_manager, max_batch_size: int = 8, max_wait_ms: float = 10.0,
+                 result_timeout_s: float = 60.0):
+        """
+        Inizializza lo scheduler e avvia il thread di inferenza.
+
+        Args:
+            model_manager: Istanza di ModelManager usata per l'inferenza.
+            max_batch_size: Numero massimo di immagini per batch.
+            max_wait_ms: Attesa massima (in millisecondi) per riempire un batch.
+            result_timeout_s: Attesa massima (in secondi) del risultato in `predict_with_gradcam`.
+        """
+        self.model_manager = model_manager
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.result_timeout_s = result_timeout_s
+
+        self._queue: "queue.Queue[_InferenceRequest]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._total_requests = 0
+        self._total_batches = 0
+        self._total_wait = 0.0
+        self._batch_sizes: Counter = Counter()
+        self._batch_buffers: Dict[Tuple[int, ...], np.ndarray] = {}
+        self._running = True
+        # Serializza controllo di `_running` e accodamento rispetto all'arresto
+        self._submit_lock = threading.Lock()
+
+        self._worker = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+        self._worker.start()
+
+
+    def submit(self, img_array: np.ndarray) -> Future:
+        """
+        Accoda un'immagine preprocessata per l'inferenza.
+
+        Args:
+            img_array: Array preprocessato dell'immagine (1, H, W, 3).
+
+        Returns:
+            Future: Future che si risolve in (classe predetta, fiducia, heatmap, probabilità).
+
+        Raises:
+            InferenceSchedulerException: Se lo scheduler è stato arrestato.
+        """
+        request = _InferenceRequest(img_array=img_array)
+        with self._submit_lock:
+            if not self._running:
+                raise InferenceSchedulerException("Lo scheduler di inferenza è stato arrestato")
+            self._queue.put(request)
+        return request.future
+
+
+    def predict_with_gradcam(self, img_array: np.ndarray,
+                             timeout: Optional[float] = None) -> Tuple[int, float, np.ndarray, np.ndarray]:
+        """
+        Equivalente bloccante di `ModelManager.predict_with_gradcam`, eseguito tramite il batching.
+
+        Args:
+            img_array: Array preprocessato dell'immagine.
+            timeout: Attesa massima del risultato in secondi (default `result_timeout_s`).
+
+        Returns:
+            Tuple[int, float, np.ndarray, np.ndarray]: Classe predetta, fiducia, heatmap e probabilità.
+
+        Raises:
+            InferenceSchedulerException: Se lo scheduler viene arrestato o il risultato non arriva in tempo.
+        """
+        future = self.submit(img_array)
+        try:
+            return future.result(timeout=timeout if timeout is not None else self.result_timeout_s)
+        except FutureTimeoutError:
+            future.cancel()
+            raise InferenceSchedulerException("Tempo di attesa del risultato dell'inferenza scaduto")
+
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Restituisce le statistiche dello scheduler.
+
+        Returns:
+            Dict[str, Any]: Profondità della coda, numero di richieste e batch,
+                dimensione media dei batch, istogramma delle dimensioni e attesa media in coda.
+        """
+        with self._stats_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'total_requests': self._total_requests,
+                'total_batches': self._total_batches,
+                'avg_batch_size': self._total_requests / self._total_batches if self._total_batches else 0.0,
+                'batch_size_histogram': {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                'avg_queue_wait_ms': 1000.0 * self._total_wait / self._total_requests if self._total_requests else 0.0
+            }
+
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """
+        Arresta il thread di inferenza dopo aver servito le richieste già accodate; quelle rimaste
+        in coda allo scadere di `timeout` vengono chiuse con un'eccezione, così nessun thread resta in attesa.
+
+        Args:
+            timeout: Tempo massimo di attesa (in secondi) per la terminazione del thread.
+        """
+        with self._submit_lock:
+            if not self._running:
+                return
+            self._running = False
+            self._queue.put(None)
+        self._worker.join(timeout)
+
+        pending = []
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                pending.append(request)
+        if self._worker.is_alive():
+            # Il thread è ancora impegnato su un batch: riceverà comunque la richiesta di arresto
+            self._queue.put(None)
+        for request in pending:
+            if request.future.set_running_or_notify_cancel():
+                request.future.set_exception(
+                    InferenceSchedulerException("Lo scheduler di inferenza è stato arrestato")
+                )
+
+
+    def _collect_batch(self, first: _InferenceRequest) -> List[_InferenceRequest]:
+        """
+        Raccoglie altre richieste fino al riempimento del batch o alla scadenza dell'attesa.
+        """
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                # Ripropaga la richiesta di arresto dopo aver servito il batch corrente
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+
+    def _process(self, batch: List[_InferenceRequest]) -> None:
+        """
+        Esegue l'inferenza su un batch, raggruppando le immagini con la stessa risoluzione.
+        """
+        groups: Dict[Tuple[int, ...], List[_InferenceRequest]] = {}
+        # Le richieste il cui chiamante ha smesso di attendere (timeout) sono annullate e vengono scartate
+        for request in (r for r in batch if r.future.set_running_or_notify_cancel()):
+            groups.setdefault(request.img_array.shape[1:], []).append(request)
+
+        for requests in groups.values():
+            started_at = time.monotonic()
+            try:
+                img_batch = self._stack(requests)
+                probabilities, heatmaps = self.model_manager.predict_with_gradcam_batch(img_batch)
+            except Exception as e:
+                for request in requests:
+                    request.future.set_exception(e)
+                continue
+
+            for i, request in enumerate(requests):
+                predicted_class = int(np.argmax(probabilities[i]))
+                confidence = float(probabilities[i][predicted_class])
+                request.future.set_result((predicted_class, confidence, heatmaps[i], probabilities[i]))
+
+            with self._stats_lock:
+                self._total_batches += 1
+                self._total_requests += len(requests)
+                self._batch_sizes[len(requests)] += 1
+                self._total_wait += sum(started_at - r.enqueued_at for r in requests)
+
+
+    def _stack(self, requests: List[_InferenceRequest]) -> np.ndarray:
+        """
+        Copia le immagini delle richieste in un buffer di batch, riutilizzato tra un batch e l'altro
+        (il thread di inferenza ne elabora uno alla volta). I buffer vengono mantenuti solo per le
+        risoluzioni dei bucket configurati: a risoluzione nativa ogni dimensione di scansione
+        occuperebbe un buffer da `max_batch_size` immagini per tutta la vita del processo.
+        """
+        if len(requests) == 1:
+            return requests[0].img_array
+        shape = requests[0].img_array.shape[1:]
+        if tuple(shape[:2]) not in self.model_manager.input_buckets:
+            return np.concatenate([r.img_array for r in requests], axis=0)
+        buffer = self._batch_buffers.get(shape)
+        if buffer is None:
+            buffer = np.empty((self.max_batch_size,) + shape, dtype=np.float32)
+            self._batch_buffers[shape] = buffer
+        img_batch = buffer[:len(requests)]
+        np.concatenate([r.img_array for r in requests], axis=0, out=img_batch)
+        return img_batch
+
+
+    def _run(self) -> None:
+        """
+        Ciclo principale del thread di inferenza.
+        """
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            self._process(self._collect_batch(first))
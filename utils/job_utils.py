@@ -0,0 +1,177 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Any, List, Optional
+
+class JobQueueFullException(Exception):
+    """Job rifiutato perché la coda dei job in background è piena."""
+    pass
+
+@dataclass
+class JobReservation:
+    """
+    Posto riservato nella coda dei job, da passare a `JobManager.submit()`.
+    Se il job non viene accodato il posto va liberato con `release()`.
+    """
+    _manager: Optional['JobManager'] = field(default=None, repr=False)
+    _consumed: bool = field(default=False, repr=False)
+
+    def release(self) -> None:
+        """
+        Libera il posto se non è stato usato da un job; le chiamate successive non hanno effetto.
+        """
+        if self._manager is not None:
+            self._manager._release_reservation(self)
+
+class JobManager:
+    """
+    Gestore dei job in background (es. rendering della Grad-CAM e caricamento dei file di /predict).
+    Tiene in memoria lo stato dei job in corso e degli ultimi job completati.
+    """
+
+    def __init__(self, max_workers: int = 2, max_finished_jobs: int = 1000, max_pending: Optional[int] = None):
+        """
+        Inizializza il pool di thread dei job.
+
+        Args:
+            max_workers: Numero di job eseguiti in parallelo.
+            max_finished_jobs: Numero di job completati di cui conservare lo stato.
+            max_pending: Numero massimo di job accodati o in esecuzione (None per nessun limite).
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.max_finished_jobs = max_finished_jobs
+        self.max_pending = max_pending
+
+
+    def reserve(self) -> JobReservation:
+        """
+        Riserva un posto nella coda dei job, prima di operazioni che non vanno ripetute
+        (es. l'assegnazione dell'indice della radiografia) se il job venisse poi rifiutato.
+
+        Returns:
+            JobReservation: Posto riservato.
+
+        Raises:
+            JobQueueFullException: Se i job accodati, in esecuzione o riservati sono già `max_pending`.
+        """
+        with self._lock:
+            if self.max_pending is not None and self._pending >= self.max_pending:
+                raise JobQueueFullException("Troppi job in background in corso")
+            self._pending += 1
+        return JobReservation(_manager=self)
+
+
+    def submit(self,
+               fn: Callable[[], Dict[str, Any]],
+               metadata: Optional[Dict[str, Any]] = None,
+               reservation: Optional[JobReservation] = None) -> str:
+        """
+        Accoda un job.
+
+        Args:
+            fn: Funzione da eseguire; il dizionario restituito diventa il risultato del job.
+            metadata: Informazioni associate al job (es. paziente e indice della radiografia).
+            reservation: Posto ottenuto da `reserve()`; se None il posto viene riservato ora.
+
+        Returns:
+            str: ID del job.
+
+        Raises:
+            JobQueueFullException: Se i job accodati o in esecuzione sono già `max_pending`.
+        """
+        if reservation is None:
+            reservation = self.reserve()
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            if reservation._consumed:
+                raise ValueError("Posto nella coda dei job già utilizzato o liberato")
+            reservation._consumed = True
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'status': 'queued',
+                'created_at': time.time(),
+                'finished_at': None,
+                'result': None,
+                'error': None,
+                **(metadata or {})
+            }
+        self._executor.submit(self._run, job_id, fn)
+        return job_id
+
+
+    def _release_reservation(self, reservation: JobReservation) -> None:
+        with self._lock:
+            if reservation._consumed:
+                return
+            reservation._consumed = True
+            self._pending -= 1
+
+
+    def _run(self, job_id: str, fn: Callable[[], Dict[str, Any]]) -> None:
+        """
+        Esegue un job aggiornandone lo stato.
+        """
+        self._update(job_id, status='running')
+        try:
+            result = fn()
+            self._update(job_id, status='done', result=result, finished_at=time.time())
+        except Exception as e:
+            print(f"Errore nel job {job_id}: {str(e)}")
+            self._update(job_id, status='failed', error=str(e), finished_at=time.time())
+        with self._lock:
+            self._pending -= 1
+        self._prune()
+
+
+    def _update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+
+    def _prune(self) -> None:
+        """
+        Elimina lo stato dei job completati più vecchi oltre `max_finished_jobs`.
+        """
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items() if job['finished_at'] is not None]
+            for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+                del self._jobs[job_id]
+
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Restituisce lo stato di un job.
+
+        Args:
+            job_id: ID del job.
+
+        Returns:
+            Optional[Dict[str, Any]]: Stato del job, o None se sconosciuto.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+
+    def find(self, **filters) -> List[Dict[str, Any]]:
+        """
+        Restituisce i job i cui metadati corrispondono ai filtri indicati.
+
+        Args:
+            filters: Coppie campo/valore (es. patient_id='...', status='running').
+
+        Returns:
+            List[Dict[str, Any]]: Stato dei job trovati.
+        """
+        with self._lock:
+            return [
+                dict(job) for job in self._jobs.values()
+                if all(job.get(key) == value for key, value in filters.items())
+            ]
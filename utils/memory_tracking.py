@@ -0,0 +1,210 @@
+import os
+import resource
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+_MIB = 1024 * 1024
+
+
+def current_rss() -> int:
+    """
+    Memoria residente attuale del processo, in byte (da /proc; se non disponibile, il picco del processo).
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def peak_rss() -> int:
+    """
+    Picco di memoria residente del processo dall'avvio, in byte (ru_maxrss è in KiB su Linux).
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RssSampler:
+    """
+    Campiona la RSS del processo a intervalli regolari mentre almeno una misura è attiva,
+    così da rilevare i picchi transitori interni a una fase e non solo i valori agli estremi.
+    """
+
+    def __init__(self, interval_s: float = 0.01):
+        """
+        Args:
+            interval_s: Intervallo di campionamento, in secondi.
+        """
+        self.interval_s = interval_s
+        self._lock = threading.Lock()
+        self._active = threading.Condition(self._lock)
+        self._peaks: Dict[int, int] = {}
+        self._next_id = 0
+        self._thread = None
+
+
+    def start(self) -> int:
+        """
+        Avvia una misura del picco di RSS.
+
+        Returns:
+            int: Identificativo della misura, da passare a `stop()`.
+        """
+        rss = current_rss()
+        with self._lock:
+            self._next_id += 1
+            measure_id = self._next_id
+            self._peaks[measure_id] = rss
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self._thread.start()
+            self._active.notify()
+        return measure_id
+
+
+    def stop(self, measure_id: int) -> int:
+        """
+        Termina una misura.
+
+        Returns:
+            int: Picco di RSS campionato durante la misura, in byte.
+        """
+        rss = current_rss()
+        with self._lock:
+            return max(self._peaks.pop(measure_id), rss)
+
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                while not self._peaks:
+                    self._active.wait()
+            rss = current_rss()
+            with self._lock:
+                for measure_id, peak in self._peaks.items():
+                    if rss > peak:
+                        self._peaks[measure_id] = rss
+            time.sleep(self.interval_s)
+
+
+class RequestMemoryProfile:
+    """
+    Memoria (RSS del processo) misurata nelle fasi di una singola richiesta.
+    """
+
+    def __init__(self, tracker: 'MemoryTracker', name: str):
+        self._tracker = tracker
+        self.name = name
+        self.stages: Dict[str, Dict[str, float]] = {}
+
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Misura una fase della pipeline: RSS all'ingresso e all'uscita e picco di RSS campionato
+        durante la fase.
+        """
+        if not self._tracker.enabled:
+            yield
+            return
+        rss_before = current_rss()
+        measure_id = self._tracker.sampler.start()
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration_ms = 1000.0 * (time.perf_counter() - started_at)
+            peak = self._tracker.sampler.stop(measure_id)
+            rss_after = current_rss()
+            self.stages[name] = {
+                'rss_before_mib': rss_before / _MIB,
+                'rss_after_mib': rss_after / _MIB,
+                'peak_rss_mib': max(peak, rss_before, rss_after) / _MIB,
+                'duration_ms': duration_ms
+            }
+
+
+    def finish(self) -> None:
+        """
+        Registra il profilo della richiesta nelle statistiche aggregate.
+        """
+        if self._tracker.enabled and self.stages:
+            self._tracker._record(self)
+
+
+class MemoryTracker:
+    """
+    Raccoglie i picchi di memoria per fase (validazione, preprocessing, inferenza, codifica,
+    caricamento) delle richieste di analisi. Le misure si basano sulla RSS del processo, campionata
+    ogni `sample_interval_ms` durante le fasi: con richieste concorrenti rappresentano un limite
+    superiore della memoria usata dalla singola richiesta, e picchi più brevi dell'intervallo
+    possono sfuggire.
+    """
+
+    def __init__(self, enabled: bool = True, history_size: int = 50, sample_interval_ms: float = 10.0):
+        """
+        Args:
+            enabled: Se effettuare le misure.
+            history_size: Numero di profili delle richieste più recenti da conservare.
+            sample_interval_ms: Intervallo di campionamento della RSS durante le fasi, in millisecondi.
+        """
+        self.enabled = enabled
+        self.sampler = RssSampler(max(1.0, sample_interval_ms) / 1000.0)
+        self._lock = threading.Lock()
+        self._history: deque = deque(maxlen=history_size)
+        self._stages: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+
+
+    def start(self, name: str) -> RequestMemoryProfile:
+        """
+        Crea il profilo di una richiesta; va chiuso con `finish()` al termine della richiesta.
+
+        Args:
+            name: Nome della richiesta (es. 'predict').
+
+        Returns:
+            RequestMemoryProfile: Profilo su cui misurare le fasi.
+        """
+        return RequestMemoryProfile(self, name)
+
+
+    def _record(self, profile: RequestMemoryProfile) -> None:
+        with self._lock:
+            self._history.append({'request': profile.name, 'stages': dict(profile.stages)})
+            for stage_name, stage in profile.stages.items():
+                stats = self._stages[f"{profile.name}.{stage_name}"]
+                stats['count'] += 1
+                stats['max_peak_rss_mib'] = max(stats['max_peak_rss_mib'], stage['peak_rss_mib'])
+                stats['total_peak_increase_mib'] += stage['peak_rss_mib'] - stage['rss_before_mib']
+                stats['total_growth_mib'] += max(0.0, stage['rss_after_mib'] - stage['rss_before_mib'])
+
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Restituisce le statistiche aggregate per fase e i profili delle richieste più recenti.
+
+        Returns:
+            Dict[str, Any]: RSS attuale e di picco del processo, statistiche per fase e profili recenti.
+        """
+        with self._lock:
+            stages = {
+                name: {
+                    'count': int(stats['count']),
+                    'max_peak_rss_mib': stats['max_peak_rss_mib'],
+                    'avg_peak_increase_mib': stats['total_peak_increase_mib'] / stats['count'] if stats['count'] else 0.0,
+                    'avg_growth_mib': stats['total_growth_mib'] / stats['count'] if stats['count'] else 0.0
+                }
+                for name, stats in self._stages.items()
+            }
+            recent: List[Dict[str, Any]] = list(self._history)
+        return {
+            'enabled': self.enabled,
+            'rss_mib': current_rss() / _MIB,
+            'peak_rss_mib': peak_rss() / _MIB,
+            'stages': stages,
+            'recent_requests': recent
+        }
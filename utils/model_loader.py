@@ -0,0 +1,235 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, Optional, Iterator
+
+class ModelLoader:
+    """
+    Carica (e preriscalda) il modello in un thread in background, così le route che non usano
+    TensorFlow sono disponibili subito. Espone lo stato di avanzamento per la readiness probe
+    e i componenti di inferenza creati ('model', 'inference', 'inference_pool', 'model_version').
+
+    Il modello può essere ricaricato a caldo: i nuovi componenti vengono creati e preriscaldati
+    accanto a quelli in uso, sostituiti in modo atomico e i vecchi vengono dismessi solo dopo
+    che le richieste che li stanno usando (acquisite con `acquire`) sono terminate.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._ready = threading.Event()
+        self._components: Dict[str, Any] = {}
+        self._in_flight: Dict[int, int] = {}
+        self._build: Optional[Callable[['ModelLoader'], Dict[str, Any]]] = None
+        self._retire: Optional[Callable[[Dict[str, Any]], None]] = None
+        self._thread: Optional[threading.Thread] = None
+        self._reload_thread: Optional[threading.Thread] = None
+        self.reload_status: Optional[Dict[str, Any]] = None
+        self.stage = 'pending'
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.ready_at: Optional[float] = None
+        self.stage_timings: Dict[str, float] = {}
+        self._stage_started_at: Optional[float] = None
+
+
+    def start(self,
+              build: Callable[['ModelLoader'], Dict[str, Any]],
+              background: bool = True,
+              retire: Optional[Callable[[Dict[str, Any]], None]] = None) -> None:
+        """
+        Avvia il caricamento.
+
+        Args:
+            build: Funzione che riceve il loader (per aggiornare lo stato, o None durante un ricaricamento)
+                e restituisce i componenti di inferenza.
+            background: Se eseguire il caricamento in un thread separato.
+            retire: Funzione che rilascia i componenti sostituiti da un ricaricamento (es. arresto dei worker).
+        """
+        self._build = build
+        self._retire = retire
+        self.started_at = time.time()
+        if background:
+            self._thread = threading.Thread(target=self._run, args=(build,), name="model-loader", daemon=True)
+            self._thread.start()
+        else:
+            self._run(build)
+            if self.error is not None:
+                raise RuntimeError(self.error)
+
+
+    def set_stage(self, stage: str) -> None:
+        """
+        Registra l'inizio di una nuova fase di caricamento, chiudendo il cronometro della precedente.
+
+        Args:
+            stage: Nome della fase (es. 'loading_model', 'warming_up').
+        """
+        now = time.time()
+        with self._lock:
+            if self._stage_started_at is not None:
+                self.stage_timings[self.stage] = round(now - self._stage_started_at, 3)
+            self.stage = stage
+            self._stage_started_at = now
+
+
+    def _run(self, build: Callable[['ModelLoader'], Dict[str, Any]]) -> None:
+        """
+        Esegue il caricamento e pubblica i componenti una volta pronti.
+        """
+        try:
+            components = build(self)
+            with self._lock:
+                self._components = components
+            self.set_stage('ready')
+            self.ready_at = time.time()
+            self._ready.set()
+            print(f"Modello pronto in {self.ready_at - self.started_at:.2f}s")
+        except Exception as e:
+            self.error = str(e)
+            self.set_stage('failed')
+            print(f"Errore nel caricamento del modello: {self.error}")
+
+
+    def get(self, name: str) -> Any:
+        """
+        Restituisce un componente di inferenza, o None se non ancora disponibile.
+
+        Args:
+            name: Nome del componente ('model', 'inference', 'inference_pool').
+        """
+        with self._lock:
+            return self._components.get(name)
+
+
+    @contextmanager
+    def acquire(self) -> Iterator[Dict[str, Any]]:
+        """
+        Fornisce un'istantanea coerente dei componenti di inferenza per la durata di una richiesta:
+        un ricaricamento concorrente non li dismette finché la richiesta non è terminata.
+
+        Yields:
+            Dict[str, Any]: Componenti di inferenza in uso.
+        """
+        with self._lock:
+            components = self._components
+            self._in_flight[id(components)] = self._in_flight.get(id(components), 0) + 1
+        try:
+            yield components
+        finally:
+            with self._lock:
+                self._in_flight[id(components)] -= 1
+                if self._in_flight[id(components)] == 0:
+                    del self._in_flight[id(components)]
+                    self._drained.notify_all()
+
+
+    def reload(self, drain_timeout: float = 60.0) -> bool:
+        """
+        Avvia in background il ricaricamento del modello, senza interrompere il servizio.
+
+        Args:
+            drain_timeout: Tempo massimo di attesa delle richieste in corso sui vecchi componenti, in secondi.
+
+        Returns:
+            bool: False se il modello non è ancora pronto o un ricaricamento è già in corso.
+        """
+        with self._lock:
+            if not self._ready.is_set() or (self.reload_status and self.reload_status['state'] in ('loading', 'draining')):
+                return False
+            self.reload_status = {
+                'state': 'loading',
+                'from_version': self._components.get('model_version'),
+                'to_version': None,
+                'error': None,
+                'started_at': time.time(),
+                'finished_at': None,
+                'drained': None
+            }
+        self._reload_thread = threading.Thread(
+            target=self._run_reload, args=(drain_timeout,), name="model-reloader", daemon=True
+        )
+        self._reload_thread.start()
+        return True
+
+
+    def _run_reload(self, drain_timeout: float) -> None:
+        """
+        Crea e preriscalda i nuovi componenti, li sostituisce ai vecchi e dismette questi ultimi.
+        """
+        try:
+            components = self._build(None)
+        except Exception as e:
+            print(f"Errore nel ricaricamento del modello: {str(e)}")
+            self._update_reload(state='failed', error=str(e), finished_at=time.time())
+            return
+
+        with self._lock:
+            old_components = self._components
+            self._components = components
+            self.reload_status.update(state='draining', to_version=components.get('model_version'))
+        print(f"Modello sostituito: {self.reload_status['from_version']} -> {self.reload_status['to_version']}")
+
+        drained = self._wait_drained(old_components, drain_timeout)
+        try:
+            if self._retire is not None:
+                self._retire(old_components)
+            self._update_reload(state='done', drained=drained, finished_at=time.time())
+        except Exception as e:
+            self._update_reload(state='failed', drained=drained, error=str(e), finished_at=time.time())
+
+
+    def _wait_drained(self, components: Dict[str, Any], timeout: float) -> bool:
+        """
+        Attende che nessuna richiesta stia usando i componenti indicati.
+
+        Returns:
+            bool: False se il tempo massimo è scaduto con richieste ancora in corso.
+        """
+        with self._lock:
+            return self._drained.wait_for(lambda: id(components) not in self._in_flight, timeout)
+
+
+    def _update_reload(self, **fields) -> None:
+        with self._lock:
+            self.reload_status.update(fields)
+
+
+    def is_ready(self) -> bool:
+        """
+        Indica se il modello è caricato e preriscaldato.
+        """
+        return self._ready.is_set()
+
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Attende che il modello sia pronto.
+
+        Args:
+            timeout: Tempo massimo di attesa, in secondi.
+
+        Returns:
+            bool: True se il modello è pronto.
+        """
+        return self._ready.wait(timeout)
+
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        Restituisce lo stato del caricamento per la readiness probe.
+
+        Returns:
+            Dict[str, Any]: Fase corrente, errore, durata delle fasi e tempo trascorso.
+        """
+        with self._lock:
+            now = self.ready_at or time.time()
+            return {
+                'ready': self._ready.is_set(),
+                'stage': self.stage,
+                'error': self.error,
+                'model_version': self._components.get('model_version'),
+                'stage_timings_s': dict(self.stage_timings),
+                'elapsed_s': round(now - self.started_at, 3) if self.started_at else None,
+                'reload': dict(self.reload_status) if self.reload_status else None
+            }
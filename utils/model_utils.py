@@ -1,39 +1,265 @@
+import time
 import cv2
 import numpy as np
 import tensorflow as tf
 from typing import Tuple
 from typing import Optional
+from typing import Dict
+from typing import Callable
+from typing import Sequence
+from typing import List
+from utils.inference_backends import InferenceBackend, KerasBackend, IMAGE_BATCH_SPEC
+
+# Strato convoluzionale usato di default per la Grad-CAM
+GRADCAM_LAYER_NAME = "conv5_block3_out"
+
+# Medie per canale (BGR) della normalizzazione 'caffe' usata da resnet50.preprocess_input
+_CAFFE_MEAN_BGR = np.array([103.939, 116.779, 123.68], dtype=np.float32)
 
 class ModelManager:
-    def __init__(self, model: tf.keras.Model):
+    def __init__(self,
+                 model: tf.keras.Model,
+                 jit_compile: bool = False,
+                 input_buckets: Optional[Sequence[Tuple[int, int]]] = None,
+                 backend: Optional[InferenceBackend] = None,
+                 model_version: Optional[str] = None):
         """
         Inizializza il gestore del modello con un'istanza del modello Keras.
+        I sotto-modelli per la Grad-CAM e le funzioni di inferenza compilate (`tf.function`)
+        vengono costruiti una sola volta qui, così ogni richiesta esegue soltanto il forward/backward pass.
 
         Args:
             model: Modello TensorFlow/Keras pre-addestrato.
+            jit_compile: Se compilare le funzioni di inferenza con XLA.
+            input_buckets: Risoluzioni (altezza, larghezza) ammesse in input al modello. Ogni immagine
+                viene ridimensionata al bucket più vicino; se vuoto si usa la risoluzione nativa.
+            backend: Backend usato per la sola classificazione (default: Keras compilato).
+                La Grad-CAM usa sempre il modello Keras, che fornisce i gradienti.
+            model_version: Versione dei pesi caricati (es. generation del blob su GCS).
         """
         self.model = model
+        self.model_version = model_version
+        self.jit_compile = jit_compile
+        self.input_buckets: List[Tuple[int, int]] = [tuple(bucket) for bucket in (input_buckets or [])]
+        self._gradcam_models: Dict[str, Tuple[tf.keras.Model, tf.keras.Model, Callable]] = {}
+        self._all_class_gradcam_fns: Dict[str, Callable] = {}
+        self.backend = backend or KerasBackend(model, jit_compile=jit_compile)
+        self._get_gradcam_models(GRADCAM_LAYER_NAME)
+
+
+    def _get_gradcam_models(self, last_conv_layer_name: str) -> Tuple[tf.keras.Model, tf.keras.Model, Callable]:
+        """
+        Restituisce (costruendoli alla prima richiesta) i sotto-modelli Grad-CAM per lo strato indicato
+        e la relativa funzione compilata che esegue forward e backward pass.
+
+        Args:
+            last_conv_layer_name: Nome dello strato convoluzionale della ResNet50.
+
+        Returns:
+            Tuple[tf.keras.Model, tf.keras.Model, Callable]:
+                - Modello dall'input all'output dello strato convoluzionale.
+                - Modello classificatore dall'output dello strato convoluzionale alle predizioni.
+                - Funzione compilata (img_batch, pred_indices) -> (predizioni, heatmap).
+        """
+        cached = self._gradcam_models.get(last_conv_layer_name)
+        if cached is not None:
+            return cached
+
+        resnet_model = self.model.get_layer('resnet50')
+        last_conv_layer = resnet_model.get_layer(last_conv_layer_name)
+        last_conv_layer_model = tf.keras.models.Model(resnet_model.input, last_conv_layer.output)
+
+        classifier_input = tf.keras.layers.Input(shape=last_conv_layer.output.shape[1:])
+        x = classifier_input
+        for layer in self.model.layers[1:]:
+            x = layer(x)
+        classifier_model = tf.keras.models.Model(classifier_input, x)
+
+        def gradcam_fn(img_batch: tf.Tensor, pred_indices: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor]:
+            with tf.GradientTape() as tape:
+                last_conv_layer_output = last_conv_layer_model(img_batch, training=False)
+                tape.watch(last_conv_layer_output)
+                preds = classifier_model(last_conv_layer_output, training=False)
+                # Un indice negativo indica di usare la classe predetta
+                predicted = tf.argmax(preds, axis=1, output_type=tf.int32)
+                pred_indices = tf.where(pred_indices < 0, predicted, pred_indices)
+                class_channel = tf.gather(preds, pred_indices, axis=1, batch_dims=1)
+
+            # Le immagini del batch sono indipendenti: il gradiente della somma coincide
+            # con il gradiente di ciascuna immagine rispetto alla propria attivazione
+            grads = tape.gradient(class_channel, last_conv_layer_output)
+            pooled_grads = tf.reduce_mean(grads, axis=(1, 2))
+            heatmaps = tf.einsum('bhwc,bc->bhw', last_conv_layer_output, pooled_grads)
+            max_values = tf.math.reduce_max(heatmaps, axis=(1, 2), keepdims=True)
+            heatmaps = tf.math.divide_no_nan(tf.maximum(heatmaps, 0), max_values)
+            return preds, heatmaps
+
+        compiled_fn = tf.function(
+            gradcam_fn,
+            input_signature=[IMAGE_BATCH_SPEC, tf.TensorSpec(shape=[None], dtype=tf.int32)],
+            jit_compile=self.jit_compile
+        )
+
+        self._gradcam_models[last_conv_layer_name] = (last_conv_layer_model, classifier_model, compiled_fn)
+        return self._gradcam_models[last_conv_layer_name]
+
+
+    def _get_all_class_gradcam_fn(self, last_conv_layer_name: str) -> Callable:
+        """
+        Restituisce (compilandola alla prima richiesta) la funzione che calcola le heatmap di tutte
+        le classi con un solo forward pass: il Jacobiano (per immagine) delle predizioni rispetto
+        all'attivazione dello strato convoluzionale viene calcolato in forma vettorizzata.
+
+        Args:
+            last_conv_layer_name: Nome dello strato convoluzionale della ResNet50.
+
+        Returns:
+            Callable: Funzione compilata img_batch -> (predizioni (N, C), heatmap (N, C, h, w)).
+        """
+        cached = self._all_class_gradcam_fns.get(last_conv_layer_name)
+        if cached is not None:
+            return cached
+
+        last_conv_layer_model, classifier_model, _ = self._get_gradcam_models(last_conv_layer_name)
+
+        def all_class_gradcam_fn(img_batch: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor]:
+            with tf.GradientTape() as tape:
+                last_conv_layer_output = last_conv_layer_model(img_batch, training=False)
+                tape.watch(last_conv_layer_output)
+                preds = classifier_model(last_conv_layer_output, training=False)
+
+            # Jacobiano (N, C, h, w, k): una riga per classe, senza ripetere il forward della ResNet50
+            jacobian = tape.batch_jacobian(preds, last_conv_layer_output)
+            pooled_grads = tf.reduce_mean(jacobian, axis=(2, 3))
+            heatmaps = tf.einsum('bhwk,bck->bchw', last_conv_layer_output, pooled_grads)
+            max_values = tf.math.reduce_max(heatmaps, axis=(2, 3), keepdims=True)
+            heatmaps = tf.math.divide_no_nan(tf.maximum(heatmaps, 0), max_values)
+            return preds, heatmaps
+
+        compiled_fn = tf.function(
+            all_class_gradcam_fn,
+            input_signature=[IMAGE_BATCH_SPEC],
+            jit_compile=self.jit_compile
+        )
+        self._all_class_gradcam_fns[last_conv_layer_name] = compiled_fn
+        return compiled_fn
+
+
+    def warmup(self, input_shapes: Optional[Sequence[Tuple[int, int]]] = None, batch_sizes: Sequence[int] = (1,)) -> float:
+        """
+        Esegue le funzioni compilate su input sintetici, così il tracing (e l'eventuale compilazione XLA)
+        avviene all'avvio e non alla prima richiesta.
+
+        Args:
+            input_shapes: Risoluzioni (altezza, larghezza) da preriscaldare. Se non fornite, usa i bucket di input.
+            batch_sizes: Dimensioni dei batch da preriscaldare.
+
+        Returns:
+            float: Tempo impiegato per il riscaldamento, in secondi.
+        """
+        if input_shapes is None:
+            input_shapes = self.input_buckets
+        started_at = time.perf_counter()
+        for height, width in input_shapes:
+            for batch_size in batch_sizes:
+                img_batch = np.zeros((batch_size, height, width, 3), dtype=np.float32)
+                self.backend.predict(img_batch)
+                self._gradcam_pass(img_batch, GRADCAM_LAYER_NAME)
+        elapsed = time.perf_counter() - started_at
+        print(f"Warmup del modello completato in {elapsed:.2f}s")
+        return elapsed
 
 
-    def preprocess_image(self, file) -> Tuple[np.ndarray, np.ndarray]:
+    def select_bucket(self, height: int, width: int) -> Optional[Tuple[int, int]]:
         """
-        Preprocessa l'immagine per l'input al modello.
+        Sceglie il bucket di input più adatto a un'immagine: quello con il rapporto d'aspetto più vicino
+        e, a parità, il più grande che non richiede di ingrandire l'immagine (o il più piccolo,
+        se tutti la ingrandirebbero). Il costo del forward resta così limitato dai bucket configurati.
+
+        Args:
+            height: Altezza dell'immagine originale.
+            width: Larghezza dell'immagine originale.
+
+        Returns:
+            Optional[Tuple[int, int]]: Bucket (altezza, larghezza), o None se si usa la risoluzione nativa.
+        """
+        if not self.input_buckets:
+            return None
+
+        aspect = np.log(width / height)
+        def score(bucket: Tuple[int, int]) -> Tuple[float, bool, int]:
+            bucket_height, bucket_width = bucket
+            aspect_distance = round(abs(np.log(bucket_width / bucket_height) - aspect), 3)
+            upscale = bucket_height > height or bucket_width > width
+            area = bucket_height * bucket_width
+            return aspect_distance, upscale, area if upscale else -area
+
+        return min(self.input_buckets, key=score)
+
+
+    @staticmethod
+    def _resize(img: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+        """
+        Ridimensiona un'immagine a (altezza, larghezza), con interpolazione adatta alla direzione.
+        """
+        height, width = size
+        shrinking = height * width < img.shape[0] * img.shape[1]
+        interpolation = cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR
+        return cv2.resize(img, (width, height), interpolation=interpolation)
+
+
+    def preprocess_image(self, file, for_display: bool = True) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Preprocessa l'immagine per l'input al modello, limitando le copie a piena risoluzione:
+        l'equalizzazione avviene in place e la normalizzazione di `resnet50.preprocess_input`
+        (modalità 'caffe') viene scritta direttamente nel buffer float32 di destinazione.
 
         Args:
             file: File binario dell'immagine.
+            for_display: Se restituire l'immagine equalizzata a risoluzione originale (per la Grad-CAM).
 
         Returns:
-            Tuple[np.ndarray, np.ndarray]: 
+            Tuple[np.ndarray, Optional[np.ndarray]]:
                 - Array preprocessato dell'immagine per l'input al modello.
-                - Immagine RGB equalizzata per la visualizzazione o elaborazioni successive.
+                - Immagine equalizzata in scala di grigi (a risoluzione originale) per la visualizzazione,
+                  o None se `for_display` è False.
+        """
+        data = np.frombuffer(file.read(), np.uint8)
+        img = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            raise ValueError("Impossibile decodificare l'immagine caricata")
+        cv2.equalizeHist(img, dst=img)
+
+        # L'input al modello viene portato alla risoluzione del bucket, la Grad-CAM
+        # resta invece alla risoluzione originale dell'immagine equalizzata
+        model_input = img
+        bucket = self.select_bucket(img.shape[0], img.shape[1])
+        if bucket is not None and bucket != img.shape[:2]:
+            model_input = self._resize(img, bucket)
+
+        out = np.empty((1, model_input.shape[0], model_input.shape[1], 3), dtype=np.float32)
+        # Con i tre canali uguali, RGB->BGR e sottrazione della media si riducono a gray - media[c]
+        np.subtract(model_input[..., np.newaxis], _CAFFE_MEAN_BGR, out=out[0])
+        return out, (img if for_display else None)
+
+
+    def analyze(self, file) -> Tuple[int, float, np.ndarray, np.ndarray]:
+        """
+        Esegue l'intera pipeline su un file: preprocessing, predizione con Grad-CAM e sovrapposizione.
+
+        Args:
+            file: File binario dell'immagine.
+
+        Returns:
+            Tuple[int, float, np.ndarray, np.ndarray]:
+                - Classe predetta (indice della classe).
+                - Fiducia associata alla classe predetta.
+                - Immagine Grad-CAM risultante con heatmap sovrapposta.
+                - Probabilità di tutte le classi.
         """
-        img = cv2.imdecode(np.frombuffer(file.read(), np.uint8), cv2.IMREAD_GRAYSCALE)
-        equalized_img = cv2.equalizeHist(img)
-        img_rgb = cv2.cvtColor(equalized_img, cv2.COLOR_GRAY2RGB)
-        img_array = tf.keras.utils.img_to_array(img_rgb)
-        img_array = np.expand_dims(img_array, axis=0)
-        img_array = tf.keras.applications.resnet50.preprocess_input(img_array)
-        return img_array, img_rgb
+        img_array, img_rgb = self.preprocess_image(file)
+        predicted_class, confidence, heatmap, probabilities = self.predict_with_gradcam(img_array)
+        return predicted_class, confidence, self.overlay_heatmap(heatmap, img_rgb), probabilities
 
 
     def predict_class(self, img_array: np.ndarray) -> Tuple[int, float]:
@@ -48,12 +274,50 @@ class ModelManager:
                 - Classe predetta (indice della classe).
                 - Fiducia associata alla classe predetta (valore float compreso tra 0 e 1).
         """
-        predictions = self.model.predict(img_array)
+        predictions = self.backend.predict(img_array)
         predicted_class = np.argmax(predictions[0])
         confidence = float(np.max(predictions[0]))
         return predicted_class, confidence
 
 
+    def predict_batch(self, img_batch: np.ndarray) -> np.ndarray:
+        """
+        Calcola le probabilità delle classi per un batch di immagini tramite il backend configurato.
+
+        Args:
+            img_batch: Batch di immagini preprocessate (N, H, W, 3).
+
+        Returns:
+            np.ndarray: Probabilità delle classi (N, num_classi).
+        """
+        return self.backend.predict(img_batch)
+
+
+    def _gradcam_pass(self, img_batch: np.ndarray, last_conv_layer_name: str, pred_indices: Optional[np.ndarray] = None) -> Tuple[tf.Tensor, tf.Tensor]:
+        """
+        Esegue un unico forward pass (registrato dal GradientTape) e un unico backward pass,
+        restituendo sia le predizioni che le heatmap Grad-CAM per ogni immagine del batch.
+
+        Args:
+            img_batch: Batch di immagini preprocessate (N, H, W, 3).
+            last_conv_layer_name: Nome dell'ultimo strato convoluzionale nel modello.
+            pred_indices: Indici delle classi per cui calcolare le heatmap (uno per immagine).
+                Se non forniti, utilizza le classi predette.
+
+        Returns:
+            Tuple[tf.Tensor, tf.Tensor]:
+                - Probabilità delle classi (N, num_classi).
+                - Heatmap Grad-CAM normalizzate (N, h, w).
+        """
+        _, _, gradcam_fn = self._get_gradcam_models(last_conv_layer_name)
+        if pred_indices is None:
+            pred_indices = np.full((len(img_batch),), -1, dtype=np.int32)
+        return gradcam_fn(
+            tf.convert_to_tensor(img_batch, dtype=tf.float32),
+            tf.convert_to_tensor(pred_indices, dtype=tf.int32)
+        )
+
+
     def make_gradcam_heatmap(self, img_array: np.ndarray, last_conv_layer_name: str, pred_index: Optional[int] = None) -> np.ndarray:
         """
         Genera una heatmap Grad-CAM per l'immagine data.
@@ -66,47 +330,123 @@ class ModelManager:
         Returns:
             np.ndarray: Heatmap Grad-CAM normalizzata come array 2D.
         """
-        resnet_model = self.model.get_layer('resnet50')
-        last_conv_layer = resnet_model.get_layer(last_conv_layer_name)
-        last_conv_layer_model = tf.keras.models.Model(resnet_model.input, last_conv_layer.output)
-        
-        classifier_input = tf.keras.layers.Input(shape=last_conv_layer.output.shape[1:])
-        x = classifier_input
-        for layer in self.model.layers[1:]:
-            x = layer(x)
-        classifier_model = tf.keras.models.Model(classifier_input, x)
+        pred_indices = None if pred_index is None else np.array([pred_index])
+        _, heatmaps = self._gradcam_pass(img_array, last_conv_layer_name, pred_indices)
+        return heatmaps[0].numpy()
 
-        with tf.GradientTape() as tape:
-            last_conv_layer_output = last_conv_layer_model(img_array)
-            tape.watch(last_conv_layer_output)
-            preds = classifier_model(last_conv_layer_output)
-            if pred_index is None:
-                pred_index = tf.argmax(preds[0])
-            class_channel = preds[:, pred_index]
 
-        grads = tape.gradient(class_channel, last_conv_layer_output)
-        pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
-        last_conv_layer_output = last_conv_layer_output[0]
-        heatmap = last_conv_layer_output @ pooled_grads[..., tf.newaxis]
-        heatmap = tf.squeeze(heatmap)
-        heatmap = tf.maximum(heatmap, 0) / tf.math.reduce_max(heatmap)
-        return heatmap.numpy()
+    def predict_with_gradcam(self, img_array: np.ndarray, last_conv_layer_name: str = GRADCAM_LAYER_NAME) -> Tuple[int, float, np.ndarray, np.ndarray]:
+        """
+        Predice la classe e calcola la heatmap Grad-CAM con un solo forward e un solo backward pass,
+        evitando di eseguire due volte la ResNet50 come con `predict_class` + `generate_gradcam`.
 
+        Args:
+            img_array: Array preprocessato dell'immagine.
+            last_conv_layer_name: Nome dell'ultimo strato convoluzionale nel modello.
 
-    def generate_gradcam(self, img_array: np.ndarray, predicted_class: int, img_rgb: np.ndarray) -> np.ndarray:
+        Returns:
+            Tuple[int, float, np.ndarray, np.ndarray]:
+                - Classe predetta (indice della classe).
+                - Fiducia associata alla classe predetta.
+                - Heatmap Grad-CAM normalizzata come array 2D.
+                - Probabilità di tutte le classi.
         """
-        Genera l'immagine Grad-CAM sovrapponendo la heatmap sull'immagine originale.
+        preds, heatmaps = self._gradcam_pass(img_array, last_conv_layer_name)
+        probabilities = preds[0].numpy()
+        predicted_class = int(np.argmax(probabilities))
+        confidence = float(probabilities[predicted_class])
+        return predicted_class, confidence, heatmaps[0].numpy(), probabilities
+
+
+    def predict_with_gradcam_batch(self, img_batch: np.ndarray, last_conv_layer_name: str = GRADCAM_LAYER_NAME) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Versione batch di `predict_with_gradcam`: un forward e un backward pass per l'intero batch.
+
+        Args:
+            img_batch: Batch di immagini preprocessate (N, H, W, 3) con la stessa risoluzione.
+            last_conv_layer_name: Nome dell'ultimo strato convoluzionale nel modello.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]:
+                - Probabilità delle classi per ogni immagine (N, num_classi).
+                - Heatmap Grad-CAM normalizzate per ogni immagine (N, h, w).
+        """
+        preds, heatmaps = self._gradcam_pass(img_batch, last_conv_layer_name)
+        return preds.numpy(), heatmaps.numpy()
+
+
+    def predict_with_gradcam_all_classes(self, img_array: np.ndarray, last_conv_layer_name: str = GRADCAM_LAYER_NAME) -> Tuple[int, float, np.ndarray, np.ndarray]:
+        """
+        Predice la classe e calcola le heatmap Grad-CAM di tutte le classi con un solo forward pass
+        (invece di un forward e un backward pass per ogni classe con `make_gradcam_heatmap`).
 
         Args:
             img_array: Array preprocessato dell'immagine.
-            predicted_class: Classe predetta utilizzata per generare la heatmap.
-            img_rgb: Immagine RGB equalizzata.
+            last_conv_layer_name: Nome dell'ultimo strato convoluzionale nel modello.
+
+        Returns:
+            Tuple[int, float, np.ndarray, np.ndarray]:
+                - Classe predetta (indice della classe).
+                - Fiducia associata alla classe predetta.
+                - Heatmap Grad-CAM normalizzate di tutte le classi (num_classi, h, w).
+                - Probabilità di tutte le classi.
+        """
+        all_class_gradcam_fn = self._get_all_class_gradcam_fn(last_conv_layer_name)
+        preds, heatmaps = all_class_gradcam_fn(tf.convert_to_tensor(img_array, dtype=tf.float32))
+        probabilities = preds[0].numpy()
+        predicted_class = int(np.argmax(probabilities))
+        return predicted_class, float(probabilities[predicted_class]), heatmaps[0].numpy(), probabilities
+
+
+    @staticmethod
+    def load_display_image(data: bytes) -> np.ndarray:
+        """
+        Decodifica ed equalizza un'immagine salvata, come fa `preprocess_image` per la visualizzazione.
+
+        Args:
+            data: Contenuto del file immagine.
+
+        Returns:
+            np.ndarray: Immagine equalizzata in scala di grigi a risoluzione originale.
+        """
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            raise ValueError("Impossibile decodificare l'immagine")
+        cv2.equalizeHist(img, dst=img)
+        return img
+
+
+    @staticmethod
+    def overlay_heatmap(heatmap: np.ndarray, img_rgb: np.ndarray) -> np.ndarray:
+        """
+        Sovrappone una heatmap Grad-CAM all'immagine originale.
+
+        Args:
+            heatmap: Heatmap Grad-CAM normalizzata come array 2D.
+            img_rgb: Immagine equalizzata, RGB o in scala di grigi.
 
         Returns:
             np.ndarray: Immagine Grad-CAM risultante con heatmap sovrapposta.
         """
-        heatmap = self.make_gradcam_heatmap(img_array, "conv5_block3_out", pred_index=predicted_class)
+        if img_rgb.ndim == 2:
+            img_rgb = cv2.cvtColor(img_rgb, cv2.COLOR_GRAY2RGB)
         heatmap = np.uint8(255 * heatmap)
         heatmap = cv2.resize(heatmap, (img_rgb.shape[1], img_rgb.shape[0]))
         heatmap = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
         return cv2.addWeighted(img_rgb, 0.6, heatmap, 0.4, 0)
+
+
+    def generate_gradcam(self, img_array: np.ndarray, predicted_class: int, img_rgb: np.ndarray) -> np.ndarray:
+        """
+        Genera l'immagine Grad-CAM sovrapponendo la heatmap sull'immagine originale.
+
+        Args:
+            img_array: Array preprocessato dell'immagine.
+            predicted_class: Classe predetta utilizzata per generare la heatmap.
+            img_rgb: Immagine equalizzata, RGB o in scala di grigi.
+
+        Returns:
+            np.ndarray: Immagine Grad-CAM risultante con heatmap sovrapposta.
+        """
+        heatmap = self.make_gradcam_heatmap(img_array, GRADCAM_LAYER_NAME, pred_index=predicted_class)
+        return self.overlay_heatmap(heatmap, img_rgb)
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Optional, Dict, Any, BinaryIO
+
+@dataclass
+class CachedPrediction:
+    """Risultato di una predizione già calcolata."""
+    predicted_class: int
+    confidence: float
+    gradcam_image: bytes
+    gradcam_format: str = 'png'
+
+class PredictionCache:
+    """
+    Cache LRU dei risultati di /predict, indicizzata dall'hash del contenuto caricato e dalla
+    versione del modello. Un livello in memoria è affiancato da un livello opzionale su disco.
+    """
+
+    def __init__(self, max_entries: int = 256, disk_dir: Optional[str] = None, disk_max_entries: int = 4096):
+        """
+        Inizializza la cache.
+
+        Args:
+            max_entries: Numero massimo di risultati tenuti in memoria.
+            disk_dir: Cartella del livello su disco (None per disabilitarlo).
+            disk_max_entries: Numero massimo di risultati tenuti su disco.
+        """
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self._entries: "OrderedDict[str, CachedPrediction]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+
+    @staticmethod
+    def hash_file(file: BinaryIO, chunk_size: int = 1024 * 1024) -> str:
+        """
+        Calcola lo SHA-256 del contenuto di un file a blocchi, riportandolo poi all'inizio.
+
+        Args:
+            file: File binario caricato.
+            chunk_size: Dimensione dei blocchi letti.
+
+        Returns:
+            str: Digest esadecimale del contenuto.
+        """
+        digest = hashlib.sha256()
+        file.seek(0)
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+        file.seek(0)
+        return digest.hexdigest()
+
+
+    @staticmethod
+    def _key(content_hash: str, model_version: Optional[str]) -> str:
+        return f"{content_hash}-{model_version or 'unknown'}"
+
+
+    def get(self, content_hash: str, model_version: Optional[str]) -> Optional[CachedPrediction]:
+        """
+        Cerca un risultato in memoria e, se assente, su disco.
+
+        Args:
+            content_hash: Hash del contenuto caricato.
+            model_version: Versione del modello che ha prodotto il risultato.
+
+        Returns:
+            Optional[CachedPrediction]: Risultato trovato, o None.
+        """
+        key = self._key(content_hash, model_version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry
+
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self._misses += 1
+                return None
+            self._disk_hits += 1
+            self._store(key, entry)
+        return entry
+
+
+    def put(self, content_hash: str, model_version: Optional[str], entry: CachedPrediction) -> None:
+        """
+        Salva un risultato in memoria e, se configurato, su disco.
+
+        Args:
+            content_hash: Hash del contenuto caricato.
+            model_version: Versione del modello che ha prodotto il risultato.
+            entry: Risultato da salvare.
+        """
+        key = self._key(content_hash, model_version)
+        with self._lock:
+            self._store(key, entry)
+        self._write_disk(key, entry)
+
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Restituisce le statistiche della cache.
+
+        Returns:
+            Dict[str, Any]: Numero di elementi, hit (in memoria e su disco) e miss.
+        """
+        with self._lock:
+            lookups = self._hits + self._disk_hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'disk_enabled': bool(self.disk_dir),
+                'hits': self._hits,
+                'disk_hits': self._disk_hits,
+                'misses': self._misses,
+                'hit_rate': (self._hits + self._disk_hits) / lookups if lookups else 0.0
+            }
+
+
+    def _store(self, key: str, entry: CachedPrediction) -> None:
+        """
+        Inserisce un elemento nel livello in memoria, eliminando i meno recenti (da chiamare con il lock).
+        """
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+    def _read_disk(self, key: str) -> Optional[CachedPrediction]:
+        """
+        Legge un elemento dal livello su disco.
+        """
+        if not self.disk_dir:
+            return None
+        base_path = os.path.join(self.disk_dir, key)
+        try:
+            with open(f"{base_path}.json", 'r') as f:
+                metadata = json.load(f)
+            with open(f"{base_path}.img", 'rb') as f:
+                gradcam_image = f.read()
+            os.utime(f"{base_path}.json")
+            return CachedPrediction(
+                metadata['predicted_class'], metadata['confidence'],
+                gradcam_image, metadata.get('gradcam_format', 'png')
+            )
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+    def _write_disk(self, key: str, entry: CachedPrediction) -> None:
+        """
+        Scrive un elemento nel livello su disco ed elimina i più vecchi oltre il limite.
+        """
+        if not self.disk_dir:
+            return
+        base_path = os.path.join(self.disk_dir, key)
+        try:
+            # L'immagine viene scritta prima dei metadati: un .json presente implica un elemento completo
+            with open(f"{base_path}.img", 'wb') as f:
+                f.write(entry.gradcam_image)
+            metadata = {k: v for k, v in asdict(entry).items() if k != 'gradcam_image'}
+            with open(f"{base_path}.json.tmp", 'w') as f:
+                json.dump(metadata, f)
+            os.replace(f"{base_path}.json.tmp", f"{base_path}.json")
+            self._evict_disk()
+        except OSError as e:
+            print(f"Errore nella scrittura della cache su disco: {str(e)}")
+
+
+    def _evict_disk(self) -> None:
+        """
+        Elimina dal disco gli elementi usati meno di recente oltre `disk_max_entries`.
+        """
+        entries = [
+            entry for entry in os.scandir(self.disk_dir)
+            if entry.name.endswith('.json')
+        ]
+        if len(entries) <= self.disk_max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.disk_max_entries]:
+            base_path = entry.path[:-len('.json')]
+            for path in (entry.path, f"{base_path}.img"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass